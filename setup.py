@@ -17,7 +17,7 @@ setup(
     long_description=long_description,
     long_description_content_type='text/markdown; charset=UTF-8',
 
-    python_requires=">=3.5",
+    python_requires=">=3.7",
 
     url='https://github.com/CN-TU/py-virtnet',
 
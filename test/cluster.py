@@ -0,0 +1,46 @@
+"""Example file for testing
+
+This spreads a line of routers over two stand-in workers on this machine and connects to a
+host on the last router from a host on the first one through the tunnel between the workers.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import virtnet
+import virtnet.cluster
+
+SPEC = {
+    'networks': {'lan0': {'network': '10.0.0.0/24', 'router': 1},
+                 'lan1': {'network': '10.0.1.0/24', 'router': 1}},
+    'switches': {'r0s': {'network': 'lan0'}, 'r1s': {'network': 'lan1'}},
+    'routers': {'r0': {}, 'r1': {}},
+    'hosts': {'h0': {}, 'h1': {}},
+    'links': [
+        {'from': 'r0', 'to': 'r0s', 'name': 'eth0'},
+        {'from': 'h0', 'to': 'r0s', 'name': 'eth0'},
+        {'from': 'r1', 'to': 'r1s', 'name': 'eth0'},
+        {'from': 'h1', 'to': 'r1s', 'name': 'eth0'},
+        {'from': 'r0', 'to': 'r1', 'name': 'eth1', 'peername': 'eth1',
+         'addresses': ['10.128.0.1/30'], 'peer_addresses': ['10.128.0.2/30']},
+    ],
+}
+
+CONNECT = """
+import socket
+try:
+    socket.create_connection(('10.0.1.2', 9), timeout=3)
+except ConnectionRefusedError:
+    print('reached 10.0.1.2')
+"""
+
+def run(vnet):
+    "Main functionality"
+    with virtnet.cluster.Cluster(virtnet.cluster.local_workers(vnet, 2)) as cluster:
+        cluster.build(SPEC)
+        print(cluster.owner)
+        print(cluster.run("h0", [sys.executable, "-c", CONNECT])['stdout'])
+        input("Done")
+
+with virtnet.Manager() as context:
+    run(context)
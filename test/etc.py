@@ -0,0 +1,65 @@
+"""Example file for testing
+
+This checks the mount and UTS namespaces of hosts: files written with host.etc are seen by
+processes of the host, but not by other hosts or the machine, processes started with Popen see
+the hostname and /sys of the host, and a stopped and restarted host starts with fresh files.
+Fails with a list of the failed checks. Needs root.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import subprocess
+import virtnet
+from virtnet import mountns
+
+def output(host, cmd):
+    "Return the stripped output of cmd run inside host"
+    return host.Popen(cmd, stdout=subprocess.PIPE).communicate()[0].decode().strip()
+
+def run(vnet):
+    "Main functionality"
+    failed = []
+    def check(name, ok):
+        print("{}: {}".format(name, "ok" if ok else "FAILED"))
+        if not ok:
+            failed.append(name)
+
+    switch = vnet.Switch("etcsw", network=vnet.Network("10.0.0.0/24"))
+    hosts = [vnet.Host("etchost{}".format(i)) for i in range(2)]
+    for host in hosts:
+        host.connect(vnet.VirtualLink, switch, "eth0")
+    vnet.update_hosts()
+
+    check("hostname", output(hosts[0], ["hostname"]) == hosts[0].name)
+    check("/sys of the host", output(hosts[0], ["ls", "/sys/class/net"]).split() == ["eth0", "lo"])
+    check("hosts file", "etchost1" in output(hosts[0], ["cat", "/etc/hosts"]))
+    check("hosts file of the machine", "etchost1" not in open("/etc/hosts").read())
+
+    hosts[0].etc["resolv.conf"] = "nameserver 10.0.0.53\n"
+    check("replaced file", output(hosts[0], ["cat", "/etc/resolv.conf"]) ==
+          "nameserver 10.0.0.53")
+    check("replaced file of other hosts", "10.0.0.53" not in
+          output(hosts[1], ["cat", "/etc/resolv.conf"]))
+    hosts[0].etc["resolv.conf"] = "nameserver 10.0.0.54\n"
+    check("rewritten file", hosts[0].etc["resolv.conf"] == b"nameserver 10.0.0.54\n" and
+          output(hosts[0], ["cat", "/etc/resolv.conf"]) == "nameserver 10.0.0.54")
+    if mountns.overlay():
+        hosts[0].etc["virtnet-test/new"] = "new"
+        check("new file", output(hosts[0], ["cat", "/etc/virtnet-test/new"]) == "new")
+        check("new file of the machine", not os.path.exists("/etc/virtnet-test"))
+
+    hosts[0].stop()
+    hosts[0].start()
+    check("hostname after restart", output(hosts[0], ["hostname"]) == hosts[0].name)
+    check("fresh files after restart", "10.0.0.54" not in
+          output(hosts[0], ["cat", "/etc/resolv.conf"]))
+
+    if failed:
+        print("failed: {}".format(", ".join(failed)))
+        return 1
+    return 0
+
+with virtnet.Manager() as context:
+    RESULT = run(context)
+sys.exit(RESULT)
@@ -0,0 +1,32 @@
+"""Example file for testing
+
+This builds a fat-tree with the topology generators and reports how long building took.
+Use the first argument to set k (default 4) and the second one to build with that many processes.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import time
+import virtnet
+
+def run(vnet, k, shards):
+    "Main functionality"
+    start = time.monotonic()
+    topology = virtnet.generators.fat_tree(vnet, k, shards=shards)
+    duration = time.monotonic() - start
+    namespaces = len(topology.spec['hosts']) + len(topology.spec['routers'])
+    print("k={} namespaces={} links={} build={:.2f}s ({:.1f}ms per namespace)".format(
+        k, namespaces, len(topology.links), duration, duration*1000/namespaces))
+
+    vnet.update_hosts()
+    first, last = sorted(topology.spec['hosts'])[::len(topology.spec['hosts'])-1]
+    with topology[first].Popen(["traceroute", last]):
+        pass
+    input("Done")
+
+# worker processes import this file again
+if __name__ == '__main__':
+    with virtnet.Manager() as context:
+        run(context, int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+            int(sys.argv[2]) if len(sys.argv) > 2 else None)
@@ -0,0 +1,43 @@
+"""Example file for testing
+
+This measures how long `import virtnet` takes in a fresh interpreter and fails if the best of
+several runs exceeds a budget in milliseconds (first argument, default 100). It also checks
+that pyroute2 is not imported until a virtnet object is used. Doesn't need root.
+"""
+
+import sys, os
+ROOT = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+
+import subprocess
+
+RUNS = 5
+
+CODE = """
+import sys, time
+start = time.perf_counter()
+import virtnet
+elapsed = time.perf_counter() - start
+print(elapsed, 'pyroute2' in sys.modules)
+"""
+
+def measure():
+    "Return the import time in seconds and whether pyroute2 was imported"
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.run([sys.executable, "-c", CODE], env=env, check=True,
+                            stdout=subprocess.PIPE).stdout.split()
+    return float(output[0]), output[1] == b'True'
+
+def run(budget):
+    "Main functionality"
+    results = [measure() for _ in range(RUNS)]
+    best = min(elapsed for elapsed, _ in results) * 1000
+    print("import virtnet: {:.1f} ms (budget {:.0f} ms)".format(best, budget))
+    if any(eager for _, eager in results):
+        print("pyroute2 was imported by import virtnet")
+        return 1
+    if best > budget:
+        print("import virtnet exceeds the budget")
+        return 1
+    return 0
+
+sys.exit(run(float(sys.argv[1]) if len(sys.argv) > 1 else 100))
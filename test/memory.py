@@ -0,0 +1,69 @@
+"""Example file for testing
+
+This measures the python side memory footprint of a star topology: hosts connected to one switch.
+It reports bytes per host (including its link) as traced by tracemalloc, and the size of the
+virtnet objects alone, and fails if the virtnet objects exceed a budget in bytes per host and per
+link. Arguments: number of hosts (default 100), host budget (default 1024), link budget (default
+1536).
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import collections
+import gc
+import tracemalloc
+import virtnet
+
+def object_size(obj):
+    "Size of a virtnet object including its attribute containers, but not referenced objects"
+    size = sys.getsizeof(obj)
+    values = []
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+        values.extend(obj.__dict__.values())
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get('__slots__', ()):
+            if name.startswith('__'):
+                name = "_{}{}".format(cls.__name__.lstrip('_'), name)
+            values.append(getattr(obj, name, None))
+    for value in values:
+        # exact types only; pyroute2 objects are dict subclasses owned by pyroute2
+        if type(value) in (set, frozenset, tuple, list, dict, collections.OrderedDict):
+            size += sys.getsizeof(value)
+    return size
+
+def run(vnet, count, host_budget, link_budget):
+    "Main functionality"
+    network = virtnet.Network("10.0.0.0/16", router=1)
+    switch = virtnet.Switch("sw", network=network, manager=vnet)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    hosts = []
+    for i in range(count):
+        host = virtnet.Host("host{}".format(i), manager=vnet)
+        host.connect(virtnet.VirtualLink, switch, "eth0")
+        hosts.append(host)
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    links = [host["eth0"].parent for host in hosts]
+    host_size = sum(object_size(host) for host in hosts) / count
+    link_size = sum(object_size(link) + object_size(link.main) + object_size(link.peer)
+                    for link in links) / len(links)
+    print("hosts={} traced={:.0f} bytes per host with link".format(count, traced / count))
+    print("virtnet objects: {:.0f} bytes per host, {:.0f} bytes per link".format(host_size,
+                                                                                  link_size))
+    if host_size > host_budget or link_size > link_budget:
+        print("virtnet objects exceed the budget of {} bytes per host and {} bytes per link"
+              .format(host_budget, link_budget))
+        return 1
+    return 0
+
+ARGS = [int(arg) for arg in sys.argv[1:]] + [100, 1024, 1536][len(sys.argv) - 1:]
+
+with virtnet.Manager() as context:
+    RESULT = run(context, *ARGS)
+sys.exit(RESULT)
@@ -7,7 +7,6 @@ one switch, and three hosts.
 import sys, os
 sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
 
-import subprocess
 import matplotlib.pyplot as plt
 import virtnet
 
@@ -43,23 +42,11 @@ def run(vnet):
 
     vnet.update_hosts()
 
-    print("Doing ping...")
-
-    with hosts[0].Popen(["ping", "-q", "-c", "1", "host1"], stdout=subprocess.DEVNULL):
-        pass
-
-    res = []
-    pings = 0
-    print(' '*40+'|'+'\b'*41, end='', flush=True)
-    with hosts[0].Popen(["ping", "-c", str(NUMPING), "-i", "0", "host1"], stdout=subprocess.PIPE) as ping:
-        for line in ping.stdout:
-            line = line.rsplit(b'time=', 1)
-            if len(line) != 2:
-                continue
-            pings += 1
-            if not pings%(NUMPING/40):
-                print('.', end='', flush=True)
-            res.append(float(line[1][:-4]))
+    print("Measuring rtt...")
+
+    vnet.measure_rtt([(hosts[0], hosts[1])], count=1)
+    result = vnet.measure_rtt([(hosts[0], hosts[1])], count=NUMPING, interval=0.001)
+    res = np.frombuffer(result[("host0", "host1")].samples)
     plt.plot(x/X*4*SIGMA/1000+DELAY/1000, y/area, label='pdf of setting')
 
     print("Done")
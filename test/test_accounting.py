@@ -0,0 +1,46 @@
+"""Tests for traffic matrices
+
+These don't need root, since the matrices are filled by hand.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import pytest
+from virtnet.accounting import TrafficMatrix
+
+def matrix(names, traffic):
+    "Return a TrafficMatrix with (src, dst): (bytes, packets) from traffic"
+    ret = TrafficMatrix(names)
+    for (src, dst), (sent, packets) in traffic.items():
+        i = ret.index(src, dst)
+        ret.bytes[i], ret.packets[i] = sent, packets
+    return ret
+
+def test_indexing():
+    traffic = matrix(["h0", "h1", "h2"], {("h0", "h2"): (1500, 1), ("h2", "h1"): (300, 3)})
+    assert traffic.index("h0", "h0") == 0
+    assert traffic.index("h1", "h0") == 3
+    assert traffic.index("h2", "h1") == 7
+    assert traffic.get("h0", "h2") == (1500, 1)
+    assert traffic["h2", "h1"] == 300
+    assert traffic["h1", "h2"] == 0
+    assert list(traffic.items()) == [("h0", "h2", 1500, 1), ("h2", "h1", 300, 3)]
+    with pytest.raises(KeyError):
+        traffic.get("h0", "h3")
+
+def test_difference():
+    "Hosts missing in the earlier matrix count from zero, others are left out"
+    before = matrix(["h0", "h1", "old"], {("h0", "h1"): (100, 1), ("old", "h0"): (50, 1)})
+    after = matrix(["h1", "h0", "new"], {("h0", "h1"): (400, 4), ("new", "h0"): (70, 2),
+                                         ("h1", "h0"): (10, 1)})
+    difference = after - before
+    assert difference.names == ["h1", "h0", "new"]
+    assert sorted(difference.items()) == [("h0", "h1", 300, 3), ("h1", "h0", 10, 1),
+                                          ("new", "h0", 70, 2)]
+
+def test_difference_after_reset():
+    "Counters lower than before, e.g. of a restarted Host, don't underflow"
+    before = matrix(["h0", "h1"], {("h0", "h1"): (100, 2)})
+    after = matrix(["h0", "h1"], {("h0", "h1"): (40, 1)})
+    assert list((after - before).items()) == []
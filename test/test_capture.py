@@ -0,0 +1,43 @@
+"""Tests for writing captures
+
+Packets are made up, so no root is needed. The expected blocks are little endian, like the
+writer on such machines.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import io
+import pytest
+from virtnet.capture import PcapngWriter, Packet
+
+pytestmark = pytest.mark.skipif(sys.byteorder != 'little', reason="expects little endian")
+
+# section header block: magic, version 1.0, unknown section length
+SECTION = bytes.fromhex("0a0d0d0a 1c000000 4d3c2b1a 0100 0000 ffffffffffffffff 1c000000")
+# interface description block: ethernet, no snaplen, if_name, if_tsresol 10^-9, end of options
+INTERFACE = bytes.fromhex("01000000 28000000 0100 0000 00000000 0200 0400 65746830"
+                          "0900 0100 09000000 0000 0000 28000000")
+INTERFACE_UNNAMED = bytes.fromhex("01000000 20000000 0100 0000 00000000"
+                                  "0900 0100 09000000 0000 0000 20000000")
+
+def written(interface, packets):
+    "Return the bytes written for packets"
+    output = io.BytesIO()
+    writer = PcapngWriter(output, interface)
+    for packet in packets:
+        writer.write(packet)
+    return output.getvalue()
+
+def test_header():
+    assert written("eth0", []) == SECTION + INTERFACE
+    assert written(None, []) == SECTION + INTERFACE_UNNAMED
+
+def test_packets():
+    "Enhanced packet blocks with the timestamp split in halves and padded data"
+    packets = [Packet(0x100000002, 60, memoryview(b"abcde")), Packet(7, 4, b"wxyz")]
+    assert written("eth0", packets) == SECTION + INTERFACE + bytes.fromhex(
+        "06000000 28000000 00000000 01000000 02000000 05000000 3c000000 6162636465 000000"
+        "28000000"
+        "06000000 24000000 00000000 00000000 07000000 04000000 04000000 7778797a"
+        "24000000")
@@ -0,0 +1,35 @@
+"""Tests for the cluster coordinator
+
+Workers are replaced by plain objects, so no root is needed.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import socketserver
+import pytest
+from virtnet import cluster
+
+class FakeWorker(object):
+    "Worker which records being closed and fails closing if error is given"
+    def __init__(self, error=None):
+        self.error = error
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        if self.error is not None:
+            raise self.error
+
+def test_close_all_workers():
+    "A failing worker doesn't keep the others running"
+    workers = [FakeWorker(OSError("gone")), FakeWorker(), FakeWorker(OSError("broken"))]
+    with pytest.raises(cluster.ClusterException) as info:
+        cluster.Cluster(workers).close()
+    assert all(worker.closed for worker in workers)
+    assert "2 of 3" in str(info.value)
+    assert info.value.__cause__ is workers[0].error
+
+def test_reuse_address_is_local():
+    assert cluster._Server.allow_reuse_address
+    assert not socketserver.TCPServer.allow_reuse_address
@@ -0,0 +1,28 @@
+"""Tests for topology generators
+
+Only the specifications are built, so no root is needed.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import pytest
+from virtnet import generators
+
+@pytest.fixture(autouse=True)
+def spec_only(monkeypatch):
+    "Return the specification instead of building it"
+    monkeypatch.setattr(generators, '_build', lambda manager, builder, *args: builder.spec)
+
+def router_links(spec):
+    "Return the sorted pairs of routers connected by a link"
+    return sorted((link['from'], link['to']) for link in spec['links']
+                  if link['to'] in spec['routers'])
+
+@pytest.mark.parametrize('routers, expected', [
+    (1, []),
+    (2, [("r0", "r1")]),
+    (3, [("r0", "r1"), ("r1", "r2"), ("r2", "r0")]),
+])
+def test_ring(routers, expected):
+    assert router_links(generators.ring(None, routers)) == sorted(expected)
@@ -0,0 +1,30 @@
+"""Tests for the helper process
+
+The helper is forked without entering any namespace, so no root is needed.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import socket
+import pytest
+from virtnet.helper import Helper, Call
+
+def test_call():
+    helper = Helper()
+    try:
+        assert helper.call(os.getpid) != os.getpid()
+        with pytest.raises(ZeroDivisionError):
+            helper.call(divmod, 1, 0)
+    finally:
+        helper.close()
+
+def test_timeout_before_pid():
+    "The timeout also applies while waiting for the process to start"
+    local, remote = socket.socketpair()
+    try:
+        with pytest.raises(TimeoutError):
+            Call(local).result(0.1)
+    finally:
+        local.close()
+        remote.close()
@@ -0,0 +1,67 @@
+"""Tests for saving and loading manifests
+
+The round trip of a running topology needs root and is skipped otherwise.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import json
+import pytest
+import virtnet
+from virtnet import manifest
+
+def test_networks_round_trip(tmp_path):
+    "Networks not used by a switch are kept with their allocations"
+    with virtnet.Manager() as vnet:
+        network = virtnet.Network("10.1.0.0/24", router=1, manager=vnet)
+        network.take(3)
+        virtnet.Network("fd00::/64", manager=vnet)
+        path = str(tmp_path / "manifest.json")
+        vnet.save_manifest(path)
+        with open(path) as manifestfile:
+            data = json.load(manifestfile)
+        vnet.detach()
+    assert data['version'] == manifest.VERSION
+    assert [network['network'] for network in data['networks']] == ["10.1.0.0/24", "fd00::/64"]
+
+    with virtnet.Manager() as vnet:
+        assert vnet.attach(path) == {}
+        loaded = vnet.snapshot_networks()
+        assert [str(network.network) for network in loaded] == ["10.1.0.0/24", "fd00::/64"]
+        assert loaded[0].allocated == 3
+        assert str(loaded[0].router) == "10.1.0.1"
+        assert str(next(loaded[0]).ip) == "10.1.0.5"
+        vnet.detach()
+
+def test_unsupported_version():
+    with virtnet.Manager() as vnet:
+        with pytest.raises(ValueError):
+            vnet.attach({'version': 0, 'containers': [], 'links': []})
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="needs root")
+def test_topology_round_trip(tmp_path):
+    "Containers, links, and addresses are found again after attaching from a new Manager"
+    path = str(tmp_path / "manifest.json")
+    with virtnet.Manager() as vnet:
+        switch = vnet.Switch("mfsw", network=vnet.Network("10.2.0.0/24", router=1))
+        lan = vnet.Network("10.3.0.0/24", router=1)
+        router = vnet.Router("mfr0")
+        router.connect(virtnet.VirtualLink, switch, "eth0", manager=vnet)
+        host = vnet.Host("mfh0")
+        host.connect(virtnet.VirtualLink, switch, "eth0", manager=vnet)
+        host.connect(virtnet.VirtualLink, router, "eth1", "eth1", manager=vnet)
+        host["eth1"].add_ip(lan)
+        addresses = set(host["eth0"].addresses)
+        vnet.save_manifest(path)
+        vnet.detach()
+
+    with virtnet.Manager() as vnet:
+        containers = vnet.attach(path)
+        assert set(containers) == {"mfsw", "mfr0", "mfh0"}
+        assert set(containers["mfh0"]["eth0"].addresses) == set(addresses)
+        assert containers["mfr0"].router
+        networks = {str(network.network): network for network in vnet.snapshot_networks()}
+        assert set(networks) == {"10.2.0.0/24", "10.3.0.0/24"}
+        assert networks["10.3.0.0/24"].allocated == 1
+        assert containers["mfsw"].networks == (networks["10.2.0.0/24"],)
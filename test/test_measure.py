@@ -0,0 +1,29 @@
+"""Tests for round trip measurements
+
+Only the encoding of echo requests is tested, which needs no root.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import struct
+import pytest
+from virtnet.measure import _checksum, _ICMP, _ICMP_ECHO_REQUEST
+
+@pytest.mark.parametrize('data, expected', [
+    # example of RFC 1071, section 3
+    (bytes.fromhex("0001f203f4f5f6f7"), b'\x22\x0d'),
+    # echo request with identifier 1 and sequence number 1
+    (bytes.fromhex("0800000000010001"), b'\xf7\xfd'),
+    # odd length is padded with a zero byte
+    (b'\x01', b'\xfe\xff'),
+    (b'', b'\xff\xff'),
+])
+def test_checksum(data, expected):
+    assert struct.pack("!H", _checksum(data)) == expected
+
+def test_checksum_verifies():
+    "The sum over a packet including its checksum is zero"
+    packet = _ICMP.pack(_ICMP_ECHO_REQUEST, 0, 0, 0x1234, 0xfedc) + b"payload"
+    packet = _ICMP.pack(_ICMP_ECHO_REQUEST, 0, _checksum(packet), 0x1234, 0xfedc) + b"payload"
+    assert _checksum(packet) == 0
@@ -0,0 +1,48 @@
+"""Tests for the namespace worker
+
+Functions are run in the namespace of the worker itself (name None), so no root is needed.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import threading
+from virtnet import netns
+
+def run(func, callback):
+    "Queue func in the home namespace of the worker"
+    netns._worker().put(None, func, (), {}, callback)
+
+def call(func):
+    "Run func in the home namespace of the worker and return the result, failing after 5s"
+    done = threading.Event()
+    ret = []
+    def callback(result, error):
+        ret.extend((result, error))
+        done.set()
+    run(func, callback)
+    assert done.wait(5), "the worker is stuck"
+    result, error = ret
+    if error is not None:
+        raise error
+    return result
+
+def test_failing_callback():
+    "The worker keeps serving after a callback raised"
+    called = threading.Event()
+    def callback(result, error):
+        called.set()
+        raise RuntimeError("callback failed")
+    run(lambda: 1, callback)
+    assert called.wait(5)
+    assert call(lambda: 42) == 42
+
+def test_error_is_raised():
+    def fail():
+        raise ValueError("failed")
+    try:
+        call(fail)
+    except ValueError as err:
+        assert str(err) == "failed"
+    else:
+        assert False, "the error was not raised"
@@ -0,0 +1,52 @@
+"""Tests for encoding qdiscs
+
+None of these need root, since nothing is sent to the kernel.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import pickle
+import pytest
+from virtnet import qdisc
+from virtnet.qdisc import NetemProfile
+
+PARAMS = {'delay': 100000, 'jitter': 10000, 'loss': 1.5, 'limit': 1000}
+# density of the delay, i.e. a triangle
+DIST = [1, 2, 3, 4, 3, 2, 1]
+
+def test_profile_equality():
+    "Profiles with the same parameters are equal and hash the same"
+    profile = NetemProfile(**PARAMS)
+    assert profile == NetemProfile(**PARAMS)
+    assert hash(profile) == hash(NetemProfile(**PARAMS))
+    assert profile != NetemProfile(**dict(PARAMS, loss=2))
+    assert len({profile, NetemProfile(**PARAMS), NetemProfile(delay=1000)}) == 2
+
+def test_profile_pickle():
+    profile = NetemProfile(dist=DIST, **PARAMS)
+    loaded = pickle.loads(pickle.dumps(profile))
+    assert loaded == profile
+    assert loaded.params == profile.params
+
+@pytest.mark.parametrize('command', ['add', 'change', 'replace'])
+@pytest.mark.parametrize('params', [{}, {'handle': '1:'}, {'handle': '1:', 'parent': '10:1'}])
+def test_profile_request(command, params):
+    "The precomputed request matches encoding the message of netem with the same parameters"
+    profile = NetemProfile(**PARAMS)
+    expected = qdisc.encode(qdisc.message(3, 'netem', dict(PARAMS, **params)), command)
+    assert qdisc.request(3, profile, params, command) == expected
+    assert qdisc.encode(profile.message(3, **params), command) == expected
+
+@pytest.mark.parametrize('params', [{'loss': 101}, {'limit': -1}, {'loss': 'high'},
+                                    {'limit': None}, {'dist': 5}, {'bandwidth': 1}])
+def test_profile_invalid(params):
+    with pytest.raises(ValueError):
+        NetemProfile(**params)
+
+def test_profile_repr():
+    "The distribution table is abbreviated, but still tells profiles apart"
+    first = repr(NetemProfile(delay=1000, dist=DIST))
+    second = repr(NetemProfile(delay=1000, dist=DIST[::-1] + [1]))
+    assert first.startswith("NetemProfile(delay=1000, dist=<7 values")
+    assert first != second
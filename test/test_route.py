@@ -0,0 +1,44 @@
+"""Tests for aggregating routes
+
+These don't need root, since only prefixes are summarized.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+from ipaddress import ip_network
+from virtnet.host import _aggregate
+
+HOP = (("10.0.0.1", None),)
+OTHER = (("10.0.0.2", None),)
+
+def nets(*prefixes):
+    "Return the networks of prefixes"
+    return [ip_network(prefix) for prefix in prefixes]
+
+def test_adjacent():
+    routes = dict.fromkeys(nets("10.1.0.0/24", "10.1.1.0/24"), HOP)
+    assert _aggregate(routes, []) == {ip_network("10.1.0.0/23"): HOP}
+
+def test_different_hops():
+    "Prefixes with different next hops are not summarized"
+    routes = {ip_network("10.1.0.0/24"): HOP, ip_network("10.1.1.0/24"): OTHER}
+    assert _aggregate(routes, []) == routes
+
+def test_filler():
+    "Covered prefixes fill gaps, but get no route themselves"
+    routes = dict.fromkeys(nets("10.1.0.0/24", "10.1.1.0/24", "10.1.2.0/24"), HOP)
+    assert _aggregate(routes, nets("10.1.3.0/24")) == {ip_network("10.1.0.0/22"): HOP}
+    assert _aggregate({}, nets("10.1.3.0/24")) == {}
+
+def test_overlap():
+    "Summaries overlapping a covered prefix are kept only if they are less specific"
+    routes = dict.fromkeys(nets("10.1.0.0/24"), HOP)
+    assert _aggregate(routes, nets("10.1.0.0/25")) == {ip_network("10.1.0.0/24"): HOP}
+    assert _aggregate(routes, nets("10.1.0.0/16")) == {}
+
+def test_exclusion():
+    "Without the prefix of a prohibited interface, nothing bridges the gap"
+    routes = dict.fromkeys(nets("10.1.0.0/24", "10.1.1.0/24", "10.1.2.0/24"), HOP)
+    assert _aggregate(routes, []) == {ip_network("10.1.0.0/23"): HOP,
+                                      ip_network("10.1.2.0/24"): HOP}
@@ -0,0 +1,31 @@
+"""Tests for the messages the scheduler encodes in advance
+
+Nothing is sent to the kernel, so no root is needed.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import struct
+import pytest
+from virtnet.scheduler import _link_message
+
+RTM_NEWLINK = 16
+# NLM_F_REQUEST | NLM_F_ACK
+FLAGS = 5
+IFF_UP = 1
+IFLA_MASTER = 10
+
+def newlink(index, flags=0, change=0, attrs=b''):
+    "Return RTM_NEWLINK laid out after struct nlmsghdr and struct ifinfomsg"
+    body = struct.pack("=BBHiII", 0, 0, 0, index, flags, change) + attrs
+    return struct.pack("=IHHII", 16 + len(body), RTM_NEWLINK, FLAGS, 0, 0) + body
+
+@pytest.mark.parametrize('attrs, expected', [
+    ({'up': True}, newlink(7, IFF_UP, IFF_UP)),
+    ({'up': False}, newlink(7, 0, IFF_UP)),
+    ({'master': 0}, newlink(7, attrs=struct.pack("=HHI", 8, IFLA_MASTER, 0))),
+    ({'master': 42}, newlink(7, attrs=struct.pack("=HHI", 8, IFLA_MASTER, 42))),
+])
+def test_link_message(attrs, expected):
+    assert _link_message(7, **attrs) == expected
@@ -0,0 +1,56 @@
+"""Tests for applying topologies
+
+The containers are replaced by plain objects, so no root is needed.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import pytest
+from virtnet.topology import Topology
+
+class FakeTopology(Topology):
+    "Topology creating plain objects, which fails creating the container named fail"
+    def _create_network(self, name, spec):
+        self.networks[name] = object()
+
+    def _create_container(self, kind, name, spec):
+        if name == "fail":
+            raise RuntimeError("creating {} failed".format(name))
+        self.containers[name] = object()
+
+    def _create_link(self, key, spec):
+        self.links[key] = object()
+
+    def _remove_container(self, name):
+        del self.containers[name]
+
+    def _remove_link(self, key):
+        del self.links[key]
+
+SPEC = {
+    "networks": {"lan": {"network": "10.0.0.0/24"}},
+    "switches": {"sw": {"network": "lan"}},
+    "hosts": {"h0": {}, "h1": {}},
+    "links": [{"from": "h0", "to": "sw", "name": "eth0"},
+              {"from": "h1", "to": "sw", "name": "eth0"}],
+}
+
+def test_failed_apply():
+    "After a failing stage, the spec describes what exists and applying again continues"
+    topology = FakeTopology(SPEC, workers=1)
+    h0 = topology["h0"]
+    spec = dict(SPEC, hosts={"h0": {}, "h1": {"hostnames": ["www"]}},
+                routers={"fail": {}})
+    with pytest.raises(RuntimeError):
+        topology.apply(spec)
+    # h1 was changed and is recreated, but creating the router failed before its link
+    assert topology.spec['hosts'] == {"h0": {}, "h1": {"hostnames": ["www"]}}
+    assert topology.spec['routers'] == {}
+    assert list(topology.spec['links']) == [("h0", "eth0")]
+    assert topology["h0"] is h0
+
+    del spec['routers']
+    plan = topology.apply(spec)
+    assert plan.describe() == [["create links eth0 of h1"]]
+    assert sorted(topology.links) == [("h0", "eth0"), ("h1", "eth0")]
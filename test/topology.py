@@ -0,0 +1,42 @@
+"""Example file for testing
+
+This builds a small testnet from a declarative specification and changes it afterwards.
+"""
+
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+import copy
+import virtnet
+
+SPEC = {
+    "networks": {"lan": {"network": "192.168.0.0/24", "router": 1}},
+    "switches": {"sw": {"network": "lan"}},
+    "routers": {"router": {}},
+    "hosts": {"host{}".format(i): {} for i in range(3)},
+    "links": [{"from": "router", "to": "sw", "name": "eth0"}] +
+             [{"from": "host{}".format(i), "to": "sw", "name": "eth0"} for i in range(3)],
+}
+
+def run(vnet):
+    "Main functionality"
+    topology = vnet.Topology(SPEC)
+    vnet.update_hosts()
+
+    with topology["host0"].Popen(["ip", "addr"]):
+        pass
+    print("-"*80)
+
+    spec = copy.deepcopy(SPEC)
+    spec["hosts"]["host3"] = {}
+    spec["links"].append({"from": "host3", "to": "sw", "name": "eth0"})
+    print(topology.plan(spec).describe())
+    topology.apply(spec)
+    vnet.update_hosts()
+
+    with topology["host0"].Popen(["ping", "-c", "1", "host3"]):
+        pass
+    input("Done")
+
+with virtnet.Manager() as context:
+    run(context)
@@ -2,27 +2,61 @@
 
 This library provides some high level functions to easlily setup a local
 network topology with the help of pyroute2
+
+Submodules, and with them pyroute2, are imported on first use of one of their names, so that
+importing virtnet itself is cheap.
 """
 
-import functools
-from . switch import Switch
-from . host import Host, PhysicalHost, Router
-from . interface import VirtualLink, PhysicalInterface
-from . address import Network
-from . container import BaseContainer
+import importlib
 from . context import Manager
 
+# name: module providing it
+_MODULES = {
+    'Switch': 'switch',
+    'Host': 'host',
+    'PhysicalHost': 'host',
+    'Router': 'host',
+    'VirtualLink': 'interface',
+    'PhysicalInterface': 'interface',
+    'Network': 'address',
+    'BaseContainer': 'container',
+    'Topology': 'topology',
+    'NetemProfile': 'qdisc',
+}
+
+_SUBMODULES = ['generators']
+
+def __getattr__(name):
+    if name in _MODULES:
+        value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES) | set(_SUBMODULES))
+
 def _make_creator(obj):
-    creator = globals()[obj]
-    @functools.wraps(creator)
+    # the class is looked up on the first call, which imports its module, and then provides the
+    # documentation and signature like functools.wraps
     def create(self, *args, **kwargs):
-        "Create a new object with the manager as first argument"
+        creator = globals().get(obj) or __getattr__(obj)
+        if not hasattr(create, '__wrapped__'):
+            create.__doc__ = creator.__doc__
+            create.__wrapped__ = creator
         return creator(*args, **kwargs, manager=self)
+    create.__name__ = obj
+    create.__qualname__ = 'Manager.' + obj
+    create.__doc__ = "Create a new {} with this manager".format(obj)
     return create
 
-_OBJECTS = ['Switch', 'Host', 'PhysicalHost', 'Router', 'VirtualLink', 'PhysicalInterface', 'Network']
+_OBJECTS = ['Switch', 'Host', 'PhysicalHost', 'Router', 'VirtualLink', 'PhysicalInterface', 'Network',
+            'Topology']
 
 for _obj in _OBJECTS:
     setattr(Manager, _obj, _make_creator(_obj))
 
-__all__ = _OBJECTS + ['Manager']
+__all__ = _OBJECTS + ['Manager', 'NetemProfile']
@@ -0,0 +1,335 @@
+"""Accounting module.
+
+This module counts the traffic between every pair of Hosts (including Routers) with nftables
+counters. Every Host gets a table 'virtnet' with a set of destination addresses per IP version,
+whose elements carry a counter each, and a chain on the output hook with one rule per IP version
+looking up the destination in the set. The rules never change; counters for other Hosts are
+added as set elements. Only traffic originating in a Host is counted, so forwarded traffic shows
+up once, at its source, with the final destination.
+
+Counters are installed by sync, which Topology.apply calls after building, and by refresh for
+Hosts and addresses which showed up since. Every change is one transaction with an
+acknowledgement for every message, so errors of the kernel are raised instead of lost. refresh
+reads all counters of a Host with one dump per IP version and returns them as a TrafficMatrix.
+
+Counters of set elements need Linux 5.11 or later.
+"""
+
+from typing import Dict, List, Tuple, Iterator, Optional
+import array
+import collections
+import os
+import threading
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_ACK, NLM_F_CREATE
+from pyroute2.netlink.nfnetlink import nfgen_msg, NFNL_SUBSYS_NFTABLES
+from pyroute2.netlink.nfnetlink.nftsocket import (
+    nft_table_msg, nft_chain_msg, nft_rule_msg, nft_set_msg, nft_set_elem_list_msg,
+    NFT_MSG_NEWTABLE, NFT_MSG_DELTABLE, NFT_MSG_NEWCHAIN, NFT_MSG_NEWRULE, NFT_MSG_NEWSET,
+    NFT_MSG_GETSET, NFT_MSG_NEWSETELEM, NFT_MSG_GETSETELEM)
+from pyroute2.netns import NETNS_RUN_DIR
+from pyroute2.nftables.main import NFTables
+from pyroute2.nftables.expressions import genex
+
+TABLE = 'virtnet'
+CHAIN = 'accounting'
+
+NFPROTO_INET = 1
+NFT_META_NFPROTO = 15
+NFT_PAYLOAD_NETWORK_HEADER = 1
+NF_ACCEPT = 1
+NFNL_MSG_BATCH_BEGIN = 0x10
+NFNL_MSG_BATCH_END = 0x11
+
+# ip version: (nfproto, offset of the destination address, address length, nft type, set name)
+DESTINATION = {4: (2, 16, 4, 7, 'ipv4'), 6: (10, 24, 16, 8, 'ipv6')}
+
+def _expression(name: str, **kwargs) -> dict:
+    return genex(name, collections.OrderedDict(sorted(kwargs.items())))
+
+def _namespace(name: str) -> Tuple[str, int, int]:
+    """Return the identity of the network namespace of host name, which changes on restart"""
+    stat = os.stat(os.path.join(NETNS_RUN_DIR, name))
+    return name, stat.st_dev, stat.st_ino
+
+def _version(address: bytes) -> int:
+    return 4 if len(address) == 4 else 6
+
+def _rule(version: int) -> List[dict]:
+    """Return the expressions counting packets to addresses of version in the set"""
+    nfproto, offset, length, _, name = DESTINATION[version]
+    return [
+        _expression('meta', dreg=1, key=NFT_META_NFPROTO),
+        _expression('cmp', sreg=1, op=0,
+                    data={'attrs': [('NFTA_DATA_VALUE', bytes([nfproto]))]}),
+        _expression('payload', dreg=1, base=NFT_PAYLOAD_NETWORK_HEADER, offset=offset,
+                    len=length),
+        # the lookup updates the counter of the element found
+        _expression('lookup', sreg=1, set=name),
+    ]
+
+def _key(address: bytes) -> dict:
+    return {'attrs': [('NFTA_SET_ELEM_KEY', {'attrs': [('NFTA_DATA_VALUE', address)]})]}
+
+# pyroute2 expects lists of expressions for both, the kernel a single one
+class _SetMessage(nft_set_msg):
+    nla_map = tuple((name, 'nft_expr') if name == 'NFTA_SET_EXPR' else (name, kind)
+                    for name, kind in nft_set_msg.nla_map)
+
+class _ElementsMessage(nft_set_elem_list_msg):
+    class set_elem(nft_set_elem_list_msg.set_elem): # pylint: disable=invalid-name
+        nla_map = tuple((name, 'nft_expr') if name == 'NFTA_SET_ELEM_EXPR' else (name, kind)
+                        for name, kind in nft_set_elem_list_msg.set_elem.nla_map)
+
+Request = Tuple[type, int, List[Tuple[str, object]]]
+
+class _Socket(NFTables):
+    """NFTables with acknowledged transactions and counters of set elements"""
+    policy = dict(NFTables.policy)
+    policy.update({NFT_MSG_NEWSET: _SetMessage, NFT_MSG_GETSET: _SetMessage,
+                   NFT_MSG_NEWSETELEM: _ElementsMessage, NFT_MSG_GETSETELEM: _ElementsMessage})
+
+    def transaction(self, requests: List[Request]) -> None:
+        """Send requests as (message class, message type, attributes) in one transaction and
+        wait for the acknowledgement of every request.
+
+        Raises:
+            NetlinkError: If the kernel refused a request, then nothing was changed.
+            RuntimeError: If an acknowledgement is missing.
+        """
+        seqs = [self.addr_pool.alloc() for _ in range(len(requests) + 2)]
+        data = b''
+        for seq, (msg_class, msg_type, attrs) in zip(seqs[1:-1], requests):
+            msg = msg_class()
+            msg['attrs'] = attrs
+            msg['nfgen_family'] = self._nfgen_family
+            msg['header']['type'] = (NFNL_SUBSYS_NFTABLES << 8) | msg_type
+            msg['header']['flags'] = NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE
+            msg['header']['sequence_number'] = seq
+            msg.encode()
+            data += msg.data
+        batch = []
+        for seq, msg_type in ((seqs[0], NFNL_MSG_BATCH_BEGIN), (seqs[-1], NFNL_MSG_BATCH_END)):
+            msg = nfgen_msg()
+            msg['res_id'] = NFNL_SUBSYS_NFTABLES
+            msg['header']['type'] = msg_type
+            msg['header']['flags'] = NLM_F_REQUEST
+            msg['header']['sequence_number'] = seq
+            msg.encode()
+            batch.append(msg.data)
+        with self.backlog_lock:
+            for seq in seqs[1:-1]:
+                self.backlog[seq] = []
+        try:
+            self.sendto(batch[0] + data + batch[1], (0, 0))
+            for seq in seqs[1:-1]:
+                if not self.get(msg_seq=seq):
+                    raise RuntimeError("nftables did not acknowledge a request")
+        finally:
+            with self.backlog_lock:
+                for seq in seqs[1:-1]:
+                    self.backlog.pop(seq, None)
+            for seq in seqs:
+                self.addr_pool.free(seq, ban=10)
+
+    def counters(self, name: str) -> Iterator[Tuple[bytes, int, int]]:
+        """Yield (address, bytes, packets) of every element of set name"""
+        msg = _ElementsMessage()
+        msg['attrs'] = [('NFTA_SET_TABLE', TABLE), ('NFTA_SET_ELEM_LIST_SET', name)]
+        for response in self.request_get(msg, NFT_MSG_GETSETELEM):
+            for element in response.get_attr('NFTA_SET_ELEM_LIST_ELEMENTS') or ():
+                counter = _counter(element)
+                if counter is not None:
+                    yield counter
+
+def _counter(element) -> Optional[Tuple[bytes, int, int]]:
+    """Return (address, bytes, packets) of a set element"""
+    key = element.get_attr('NFTA_SET_ELEM_KEY')
+    expression = element.get_attr('NFTA_SET_ELEM_EXPR')
+    if key is None or expression is None or expression.get_attr('NFTA_EXPR_NAME') != 'counter':
+        return None
+    data = expression.get_attr('NFTA_EXPR_DATA')
+    return (key.get_attr('NFTA_DATA_VALUE'), data.get_attr('NFTA_COUNTER_BYTES'),
+            data.get_attr('NFTA_COUNTER_PACKETS'))
+
+def _setup() -> List[Request]:
+    """Return the requests creating an empty table with the sets and rules"""
+    requests = [
+        (nft_table_msg, NFT_MSG_NEWTABLE, [('NFTA_TABLE_NAME', TABLE), ('NFTA_TABLE_FLAGS', 0)]),
+        # start from an empty table, even if counters are left from before
+        (nft_table_msg, NFT_MSG_DELTABLE, [('NFTA_TABLE_NAME', TABLE)]),
+        (nft_table_msg, NFT_MSG_NEWTABLE, [('NFTA_TABLE_NAME', TABLE), ('NFTA_TABLE_FLAGS', 0)]),
+        (nft_chain_msg, NFT_MSG_NEWCHAIN, [
+            ('NFTA_CHAIN_TABLE', TABLE), ('NFTA_CHAIN_NAME', CHAIN),
+            ('NFTA_CHAIN_HOOK', {'attrs': [('NFTA_HOOK_HOOKNUM', 3), ('NFTA_HOOK_PRIORITY', 0)]}),
+            ('NFTA_CHAIN_TYPE', 'filter'), ('NFTA_CHAIN_POLICY', NF_ACCEPT)]),
+    ]
+    for set_id, version in enumerate(sorted(DESTINATION), 1):
+        _, _, length, key_type, name = DESTINATION[version]
+        requests.append((_SetMessage, NFT_MSG_NEWSET, [
+            ('NFTA_SET_TABLE', TABLE), ('NFTA_SET_NAME', name), ('NFTA_SET_FLAGS', 0),
+            ('NFTA_SET_KEY_TYPE', key_type), ('NFTA_SET_KEY_LEN', length),
+            ('NFTA_SET_ID', set_id), ('NFTA_SET_EXPR', _expression('counter', bytes=0, packets=0))]))
+        requests.append((nft_rule_msg, NFT_MSG_NEWRULE, [
+            ('NFTA_RULE_TABLE', TABLE), ('NFTA_RULE_CHAIN', CHAIN),
+            ('NFTA_RULE_EXPRESSIONS', _rule(version))]))
+    return requests
+
+def _elements(addresses: List[bytes]) -> List[Request]:
+    """Return the requests adding counters for addresses"""
+    requests = []
+    for version in sorted(DESTINATION):
+        keys = [_key(address) for address in addresses if _version(address) == version]
+        if keys:
+            requests.append((_ElementsMessage, NFT_MSG_NEWSETELEM, [
+                ('NFTA_SET_TABLE', TABLE), ('NFTA_SET_ELEM_LIST_SET', DESTINATION[version][4]),
+                ('NFTA_SET_ELEM_LIST_ELEMENTS', keys)]))
+    return requests
+
+class TrafficMatrix(object):
+    """Bytes and packets sent from every Host to every other Host.
+
+    Attributes:
+        names: Names of the Hosts, which index rows (source) and columns (destination).
+        bytes: Flat array of len(names)**2 byte counters in row major order.
+        packets: Flat array of len(names)**2 packet counters in row major order.
+    """
+    __slots__ = ('names', 'bytes', 'packets', '__index')
+
+    def __init__(self, names: List[str]) -> None:
+        self.names = list(names)
+        self.__index = {name: i for i, name in enumerate(self.names)}
+        size = len(self.names) ** 2
+        self.bytes = array.array('Q', bytes(8 * size))
+        self.packets = array.array('Q', bytes(8 * size))
+
+    def index(self, src: str, dst: str) -> int:
+        """Return the position of (src, dst) in bytes and packets"""
+        return self.__index[src] * len(self.names) + self.__index[dst]
+
+    def get(self, src: str, dst: str) -> Tuple[int, int]:
+        """Return (bytes, packets) sent from src to dst"""
+        i = self.index(src, dst)
+        return self.bytes[i], self.packets[i]
+
+    def __getitem__(self, pair: Tuple[str, str]) -> int:
+        return self.bytes[self.index(*pair)]
+
+    def items(self) -> Iterator[Tuple[str, str, int, int]]:
+        """Yield (src, dst, bytes, packets) of every pair with traffic"""
+        count = len(self.names)
+        for i, value in enumerate(self.packets):
+            if value:
+                yield self.names[i // count], self.names[i % count], self.bytes[i], value
+
+    def __sub__(self, other: 'TrafficMatrix') -> 'TrafficMatrix':
+        """Return the traffic since the earlier matrix other, e.g. of a test run. Hosts missing
+        in other count from zero."""
+        ret = TrafficMatrix(self.names)
+        count = len(self.names)
+        for i in range(count * count):
+            src, dst = self.names[i // count], self.names[i % count]
+            try:
+                j = other.index(src, dst)
+            except KeyError:
+                ret.bytes[i], ret.packets[i] = self.bytes[i], self.packets[i]
+                continue
+            ret.bytes[i] = max(0, self.bytes[i] - other.bytes[j])
+            ret.packets[i] = max(0, self.packets[i] - other.packets[j])
+        return ret
+
+class Accounting(object):
+    """Traffic counters of every Host of a Manager.
+
+    Args:
+        manager: Manager whose Hosts are counted.
+    """
+    def __init__(self, manager) -> None:
+        self.__manager = manager
+        # keyed by the namespace, so a restarted Host gets a new socket and counters
+        self.__sockets = {} # type: Dict[Tuple[str, int, int], _Socket]
+        self.__installed = {} # type: Dict[Tuple[str, int, int], set]
+        self.__lock = threading.Lock()
+
+    def __hosts(self) -> List:
+        from . host import Host
+        return [obj for obj in self.__manager.snapshot()
+                if isinstance(obj, Host) and obj.running]
+
+    @staticmethod
+    def __addresses(host) -> set:
+        return {address.ip.packed for intf in list(host.interfaces.values())
+                for address in intf.addresses if not address.ip.is_loopback}
+
+    def sync(self) -> None:
+        """Install the counters missing for new Hosts or addresses"""
+        with self.__lock:
+            self.__sync(self.__hosts())
+
+    def __sync(self, hosts: List) -> Tuple[Dict[bytes, str], Dict[str, Tuple[str, int, int]]]:
+        """Install missing counters and return the owner of every address and the namespace of
+        every host"""
+        owners = {}
+        for host in hosts:
+            for address in self.__addresses(host):
+                owners[address] = host.name
+        namespaces = {host.name: _namespace(host.name) for host in hosts}
+        current = set(namespaces.values())
+        for namespace in list(self.__sockets):
+            if namespace not in current:
+                self.__close(namespace)
+        for host in hosts:
+            namespace = namespaces[host.name]
+            installed = self.__installed.get(namespace, set())
+            missing = [address for address, owner in owners.items()
+                       if owner != host.name and address not in installed]
+            if namespace in self.__sockets and not missing:
+                continue
+            # one transaction per host
+            sock = self.__sockets.get(namespace)
+            requests = []
+            if sock is None:
+                sock = host.thread.call(_Socket, nfgen_family=NFPROTO_INET)
+                requests = _setup()
+            requests.extend(_elements(missing))
+            try:
+                sock.transaction(requests)
+            except:
+                if namespace not in self.__sockets:
+                    sock.close()
+                raise
+            self.__sockets[namespace] = sock
+            self.__installed[namespace] = installed
+            installed.update(missing)
+        return owners, namespaces
+
+    def refresh(self) -> TrafficMatrix:
+        """Install missing counters and return the traffic counted so far"""
+        with self.__lock:
+            hosts = self.__hosts()
+            owners, namespaces = self.__sync(hosts)
+            matrix = TrafficMatrix([host.name for host in hosts])
+            for host in hosts:
+                namespace = namespaces[host.name]
+                versions = {_version(address) for address in self.__installed[namespace]}
+                for version in sorted(versions):
+                    counters = self.__sockets[namespace].counters(DESTINATION[version][4])
+                    for address, sent, packets in counters:
+                        if address not in owners:
+                            continue
+                        i = matrix.index(host.name, owners[address])
+                        matrix.bytes[i] += sent
+                        matrix.packets[i] += packets
+            return matrix
+
+    def __close(self, namespace: Tuple[str, int, int]) -> None:
+        self.__installed.pop(namespace, None)
+        sock = self.__sockets.pop(namespace, None)
+        if sock is not None:
+            sock.close()
+
+    def close(self) -> None:
+        """Close the netlink sockets, which would keep the namespaces alive. The counters stay
+        until the Hosts are removed."""
+        with self.__lock:
+            for namespace in list(self.__sockets):
+                self.__close(namespace)
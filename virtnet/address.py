@@ -6,18 +6,24 @@ Todo:
     * Implement like everything!
 """
 
-from typing import Union
+from typing import Union, Iterator, List
 import ipaddress
+import threading
 from . context import Manager
 
 class InterfaceIter(object): #pylint: disable=too-few-public-methods
-    """Iterator over Network returning Interfaces. This works for IPv6 and IPv4."""
+    """Iterator over Network returning Interfaces. This works for IPv6 and IPv4. It can be used
+    from several threads at once."""
+    __slots__ = ('network', 'hosts', 'router', 'allocated', 'lock', '__cls')
+
     def __init__(self,
                  network: Union[ipaddress.IPv4Network, ipaddress.IPv6Network],
                  router: Union[ipaddress.IPv4Address, ipaddress.IPv6Address] = None) -> None:
         self.network = network
         self.hosts = network.hosts()
         self.router = router
+        self.allocated = 0
+        self.lock = threading.RLock()
         if isinstance(network, ipaddress.IPv4Network):
             self.__cls = ipaddress.IPv4Interface
         else:
@@ -27,9 +33,11 @@ class InterfaceIter(object): #pylint: disable=too-few-public-methods
         return self
 
     def __next__(self) -> Union[ipaddress.IPv4Interface, ipaddress.IPv6Interface]:
-        addr = next(self.hosts)
-        if self.router is not None and addr == self.router:
-            addr = next(self.hosts) # skip router
+        with self.lock:
+            addr = next(self.hosts)
+            if self.router is not None and addr == self.router:
+                addr = next(self.hosts) # skip router
+            self.allocated += 1
         return self.__cls((int(addr), self.network.prefixlen))
 
 class Network(object): #pylint: disable=too-few-public-methods
@@ -41,13 +49,37 @@ class Network(object): #pylint: disable=too-few-public-methods
     Attributes:
         network: The ipv4 or ipv6 network
     """
+    __slots__ = ('__network', '__router', '__hosts')
+
     def __init__(self, network: str, router: int = None, manager: Manager = None) -> None:
-        #pylint: disable=unused-argument
         self.__network = ipaddress.ip_network(network)
         self.__router = None
         if router is not None:
             self.__router = self.__network.network_address + router
         self.__hosts = InterfaceIter(self.__network, self.__router)
+        if manager is not None:
+            manager.register_network(self)
+
+    @property
+    def network(self) -> Union[ipaddress.IPv4Network, ipaddress.IPv6Network]:
+        """Return the ipv4 or ipv6 network"""
+        return self.__network
+
+    @property
+    def allocated(self) -> int:
+        """Return the number of addresses handed out so far"""
+        return self.__hosts.allocated
+
+    def take(self, count: int) -> List[Union[ipaddress.IPv4Interface, ipaddress.IPv6Interface]]:
+        """Allocate count consecutive addresses at once"""
+        with self.__hosts.lock:
+            return [next(self.__hosts) for _ in range(count)]
+
+    def skip(self, count: int) -> None:
+        """Skip count addresses, e.g. because they are already in use"""
+        with self.__hosts.lock:
+            for _ in range(count):
+                next(self.__hosts)
 
     @property
     def router(self):
@@ -63,6 +95,12 @@ class Network(object): #pylint: disable=too-few-public-methods
             return ipaddress.IPv4Interface((int(self.router), self.__network.prefixlen))
         return ipaddress.IPv6Interface((int(self.router), self.__network.prefixlen))
 
+    def subnets(self, prefixlen: int, router: int = None,
+                manager: Manager = None) -> Iterator['Network']:
+        """Split this network into Networks with the given prefix length"""
+        for subnet in self.__network.subnets(new_prefix=prefixlen):
+            yield Network(str(subnet), router=router, manager=manager)
+
     def __iter__(self) -> InterfaceIter:
         return self.__hosts
 
@@ -0,0 +1,127 @@
+"""Broadcast module.
+
+This module runs a command on many hosts at once. The output pipes of all processes are read
+by a single selector loop, so no thread per process is needed and no pipe can fill up.
+"""
+
+from typing import Union, Sequence, Callable, Iterator, Tuple, Dict
+import collections
+import os
+import selectors
+import subprocess
+import time
+
+Output = collections.namedtuple('Output', ['host', 'returncode', 'stdout', 'stderr'])
+Output.__doc__ = """Exit code and complete output of a command on host"""
+
+Line = collections.namedtuple('Line', ['host', 'stream', 'data'])
+Line.__doc__ = """Line of output (including the newline) of host on stream 'stdout' or
+'stderr'"""
+
+Command = Union[Sequence[str], Callable[[object], Sequence[str]]]
+
+def _start(hosts, cmd: Command) -> 'collections.OrderedDict[str, subprocess.Popen]':
+    # processes are started one after another, since forking with preexec_fn from several
+    # threads can deadlock; they run concurrently nevertheless
+    processes = collections.OrderedDict()
+    try:
+        for host in hosts:
+            command = cmd(host) if callable(cmd) else cmd
+            processes[host.name] = host.Popen(command, stdin=subprocess.DEVNULL,
+                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except:
+        for process in processes.values():
+            process.kill()
+            process.wait()
+        raise
+    return processes
+
+def _read(processes: Dict[str, subprocess.Popen],
+          timeout: float = None) -> Iterator[Tuple[str, str, bytes]]:
+    """Yield (host, stream, data) chunks until all pipes are closed or timeout is over. Closing
+    of a pipe is signalled with empty data."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    try:
+        for name, process in processes.items():
+            for stream in ('stdout', 'stderr'):
+                pipe = getattr(process, stream)
+                os.set_blocking(pipe.fileno(), False)
+                selector.register(pipe, selectors.EVENT_READ, (name, stream))
+        while selector.get_map():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(list(processes), timeout)
+            for key, _ in selector.select(remaining):
+                try:
+                    data = os.read(key.fd, 1 << 16)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                yield key.data + (data,)
+    finally:
+        selector.close()
+
+def _wait(processes: Dict[str, subprocess.Popen], kill: bool) -> None:
+    for process in processes.values():
+        if kill and process.poll() is None:
+            process.kill()
+        process.wait()
+        for pipe in (process.stdout, process.stderr):
+            pipe.close()
+
+def run_everywhere(hosts, cmd: Command,
+                   timeout: float = None) -> 'collections.OrderedDict[str, Output]':
+    """Run cmd on every host and wait for all of them to finish.
+
+    Args:
+        hosts: Hosts to run the command on.
+        cmd: Command as for Popen, or a function returning the command for a given host.
+        timeout: Time in seconds after which all processes are killed and
+            subprocess.TimeoutExpired is raised.
+
+    Returns:
+        Ordered mapping from host names to Output.
+    """
+    processes = _start(hosts, cmd)
+    buffers = {name: {'stdout': bytearray(), 'stderr': bytearray()} for name in processes}
+    completed = False
+    try:
+        for name, stream, data in _read(processes, timeout):
+            buffers[name][stream] += data
+        completed = True
+    finally:
+        _wait(processes, not completed)
+    return collections.OrderedDict(
+        (name, Output(name, process.returncode, bytes(buffers[name]['stdout']),
+                      bytes(buffers[name]['stderr'])))
+        for name, process in processes.items())
+
+def stream_everywhere(hosts, cmd: Command, timeout: float = None) -> Iterator[Line]:
+    """Run cmd on every host and yield Lines in the order they arrive. Arguments are the same
+    as for run_everywhere. Processes still running are killed, when the generator is closed."""
+    processes = _start(hosts, cmd)
+    partial = collections.defaultdict(bytearray)
+    completed = False
+    try:
+        for name, stream, data in _read(processes, timeout):
+            buffer = partial[(name, stream)]
+            if not data:
+                # pipe closed; emit the unterminated rest
+                if buffer:
+                    yield Line(name, stream, bytes(buffer))
+                del partial[(name, stream)]
+                continue
+            buffer += data
+            end = buffer.rfind(b'\n') + 1
+            if not end:
+                continue
+            lines = bytes(buffer[:end])
+            del buffer[:end]
+            for line in lines.splitlines(keepends=True):
+                yield Line(name, stream, line)
+        completed = True
+    finally:
+        _wait(processes, not completed)
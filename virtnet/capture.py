@@ -0,0 +1,261 @@
+"""Capture module.
+
+This module captures packets from interfaces with a memory mapped TPACKET_V3 ring of an
+AF_PACKET socket. The kernel fills whole blocks of packets, which are handed out as
+memoryviews into the ring, so no data is copied until it is needed.
+
+Packet data is only valid until its Block is released (or the Capture is closed); the
+memoryviews are released with it, so using them afterwards raises ValueError instead of
+reading data the kernel overwrote. Copy data to keep it, e.g. bytes(packet.data).
+"""
+
+from typing import Union, Sequence, Tuple, Iterator, BinaryIO, Optional
+import collections
+import ctypes
+import mmap
+import select
+import socket
+import struct
+import subprocess
+import weakref
+from . import netns
+
+SOL_PACKET = 263
+PACKET_VERSION = 10
+PACKET_RX_RING = 5
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+LINKTYPE_ETHERNET = 1
+
+_REQ3 = struct.Struct("=7I")
+# tpacket_block_desc with tpacket_hdr_v1
+_BLOCK = struct.Struct("=IIIIIIQIIII")
+_BLOCK_STATUS = 8
+# tpacket3_hdr
+_PACKET = struct.Struct("=IIIIIIHH")
+
+Packet = collections.namedtuple('Packet', ['timestamp', 'length', 'data'])
+Packet.__doc__ = """Captured packet with timestamp in ns, original length, and captured data as
+memoryview into the ring, valid until the block is released"""
+
+def compile_filter(expression: str, interface: str = None) -> Sequence[Tuple[int, int, int, int]]:
+    """Compile a tcpdump filter expression to classic BPF with tcpdump -ddd"""
+    command = ["tcpdump", "-ddd"]
+    if interface is not None:
+        command.extend(["-i", interface])
+    output = subprocess.check_output(command + [expression]).split()
+    count = int(output[0])
+    values = [int(value) for value in output[1:]]
+    return [tuple(values[i*4:i*4+4]) for i in range(count)]
+
+class Block(object):
+    """Block of packets inside the ring, which is owned by userspace until released"""
+    def __init__(self, ring: memoryview, offset: int, size: int) -> None:
+        self.__view = ring[offset:offset+size]
+        _, _, _, self.count, first, self.length, self.seq, _, _, _, _ = \
+            _BLOCK.unpack_from(self.__view)
+        self.__first = first
+        self.__views = []
+
+    @property
+    def released(self) -> bool:
+        """True if the block was handed back to the kernel"""
+        return self.__view is None
+
+    @property
+    def data(self) -> memoryview:
+        """The whole block"""
+        return self.__view[:self.length]
+
+    def __iter__(self) -> Iterator[Packet]:
+        offset = self.__first
+        for _ in range(self.count):
+            next_offset, sec, nsec, snaplen, length, _, mac, _ = \
+                _PACKET.unpack_from(self.__view, offset)
+            data = self.__view[offset+mac:offset+mac+snaplen]
+            self.__views.append(data)
+            yield Packet(sec * 1000000000 + nsec, length, data)
+            offset += next_offset
+
+    def release(self) -> None:
+        """Hand the block back to the kernel and release the packet data of this block. Does
+        nothing if the block was released already."""
+        if self.__view is None:
+            return
+        struct.pack_into("=I", self.__view, _BLOCK_STATUS, TP_STATUS_KERNEL)
+        for view in self.__views:
+            try:
+                view.release()
+            except BufferError:
+                # still exported by the caller; the ring stays mapped until it is gone
+                pass
+        self.__views = []
+        self.__view.release()
+        self.__view = None
+
+class Capture(object):
+    """Packet capture on an interface.
+
+    Args:
+        interface: Name of the interface.
+        namespace: Name of the network namespace of the interface, or None for the current one.
+        bpf: Filter as tcpdump expression or as list of (code, jt, jf, k) instructions.
+        block_size: Size of a ring block; must be a multiple of the page size.
+        block_count: Number of blocks in the ring.
+        frame_size: Maximum size of a packet including headers.
+        block_timeout: Time in ms after which a partially filled block is handed to userspace.
+    """
+    def __init__(self, interface: str, namespace: str = None,
+                 bpf: Union[str, Sequence[Tuple[int, int, int, int]]] = None,
+                 block_size: int = 1 << 20, block_count: int = 64, frame_size: int = 1 << 11,
+                 block_timeout: int = 100) -> None:
+        self.interface = interface
+        self.namespace = namespace
+        if namespace is None:
+            self.__sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                        socket.htons(ETH_P_ALL))
+        else:
+            self.__sock = netns.call(namespace, socket.socket, socket.AF_PACKET,
+                                     socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            if bpf is not None:
+                self.attach_filter(bpf)
+            self.__sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            self.__sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _REQ3.pack(
+                block_size, block_count, frame_size, block_size // frame_size * block_count,
+                block_timeout, 0, 0))
+            self.__mmap = mmap.mmap(self.__sock.fileno(), block_size * block_count,
+                                    mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self.__sock.bind((interface, ETH_P_ALL))
+        except:
+            self.__sock.close()
+            raise
+        self.__ring = memoryview(self.__mmap)
+        self.__block_size = block_size
+        self.__block_count = block_count
+        self.__current = 0
+        # blocks handed out and maybe not released yet, which close releases
+        self.__blocks = weakref.WeakSet()
+        self.__poll = select.poll()
+        self.__poll.register(self.__sock, select.POLLIN | select.POLLERR)
+
+    def attach_filter(self, bpf: Union[str, Sequence[Tuple[int, int, int, int]]]) -> None:
+        """Attach a filter given as tcpdump expression or list of (code, jt, jf, k)"""
+        if isinstance(bpf, str):
+            bpf = compile_filter(bpf)
+        instructions = (ctypes.c_ubyte * (8 * len(bpf)))()
+        for i, instruction in enumerate(bpf):
+            struct.pack_into("=HBBI", instructions, i*8, *instruction)
+        program = struct.pack("HL", len(bpf), ctypes.addressof(instructions))
+        self.__sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, program)
+
+    def fileno(self) -> int:
+        """Return the file descriptor of the capture socket, e.g. for selectors"""
+        return self.__sock.fileno()
+
+    def _ready(self) -> bool:
+        offset = self.__current * self.__block_size
+        return bool(struct.unpack_from("=I", self.__ring, offset + _BLOCK_STATUS)[0] &
+                    TP_STATUS_USER)
+
+    def next_block(self, timeout: float = None) -> Optional[Block]:
+        """Wait for the next filled block and return it, or None after timeout seconds. The block
+        must be released before the following one is requested."""
+        if not self._ready():
+            self.__poll.poll(None if timeout is None else timeout * 1000)
+            if not self._ready():
+                return None
+        block = Block(self.__ring, self.__current * self.__block_size, self.__block_size)
+        self.__blocks.add(block)
+        self.__current = (self.__current + 1) % self.__block_count
+        return block
+
+    def blocks(self, timeout: float = None) -> Iterator[Block]:
+        """Yield filled blocks until no block arrives within timeout seconds. Every block is
+        released when the next one is requested."""
+        while True:
+            block = self.next_block(timeout)
+            if block is None:
+                return
+            try:
+                yield block
+            finally:
+                block.release()
+
+    def packets(self, timeout: float = None, count: int = None) -> Iterator[Packet]:
+        """Yield captured packets until no packet arrives within timeout seconds or count packets
+        were yielded. Packet data is only valid until the next block is fetched."""
+        if count is not None and count <= 0:
+            return
+        for block in self.blocks(timeout):
+            for packet in block:
+                yield packet
+                if count is not None:
+                    count -= 1
+                    if not count:
+                        return
+
+    def write_pcapng(self, output: BinaryIO, timeout: float = None, count: int = None) -> int:
+        """Stream captured packets to output in pcapng format. Returns number of packets."""
+        writer = PcapngWriter(output, self.interface)
+        written = 0
+        for packet in self.packets(timeout, count):
+            writer.write(packet)
+            written += 1
+        return written
+
+    def close(self) -> None:
+        """Close the capture and release all blocks and their packet data"""
+        self.__poll.unregister(self.__sock)
+        for block in list(self.__blocks):
+            block.release()
+        self.__ring.release()
+        try:
+            self.__mmap.close()
+        except BufferError:
+            # the caller still holds buffers exported from packet data; unmapped once they are gone
+            pass
+        self.__sock.close()
+
+    def __enter__(self) -> 'Capture':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.close()
+        return False
+
+def _option(code: int, value: bytes) -> bytes:
+    return struct.pack("=HH", code, len(value)) + value + b'\0' * (-len(value) % 4)
+
+class PcapngWriter(object):
+    """Writer for pcapng files with a single ethernet interface and ns timestamps"""
+    def __init__(self, output: BinaryIO, interface: str = None, snaplen: int = 0) -> None:
+        self.output = output
+        self.__block(0x0A0D0D0A, struct.pack("=IHHq", 0x1A2B3C4D, 1, 0, -1))
+        options = _option(9, b'\x09') # if_tsresol: ns
+        if interface is not None:
+            options = _option(2, interface.encode()) + options # if_name
+        self.__block(0x00000001, struct.pack("=HHI", LINKTYPE_ETHERNET, 0, snaplen) + options +
+                     _option(0, b''))
+
+    def __block(self, blocktype: int, body: bytes) -> None:
+        length = 12 + len(body)
+        self.output.write(struct.pack("=II", blocktype, length))
+        self.output.write(body)
+        self.output.write(struct.pack("=I", length))
+
+    def write(self, packet: Packet) -> None:
+        """Write a packet as enhanced packet block"""
+        timestamp = packet.timestamp
+        captured = len(packet.data)
+        padding = -captured % 4
+        length = 32 + captured + padding
+        self.output.write(struct.pack("=IIIIIII", 0x00000006, length, 0, timestamp >> 32,
+                                      timestamp & 0xffffffff, captured, packet.length))
+        self.output.write(packet.data)
+        self.output.write(b'\0' * padding + struct.pack("=I", length))
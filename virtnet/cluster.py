@@ -0,0 +1,354 @@
+"""Cluster module.
+
+This module spreads one topology over several workers, e.g. one per machine. The
+specification is split like in virtnet.shard, every worker builds its part and sets up routes
+inside it, and links between the parts are carried by tunnels (see TunnelLink) between the
+underlay addresses of the workers. Routes to networks missing afterwards, e.g. of other parts,
+are computed from the specification; they follow the links between routers, which need
+explicit addresses for this.
+
+Workers are started with ``python -m virtnet.cluster [address [port]]`` and are controlled
+over a small protocol: every request and every response is a json object on a line of its
+own. A request has a 'command' and its arguments, a response has 'ok' and either 'result' or
+'error'. Before the first request, the worker sends a random 'challenge', which the coordinator
+answers with the 'hmac' of it keyed with a shared secret (environment variable
+VIRTNET_CLUSTER_SECRET of the worker). Without a secret, workers only listen on loopback
+addresses.
+
+For testing on one machine, local_workers starts workers inside Hosts connected by an
+underlay switch, so that every worker has a namespace of its own like a separate machine.
+"""
+
+from typing import Dict, Any, List, Sequence, Tuple, Union
+import collections
+import hashlib
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import secrets
+import socket
+import socketserver
+import subprocess
+import sys
+from . import shard
+from . context import Manager
+from . topology import Topology, load_spec, _normalize
+
+DEFAULT_PORT = 7474
+UNDERLAY = "10.255.0.0/24"
+SECRET_ENV = 'VIRTNET_CLUSTER_SECRET'
+
+class ClusterException(Exception):
+    """A worker failed to execute a request"""
+
+def _digest(secret: str, challenge: str) -> str:
+    return hmac.new((secret or '').encode(), challenge.encode(), hashlib.sha256).hexdigest()
+
+def _is_loopback(address: str) -> bool:
+    if not address:
+        return False
+    return all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback
+               for info in socket.getaddrinfo(address, None))
+
+def _send(wfile, message: Dict[str, Any]) -> None:
+    wfile.write(json.dumps(message).encode() + b'\n')
+    wfile.flush()
+
+class _Worker(object):
+    """State and commands of a worker process"""
+    def __init__(self, server: socketserver.TCPServer) -> None:
+        self.server = server
+        self.manager = Manager()
+        self.topology = Topology(manager=self.manager)
+
+    def build(self, spec: Dict[str, Any]) -> Dict[str, List[str]]:
+        """Build spec, set up routes and return the prefixes of every router"""
+        self.topology.apply(spec)
+        self.manager.simple_route()
+        return {name: sorted({str(address.network) for intf in router.interfaces.values()
+                              for address in intf.addresses})
+                for name, router in self.topology.containers.items() if router.router}
+
+    def tunnel(self, container: str, name: str, local: str, remote: str, key: int,
+               kind: str = 'vxlan', addresses: Sequence[str] = ()) -> None:
+        """Create the local half of a link to another worker"""
+        from . interface import TunnelLink
+        link = TunnelLink(name, self.topology[container], local, remote, key, kind=kind,
+                          manager=self.manager)
+        link.main.add_ips([ipaddress.ip_interface(address) for address in addresses])
+
+    def route(self, routes: Dict[str, Sequence[Tuple[str, str]]]) -> None:
+        """Add (destination, gateway) routes to routers, unless there is one already"""
+        for name, router_routes in routes.items():
+            ipdb = self.topology[name].ipdb
+            for dst, gateway in router_routes:
+                if dst not in ipdb.routes:
+                    ipdb.routes.add({'dst': dst, 'gateway': gateway}).commit()
+
+    def run(self, host: str, cmd: Sequence[str], timeout: float = None) -> Dict[str, Any]:
+        """Run cmd on host and return its exit code and output"""
+        output = self.manager.run_everywhere(cmd, [self.topology[host]], timeout)[host]
+        return {'returncode': output.returncode,
+                'stdout': output.stdout.decode(errors='replace'),
+                'stderr': output.stderr.decode(errors='replace')}
+
+    def stop(self) -> None:
+        """Remove everything and exit after this request"""
+        self.manager.close()
+        self.server.running = False
+
+class _Server(socketserver.TCPServer):
+    allow_reuse_address = True
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        worker = self.server.worker
+        challenge = secrets.token_hex(32)
+        _send(self.wfile, {'challenge': challenge})
+        try:
+            answer = json.loads(self.rfile.readline().decode())['hmac']
+        except (ValueError, KeyError, TypeError):
+            answer = ''
+        if not hmac.compare_digest(str(answer), _digest(self.server.secret, challenge)):
+            _send(self.wfile, {'ok': False, 'error': "Authentication failed"})
+            return
+        _send(self.wfile, {'ok': True, 'result': None})
+        for line in self.rfile:
+            request = json.loads(line.decode())
+            try:
+                command = request.pop('command')
+                if command.startswith('_') or not hasattr(worker, command):
+                    raise ValueError("Unknown command {}".format(command))
+                response = {'ok': True, 'result': getattr(worker, command)(**request)}
+            except Exception as err: # pylint: disable=broad-except
+                response = {'ok': False, 'error': "{}: {}".format(type(err).__name__, err)}
+            _send(self.wfile, response)
+            if not self.server.running:
+                return
+
+def serve(address: str = '127.0.0.1', port: int = DEFAULT_PORT, secret: str = None) -> None:
+    """Serve requests of one coordinator after another until a stop request. 'ready' is
+    printed, once requests are accepted.
+
+    Raises:
+        ValueError: If address is not a loopback address and there is no secret.
+    """
+    if not secret and not _is_loopback(address):
+        raise ValueError("Listening on {} needs a secret ({})".format(address, SECRET_ENV))
+    with _Server((address, port), _Handler) as server:
+        server.secret = secret
+        server.worker = _Worker(server)
+        server.running = True
+        print("ready", flush=True)
+        while server.running:
+            server.handle_request()
+
+class Client(object):
+    """Connection to a worker.
+
+    Args:
+        sock: Connected socket, or (address, port) of the worker.
+        underlay: Underlay address of the worker, which the tunnels are bound to.
+        process: Process of the worker, which is waited for on close.
+        secret: Secret shared with the worker.
+
+    Raises:
+        ClusterException: If the worker refused the secret.
+    """
+    def __init__(self, sock: Union[socket.socket, Tuple[str, int]], underlay: str,
+                 process: subprocess.Popen = None, secret: str = None) -> None:
+        if not isinstance(sock, socket.socket):
+            sock = socket.create_connection(sock)
+        self.underlay = underlay
+        self.process = process
+        self.__sock = sock
+        self.__file = sock.makefile('rwb')
+        try:
+            challenge = json.loads(self.__file.readline().decode())['challenge']
+            _send(self.__file, {'hmac': _digest(secret, challenge)})
+            self.__response()
+        except:
+            self.__file.close()
+            self.__sock.close()
+            raise
+
+    def request(self, command: str, **kwargs) -> Any:
+        """Execute command with arguments on the worker and return the result.
+
+        Raises:
+            ClusterException: If the worker failed.
+        """
+        kwargs['command'] = command
+        _send(self.__file, kwargs)
+        return self.__response()
+
+    def __response(self) -> Any:
+        line = self.__file.readline()
+        if not line:
+            raise ClusterException("Connection to worker {} closed".format(self.underlay))
+        response = json.loads(line.decode())
+        if not response['ok']:
+            raise ClusterException(response['error'])
+        return response['result']
+
+    def close(self) -> None:
+        """Stop the worker, which removes everything it built"""
+        try:
+            self.request('stop')
+        finally:
+            self.__file.close()
+            self.__sock.close()
+            if self.process is not None:
+                self.process.wait()
+
+def local_workers(manager: Manager, count: int, underlay: str = UNDERLAY,
+                  port: int = DEFAULT_PORT) -> List[Client]:
+    """Start count workers on this machine, each inside a Host named worker<n> connected to the
+    underlay switch 'underlay'. The workers are stopped by Cluster.close.
+
+    The workers import virtnet from the same directory as this process and share a random
+    secret with their Clients."""
+    from . address import Network
+    from . host import Host
+    from . interface import VirtualLink
+    from . switch import Switch
+    switch = Switch("underlay", network=Network(underlay), manager=manager)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    secret = secrets.token_hex(32)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [root] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+    env[SECRET_ENV] = secret
+    clients = []
+    try:
+        for i in range(count):
+            host = Host("worker{}".format(i), manager=manager)
+            host.connect(VirtualLink, switch, "eth0")
+            process = host.Popen([sys.executable, "-m", "virtnet.cluster", "127.0.0.1",
+                                  str(port)], stdout=subprocess.PIPE, env=env, cwd=root)
+            if process.stdout.readline().strip() != b'ready':
+                process.wait()
+                raise ClusterException("Worker {} did not start".format(host.name))
+            sock = host.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect(('127.0.0.1', port))
+            clients.append(Client(sock, str(next(iter(host['eth0'].addresses)).ip), process,
+                                  secret))
+    except:
+        for client in clients:
+            client.close()
+        raise
+    return clients
+
+def _routes(spec: Dict[str, Any],
+            prefixes: Dict[str, List[str]]) -> Dict[str, List[Tuple[str, str]]]:
+    """Compute (destination, gateway) routes of every router to the prefixes of all other
+    routers along the shortest path over links between routers"""
+    neighbours = collections.defaultdict(list)
+    for link in spec['links'].values():
+        ends = (link['from'], link['to'])
+        if not all(end in spec['routers'] for end in ends):
+            continue
+        for (local, remote), addresses in ((ends, link.get('peer_addresses', [])),
+                                           (ends[::-1], link.get('addresses', []))):
+            for address in addresses:
+                neighbours[local].append((remote, ipaddress.ip_interface(address).ip))
+    ret = {}
+    for router in spec['routers']:
+        # breadth first search remembering the first hop gateways
+        gateways = {router: None}
+        level = [router]
+        while level:
+            next_level = []
+            for node in level:
+                for peer, address in neighbours[node]:
+                    if peer not in gateways:
+                        gateways[peer] = address if node == router else gateways[node]
+                        next_level.append(peer)
+            level = next_level
+        routes = []
+        for peer, gateway in gateways.items():
+            if gateway is None:
+                continue
+            for prefix in prefixes.get(peer, []):
+                if ipaddress.ip_network(prefix).version == gateway.version:
+                    routes.append((prefix, str(gateway)))
+        ret[router] = routes
+    return ret
+
+class Cluster(object):
+    """Topology spread over several workers.
+
+    Args:
+        workers: Clients of the workers.
+        kind: Kind of tunnels between workers, 'vxlan' or 'gretap'.
+    """
+    def __init__(self, workers: Sequence[Client], kind: str = 'vxlan') -> None:
+        self.workers = list(workers)
+        self.kind = kind
+        self.owner = {} # type: Dict[str, int]
+        self.__keys = itertools.count(1)
+
+    def build(self, spec: Union[Dict[str, Any], str]) -> None:
+        """Build spec spread over the workers including the tunnels and routes between them"""
+        if isinstance(spec, str):
+            spec = load_spec(spec)
+        parts = shard.partition(spec, len(self.workers))
+        spec = _normalize(spec)
+        prefixes = {}
+        for index, names in enumerate(parts):
+            for name in names:
+                self.owner[name] = index
+            prefixes.update(self.workers[index].request('build',
+                                                         spec=shard._subspec(spec, names)))
+        for link in spec['links'].values():
+            local, remote = self.owner[link['from']], self.owner[link['to']]
+            if local == remote:
+                continue
+            key = next(self.__keys)
+            self.workers[local].request(
+                'tunnel', container=link['from'], name=link['name'],
+                local=self.workers[local].underlay, remote=self.workers[remote].underlay,
+                key=key, kind=self.kind, addresses=link.get('addresses', []))
+            self.workers[remote].request(
+                'tunnel', container=link['to'], name=link.get('peername', link['name']),
+                local=self.workers[remote].underlay, remote=self.workers[local].underlay,
+                key=key, kind=self.kind, addresses=link.get('peer_addresses', []))
+        routes = _routes(spec, prefixes)
+        for index, worker in enumerate(self.workers):
+            worker.request('route', routes={name: value for name, value in routes.items()
+                                            if self.owner[name] == index})
+
+    def run(self, host: str, cmd: Sequence[str], timeout: float = None) -> Dict[str, Any]:
+        """Run cmd on host and return a dictionary with returncode, stdout and stderr"""
+        return self.workers[self.owner[host]].request('run', host=host, cmd=cmd,
+                                                      timeout=timeout)
+
+    def close(self) -> None:
+        """Stop all workers, which removes everything they built. Every worker is stopped, even
+        if stopping another one failed.
+
+        Raises:
+            ClusterException: If stopping any worker failed.
+        """
+        errors = []
+        for worker in self.workers:
+            try:
+                worker.close()
+            except Exception as err: # pylint: disable=broad-except
+                errors.append(err)
+        if errors:
+            raise ClusterException("Stopping {} of {} workers failed: {}".format(
+                len(errors), len(self.workers), "; ".join(str(err) for err in errors))) \
+                from errors[0]
+
+    def __enter__(self) -> 'Cluster':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.close()
+        return False
+
+if __name__ == '__main__':
+    serve(*sys.argv[1:2], *[int(port) for port in sys.argv[2:3]],
+          secret=os.environ.pop(SECRET_ENV, None))
@@ -3,14 +3,17 @@
 This module build the base for every device and all the interfaces.
 """
 
-from typing import Union, Sequence, Type, List, Tuple
+from typing import Union, Sequence, Type, List, Tuple, Iterable
 from enum import Enum
 import ipaddress
+import socket
+import threading
 import collections
 from abc import ABC, abstractmethod
 import pyroute2.ipdb.main
 from . address import Network
-from . iproute import IPDB
+from . iproute import IPDB, lock
+from . capture import Capture
 import os
 
 class RouteDirection(Enum):
@@ -47,6 +50,8 @@ class BaseContainer(ABC):
     Attributes:
         name: Name of this thing.
     """
+    __slots__ = ('name', '__ipdb')
+
     def __init__(self, name: str,
                  ipdb: Union[pyroute2.ipdb.main.IPDB,
                              Sequence[pyroute2.ipdb.main.IPDB]]=None) -> None:
@@ -110,12 +115,18 @@ class Interface(BaseContainer): # pylint: disable=abstract-method
     Attributes:
         name: Name of this Interface.
         interface: pyroute2 interface.
-        route: routing properties for this link."""
+        addresses: Set of the addresses of this interface; use add_ip and del_ip to change it.
+            Changes replace the set, so it can be iterated while other threads add addresses.
+        route: routing properties for this link.
+        weight: weight of next hops reached through this interface in multipath routes."""
+    __slots__ = ('interface', 'addresses', 'route', 'weight')
+
     def __init__(self, name: str, interface: pyroute2.ipdb.interfaces.Interface,
                  ipdb: pyroute2.ipdb.main.IPDB = None, route: RouteDirection = None) -> None:
         self.interface = interface
         self.addresses = set()
         self.route = route
+        self.weight = 1
         super().__init__(name, ipdb)
 
     def set_name(self, name:str):
@@ -146,18 +157,48 @@ class Interface(BaseContainer): # pylint: disable=abstract-method
     def running(self) -> bool:
         return self.interface is not None
 
+    @property
+    def namespace(self) -> Union[str, None]:
+        """Return the name of the network namespace of this interface, or None for the default"""
+        if self.ipdb is IPDB:
+            return None
+        return self.ipdb.nl.netns
+
+    def capture(self, **kwargs) -> Capture:
+        """Capture packets on this interface. See virtnet.capture.Capture for arguments."""
+        return Capture(self.interface.ifname, namespace=self.namespace, **kwargs)
+
     def add_ip(self, address: Union[ipaddress.IPv4Interface, ipaddress.IPv6Interface,
                                     Network]) -> None:
         "Add ip to interface"
-        if isinstance(address, Network):
-            address = next(address)
-        self.addresses.add(address)
-        self.interface.add_ip(address.with_prefixlen).commit()
+        self.add_ips([address])
+
+    def add_ips(self, addresses: Iterable[Union[ipaddress.IPv4Interface,
+                                                ipaddress.IPv6Interface, Network]],
+                configure: bool = True) -> None:
+        """Add several ips to interface with a single commit. An address is drawn from every
+        Network. If configure is false, the addresses are only recorded, e.g. because they
+        exist already."""
+        addresses = [next(address) if isinstance(address, Network) else address
+                     for address in addresses]
+        with lock(self.ipdb):
+            addresses = [address for address in addresses if address not in self.addresses]
+            if not addresses:
+                return
+            self.addresses = self.addresses.union(addresses)
+            if not configure:
+                return
+            for address in addresses:
+                self.interface.add_ip(address.with_prefixlen)
+            self.interface.commit()
 
     def del_ip(self, address: Union[ipaddress.IPv4Interface, ipaddress.IPv6Interface]) -> None:
         "Remove ip from interface"
-        self.addresses.remove(address)
-        self.interface.del_ip(address.with_prefixlen).commit()
+        with lock(self.ipdb):
+            if address not in self.addresses:
+                raise KeyError(address)
+            self.addresses = self.addresses - {address}
+            self.interface.del_ip(address.with_prefixlen).commit()
 
 class Link(BaseContainer):
     """Link is the base for a link
@@ -169,12 +210,19 @@ class Link(BaseContainer):
     Attributes:
         name: Name of this thing.
         route: routing properties for this link."""
+    __slots__ = ('peername', 'route', 'peers')
+
     def __init__(self, name: str, peers: Sequence["InterfaceContainer"], peername: str,
                  route: RouteDirection = None) -> None:
         self.peername = peername
         self.route = route
         self.peers = peers
-        super().__init__(name, list(obj.ipdb for obj in peers))
+        super().__init__(name)
+
+    @property
+    def ipdb(self) -> List[pyroute2.ipdb.main.IPDB]:
+        """Return the IPDBs of both peers, which are only looked up when needed"""
+        return [obj.ipdb for obj in self.peers]
 
     @property
     @abstractmethod
@@ -189,8 +237,19 @@ class Link(BaseContainer):
         raise NotImplementedError
 
 class InterfaceContainer(BaseContainer): # pylint: disable=abstract-method
-    """InterfaceContainer provides attaching Interfaces to a container"""
+    """InterfaceContainer provides attaching Interfaces to a container
+
+    Thread safety: connect, attach_interface and detach_interface may be called from several
+    threads, also for the same container. Attaching is serialized per container and interface
+    names are reserved before the link is created, so generated names stay unique. Interface
+    names are generated in call order, so calls for one container should still be issued in a
+    fixed order to get reproducible names. Generated names are never reused, even after an
+    interface was detached."""
+    __slots__ = ('interfaces', '__lock', '__count')
+
     def __init__(self, *args, **kwargs) -> None:
+        self.__lock = threading.RLock()
+        self.__count = 0
         super().__init__(*args, **kwargs)
         self.interfaces = collections.OrderedDict()
 
@@ -199,33 +258,57 @@ class InterfaceContainer(BaseContainer): # pylint: disable=abstract-method
         """Return a network to draw addresses from upon connect"""
         return None
 
+    @property
+    def networks(self) -> List[Network]:
+        """Return all networks to draw addresses from upon connect"""
+        return [] if self.network is None else [self.network]
+
     def attach_interface(self, intf: Interface) -> None:
         """Attach existing interface to this container"""
-        self.interfaces[intf.name] = intf
+        with self.__lock:
+            self.interfaces[intf.name] = intf
+
+    def detach_interface(self, name: str) -> None:
+        """Forget the interface name of this container, e.g. before removing its link"""
+        with self.__lock:
+            self.interfaces.pop(name, None)
 
     def connect(self, intf: Type[Interface], remote: 'InterfaceContainer', name: str,
-                remotename: str = None, route: RouteDirection = RouteDirection.DEFAULT) -> Link:
-        """Connect InterfaceContainer with another InterfaceContainer"""
-        if remotename is None:
-            remotename = "{}{}".format(self.name, len(self.interfaces))
-        intf = intf(name, [self, remote], remotename, route=route)
+                remotename: str = None, route: RouteDirection = RouteDirection.DEFAULT,
+                **kwargs) -> Link:
+        """Connect InterfaceContainer with another InterfaceContainer. Further keyword arguments,
+        e.g. manager, are passed to the link."""
+        with self.__lock:
+            while remotename is None:
+                # the counter only grows, so names stay unique when links are removed
+                remotename = "{}{}".format(self.name, self.__count)
+                self.__count += 1
+                if remotename in remote.interfaces:
+                    remotename = None
+        intf = intf(name, [self, remote], remotename, route=route, **kwargs)
         self.attach_interface(intf.main)
 
-        network = remote.network
-        if network is not None:
+        addresses = []
+        gateways = []
+        for network in remote.networks:
             router = network.router
             if self.router:
                 if route is RouteDirection.DEFAULT and router is not None:
-                    intf.main.add_ip(network.router_interface)
+                    addresses.append(network.router_interface)
                 else:
-                    intf.main.add_ip(network)
+                    addresses.append(network)
             else:
-                intf.main.add_ip(network)
+                addresses.append(network)
                 if route is RouteDirection.DEFAULT:
                     if router is not None:
-                        routes = self.ipdb.routes
-                        if 'default' not in routes:
-                            routes.add({'dst': 'default', 'gateway': str(router)}).commit()
+                        gateways.append(router)
+        intf.main.add_ips(addresses)
+        routes = self.ipdb.routes
+        for router in gateways:
+            family = socket.AF_INET if router.version == 4 else socket.AF_INET6
+            with lock(self.ipdb):
+                if {'dst': 'default', 'family': family} not in routes:
+                    routes.add({'dst': 'default', 'gateway': str(router)}).commit()
 
         remote.attach_interface(intf.peer)
         return intf
@@ -3,44 +3,248 @@
 This module provides a context class which provides automatic cleanup.
 """
 
+from typing import Dict
 import collections
+import contextlib
 import ipaddress
+import threading
+import time
+
+Timing = collections.namedtuple('Timing', ['count', 'last', 'total'])
+Timing.__doc__ = """Number of runs, duration of the last run and total duration in seconds of an
+operation"""
 			
 class Manager(object):
     """Context manager for automatically cleaning up created network resources. Just use this object
-    instead of the virtnet module."""
-    def __init__(self) -> None:
+    instead of the virtnet module.
+
+    Thread safety: Hosts, Routers, Switches and links may be created, connected and stopped from
+    several threads at once, e.g. to build independent parts of a topology in parallel. Changes
+    in one namespace are serialized by a lock per namespace (see virtnet.iproute.lock), the
+    interfaces of a container by a lock per container, and registration by a lock in the
+    Manager. Methods working on the whole topology, like simple_route or update_hosts, work on a
+    snapshot of the registered objects and should be called once building is done.
+
+    Args:
+        accounting: Count the traffic between every pair of Hosts (see traffic_matrix)."""
+    def __init__(self, accounting: bool = False) -> None:
         self.registered = collections.OrderedDict()
+        self.networks = collections.OrderedDict()
+        self.__events = None
+        self.__exporter = None
+        self.__lock = threading.RLock()
+        self.timings = {} # type: Dict[str, Timing]
+        self.accounting = None
+        if accounting:
+            from . accounting import Accounting
+            self.accounting = Accounting(self)
 
     def register(self, obj) -> None:
         "Register an object for future removal."
-        self.registered[obj] = None
+        with self.__lock:
+            self.registered[obj] = None
+            if self.__events is not None and hasattr(type(obj), 'thread'):
+                self.__events.add_namespace(obj.name)
 
     def unregister(self, obj) -> None:
         "Unregister an object from future removal."
-        if obj in self.registered:
-            del self.registered[obj]
+        with self.__lock:
+            if obj in self.registered:
+                del self.registered[obj]
+                if self.__events is not None and hasattr(type(obj), 'thread'):
+                    self.__events.remove_namespace(obj.name)
+
+    def register_network(self, network) -> None:
+        "Register a Network, so that it is part of the manifest"
+        with self.__lock:
+            self.networks[network] = None
+
+    def unregister_network(self, network) -> None:
+        "Unregister a Network"
+        with self.__lock:
+            self.networks.pop(network, None)
+
+    def snapshot_networks(self) -> list:
+        "Return a list of the registered Networks"
+        with self.__lock:
+            return list(self.networks)
+
+    def snapshot(self) -> list:
+        "Return a list of the registered objects, which is safe to iterate while others register"
+        with self.__lock:
+            return list(self.registered)
+
+    @property
+    def events(self):
+        """Return the EventHub delivering netlink events of the default namespace and every
+        Host. It is started on first use."""
+        with self.__lock:
+            if self.__events is None:
+                from . events import EventHub
+                self.__events = EventHub()
+                self.__events.add_namespace(None)
+                for obj in self.registered:
+                    if hasattr(type(obj), 'thread'):
+                        self.__events.add_namespace(obj.name)
+            return self.__events
+
+    def record(self, operation: str, seconds: float) -> None:
+        "Record a run of operation, which took seconds, in timings"
+        with self.__lock:
+            timing = self.timings.get(operation, Timing(0, 0.0, 0.0))
+            self.timings[operation] = Timing(timing.count + 1, seconds, timing.total + seconds)
+
+    def snapshot_timings(self) -> Dict[str, Timing]:
+        "Return a copy of timings, which is safe to iterate while others record"
+        with self.__lock:
+            return dict(self.timings)
+
+    @contextlib.contextmanager
+    def timed(self, operation: str):
+        "Record the duration of the enclosed block as a run of operation"
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(operation, time.monotonic() - start)
+
+    def export(self, address: str = '127.0.0.1', port: int = None, interval: float = None):
+        """Serve metrics of the managed objects in the Prometheus text format on
+        http://address:port/metrics until the Manager exits. See virtnet.exporter.Exporter."""
+        from . import exporter
+        with self.__lock:
+            if self.__exporter is not None:
+                raise RuntimeError("Already exporting on {}:{}".format(*self.__exporter.address))
+            self.__exporter = exporter.Exporter(
+                self, address, exporter.DEFAULT_PORT if port is None else port,
+                exporter.DEFAULT_INTERVAL if interval is None else interval)
+            return self.__exporter
+
+    def traffic_matrix(self):
+        """Return the bytes and packets sent between every pair of Hosts so far as a
+        TrafficMatrix. Counters for Hosts and addresses added since the last call are installed
+        first. See virtnet.accounting."""
+        if self.accounting is None:
+            raise RuntimeError("Accounting is disabled, use Manager(accounting=True)")
+        with self.timed('traffic_matrix'):
+            return self.accounting.refresh()
 
     def update_hosts(self) -> None:
         "Update all hosts files to include every Host"
+        objects = self.snapshot()
         hosts = []
-        for obj in self.registered:
+        for obj in objects:
             hosts.extend(obj.get_hostnames())
-        for obj in self.registered:
+        for obj in objects:
             obj.set_hosts(hosts)
 
-    def simple_route(self) -> None:
-        "Add routes between routers"
-        for host in filter(lambda x: hasattr(x, 'find_routes'), self.registered):
-            host.remove_prohibited_routes()
-        for host in filter(lambda x: hasattr(x, 'find_routes'), self.registered):
-            host.find_routes()
+    def simple_route(self, multipath: bool = False, aggregate: bool = False) -> None:
+        """Add routes between routers. If multipath is true, routers balance traffic over all
+        equal cost next hops. If aggregate is true, adjacent prefixes with the same next hops
+        are summarized to keep routing tables small."""
+        with self.timed('simple_route'):
+            hosts = [obj for obj in self.snapshot() if hasattr(obj, 'find_routes')]
+            for host in hosts:
+                host.remove_prohibited_routes()
+            for host in hosts:
+                if host.router:
+                    host.find_routes(multipath, aggregate)
+                else:
+                    host.find_routes()
+
+    def measure_rtt(self, pairs, count: int = 10, interval: float = 0.01,
+                    timeout: float = 1.0) -> collections.OrderedDict:
+        """Measure the round trip time between many (source host, destination) pairs at the
+        same time. See virtnet.measure.measure_rtt."""
+        from . import measure
+        return measure.measure_rtt(pairs, count, interval, timeout)
+
+    def _hosts(self, hosts=None) -> list:
+        if hosts is not None:
+            return list(hosts)
+        from . host import Host
+        return [obj for obj in self.snapshot() if isinstance(obj, Host)]
+
+    def run_everywhere(self, cmd, hosts=None, timeout: float = None) -> collections.OrderedDict:
+        """Run cmd on hosts (every Host by default) concurrently and return the output per host
+        name. See virtnet.broadcast.run_everywhere."""
+        from . import broadcast
+        return broadcast.run_everywhere(self._hosts(hosts), cmd, timeout)
+
+    def stream_everywhere(self, cmd, hosts=None, timeout: float = None):
+        """Run cmd on hosts (every Host by default) concurrently and yield output lines tagged
+        with the host name as they arrive. See virtnet.broadcast.stream_everywhere."""
+        from . import broadcast
+        return broadcast.stream_everywhere(self._hosts(hosts), cmd, timeout)
+
+    def schedule(self, timeline=None):
+        """Return a Scheduler for timed fault injection, optionally filled with
+        (time, action, target[, params]) tuples. See virtnet.scheduler.Scheduler."""
+        from . scheduler import Scheduler
+        scheduler = Scheduler()
+        if timeline is not None:
+            scheduler.extend(timeline)
+        return scheduler
+
+    def manifest(self) -> dict:
+        "Return a manifest describing the current topology"
+        from . import manifest
+        return manifest.dump(self)
+
+    def save_manifest(self, path: str) -> None:
+        "Save a manifest describing the current topology to path"
+        from . import manifest
+        manifest.save(self, path)
+
+    def attach(self, manifest) -> collections.OrderedDict:
+        """Reattach to a topology described by a manifest (or a path to one) without creating
+        anything. Returns a mapping from name to container."""
+        from . import manifest as _manifest
+        return _manifest.load(self, manifest)
+
+    def detach(self) -> None:
+        """Forget every registered object without removing anything, e.g. after handing the
+        topology to another process with a manifest. Hosts release their netlink sockets and
+        threads, and the exporter and accounting close their sockets in the namespaces."""
+        with self.__lock:
+            exporter, self.__exporter = self.__exporter, None
+            objects = list(self.registered)
+            self.registered.clear()
+            self.networks.clear()
+            events, self.__events = self.__events, None
+        if exporter is not None:
+            exporter.close()
+        if events is not None:
+            events.close()
+        if self.accounting is not None:
+            self.accounting.close()
+        for obj in objects:
+            if hasattr(obj, 'detach'):
+                obj.detach()
+
+    def close(self) -> None:
+        "Stop and remove every registered object, like leaving the with block"
+        # the exporter must not sample namespaces being removed
+        with self.__lock:
+            exporter, self.__exporter = self.__exporter, None
+        if exporter is not None:
+            exporter.close()
+        if self.__events is not None:
+            self.__events.close()
+            self.__events = None
+        if self.accounting is not None:
+            self.accounting.close()
+        with self.timed('teardown'):
+            while True:
+                with self.__lock:
+                    if not self.registered:
+                        break
+                    obj, _ = self.registered.popitem()
+                obj.stop()
 
     def __enter__(self) -> 'Manager':
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
-        while self.registered:
-            obj, _ = self.registered.popitem()
-            obj.stop()
+        self.close()
         return False
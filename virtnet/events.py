@@ -0,0 +1,230 @@
+"""Events module.
+
+This module provides a single event hub for netlink notifications of all managed namespaces.
+Every namespace gets one netlink socket, and all sockets are served by one selector loop in one
+thread, which dispatches typed events to subscribers. The sockets are opened by the namespace
+worker (see virtnet.netns), so no thread is kept per namespace. A socket failing, e.g. after its
+namespace was removed, is logged and closed; the other namespaces are still served.
+
+The hub is for subscribers of virtnet. The IPDB of every Host keeps its own monitoring thread,
+since IPDB needs the events of its namespace to keep its state and to complete commits.
+"""
+
+from typing import Callable, Union, Iterable, Optional
+import collections
+import errno
+import logging
+import os
+import selectors
+import socket
+import threading
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_DUMP
+from pyroute2.netlink.rtnl import (RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK, RTM_NEWADDR,
+                                   RTM_DELADDR, RTM_NEWROUTE, RTM_DELROUTE, RTMGRP_LINK,
+                                   RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR, RTMGRP_IPV4_ROUTE,
+                                   RTMGRP_IPV6_ROUTE)
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg, IFF_UP
+from pyroute2.netlink.rtnl.marshal import MarshalRtnl
+from . import netns
+
+NETLINK_ROUTE = 0
+
+GROUPS = (RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR | RTMGRP_IPV4_ROUTE |
+          RTMGRP_IPV6_ROUTE)
+
+KINDS = ('link_new', 'link_del', 'link_up', 'link_down', 'addr_new', 'addr_del', 'route_new',
+         'route_del')
+
+Event = collections.namedtuple('Event', ['namespace', 'ifname', 'kind', 'message'])
+Event.__doc__ = """Netlink event of namespace (None for the default namespace) concerning interface
+ifname. kind is one of KINDS and message the parsed pyroute2 message."""
+
+_DUMP_SEQ = 0x7669
+
+LOG = logging.getLogger(__name__)
+
+class Subscription(object): #pylint: disable=too-few-public-methods
+    """Subscription to events, which match the given filters. None matches everything."""
+    def __init__(self, callback: Callable[[Event], None], namespace: Optional[str],
+                 ifname: Optional[str], kind: Union[str, Iterable[str], None]) -> None:
+        self.callback = callback
+        self.namespace = namespace
+        self.ifname = ifname
+        if isinstance(kind, str):
+            kind = (kind,)
+        self.kind = None if kind is None else frozenset(kind)
+
+    def matches(self, event: Event) -> bool:
+        """Return true if event passes the filters of this subscription"""
+        return ((self.namespace is None or self.namespace == event.namespace) and
+                (self.ifname is None or self.ifname == event.ifname) and
+                (self.kind is None or event.kind in self.kind))
+
+class _Namespace(object): #pylint: disable=too-few-public-methods
+    """Netlink socket and interface cache of one namespace"""
+    def __init__(self, name: Optional[str]) -> None:
+        self.name = name
+        if name is not None:
+            self.sock = netns.call(name, socket.socket, socket.AF_NETLINK, socket.SOCK_RAW,
+                                   NETLINK_ROUTE)
+        else:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, GROUPS))
+        self.sock.setblocking(False)
+        self.marshal = MarshalRtnl()
+        self.names = {}
+        self.flags = {}
+        request = ifinfmsg()
+        request['header']['type'] = RTM_GETLINK
+        request['header']['flags'] = NLM_F_REQUEST | NLM_F_DUMP
+        request['header']['sequence_number'] = _DUMP_SEQ
+        request.encode()
+        self.sock.send(request.data)
+
+class EventHub(object):
+    """Event hub serving the netlink sockets of many namespaces from one thread.
+
+    Subscribers are called from the hub thread and must not block. Exceptions raised by a
+    subscriber are logged and don't affect the other subscribers.
+    """
+    def __init__(self) -> None:
+        self.__selector = selectors.DefaultSelector()
+        self.__namespaces = {}
+        self.__subscriptions = []
+        self.__pending = []
+        self.__lock = threading.Lock()
+        self.__wakeup, self.__notify = os.pipe()
+        os.set_blocking(self.__wakeup, False)
+        self.__selector.register(self.__wakeup, selectors.EVENT_READ, None)
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="virtnet-events", daemon=True)
+        self.__thread.start()
+
+    def add_namespace(self, name: Optional[str]) -> None:
+        """Start listening to events of namespace name. Use None for the default namespace."""
+        namespace = _Namespace(name)
+        with self.__lock:
+            self.__pending.append((name, namespace))
+        os.write(self.__notify, b'\0')
+
+    def remove_namespace(self, name: Optional[str]) -> None:
+        """Stop listening to events of namespace name"""
+        with self.__lock:
+            self.__pending.append((name, None))
+        os.write(self.__notify, b'\0')
+
+    def __update(self) -> None:
+        # (un)registering is done by the hub thread, so the selector is never used concurrently
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+        for name, namespace in pending:
+            old = self.__namespaces.pop(name, None)
+            if old is not None:
+                self.__selector.unregister(old.sock)
+                old.sock.close()
+            if namespace is not None:
+                self.__namespaces[name] = namespace
+                self.__selector.register(namespace.sock, selectors.EVENT_READ, namespace)
+
+    def subscribe(self, callback: Callable[[Event], None], namespace: str = None,
+                  ifname: str = None, kind: Union[str, Iterable[str]] = None) -> Subscription:
+        """Call callback for every event matching namespace, ifname, and kind"""
+        subscription = Subscription(callback, namespace, ifname, kind)
+        with self.__lock:
+            self.__subscriptions = self.__subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription"""
+        with self.__lock:
+            self.__subscriptions = [sub for sub in self.__subscriptions if sub is not subscription]
+
+    def __run(self) -> None:
+        while self.__running:
+            for key, _ in self.__selector.select():
+                if key.data is None:
+                    try:
+                        os.read(self.__wakeup, 4096)
+                    except BlockingIOError:
+                        pass
+                    self.__update()
+                    break
+                self.__receive(key.data)
+        for namespace in self.__namespaces.values():
+            self.__selector.unregister(namespace.sock)
+            namespace.sock.close()
+        self.__namespaces.clear()
+
+    def __drop(self, namespace: _Namespace) -> None:
+        if self.__namespaces.get(namespace.name) is namespace:
+            del self.__namespaces[namespace.name]
+        self.__selector.unregister(namespace.sock)
+        namespace.sock.close()
+
+    def __receive(self, namespace: _Namespace) -> None:
+        while True:
+            try:
+                data = namespace.sock.recv(1 << 16)
+            except BlockingIOError:
+                return
+            except OSError as err:
+                if err.errno == errno.ENOBUFS:
+                    # events were dropped by the kernel; keep going with the following ones
+                    continue
+                LOG.exception("Receiving events of namespace %s failed", namespace.name)
+                self.__drop(namespace)
+                return
+            for message in namespace.marshal.parse(data):
+                event = self.__event(namespace, message)
+                if event is None:
+                    continue
+                for subscription in self.__subscriptions:
+                    if not subscription.matches(event):
+                        continue
+                    try:
+                        subscription.callback(event)
+                    except Exception: # pylint: disable=broad-except
+                        LOG.exception("Subscriber %r failed on %s", subscription.callback, event)
+
+    @staticmethod
+    def __event(namespace: _Namespace, message) -> Optional[Event]:
+        msgtype = message['header']['type']
+        if msgtype in (RTM_NEWLINK, RTM_DELLINK):
+            index = message['index']
+            ifname = message.get_attr('IFLA_IFNAME') or namespace.names.get(index)
+            flags = message['flags']
+            previous = namespace.flags.get(index)
+            if msgtype == RTM_DELLINK:
+                namespace.names.pop(index, None)
+                namespace.flags.pop(index, None)
+                return Event(namespace.name, ifname, 'link_del', message)
+            namespace.names[index] = ifname
+            namespace.flags[index] = flags
+            if message['header']['sequence_number'] == _DUMP_SEQ:
+                # initial state
+                return None
+            if previous is not None and (previous ^ flags) & IFF_UP:
+                return Event(namespace.name, ifname, 'link_up' if flags & IFF_UP else 'link_down',
+                             message)
+            return Event(namespace.name, ifname, 'link_new', message)
+        if msgtype in (RTM_NEWADDR, RTM_DELADDR):
+            ifname = namespace.names.get(message['index'])
+            return Event(namespace.name, ifname,
+                         'addr_new' if msgtype == RTM_NEWADDR else 'addr_del', message)
+        if msgtype in (RTM_NEWROUTE, RTM_DELROUTE):
+            ifname = namespace.names.get(message.get_attr('RTA_OIF'))
+            return Event(namespace.name, ifname,
+                         'route_new' if msgtype == RTM_NEWROUTE else 'route_del', message)
+        return None
+
+    def close(self) -> None:
+        """Stop the hub and close all sockets"""
+        self.__running = False
+        os.write(self.__notify, b'\0')
+        self.__thread.join()
+        for _, namespace in self.__pending:
+            if namespace is not None:
+                namespace.sock.close()
+        self.__selector.close()
+        os.close(self.__wakeup)
+        os.close(self.__notify)
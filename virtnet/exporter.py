@@ -0,0 +1,262 @@
+"""Exporter module.
+
+This module serves metrics of the emulated network in the Prometheus text format over HTTP:
+interface and qdisc counters of every Host and of the Switches in the default namespace,
+the number of managed objects, and the timings recorded by the Manager (see Manager.timed).
+
+Scrapes never cause netlink requests. A sampler thread dumps all links and qdiscs of every
+namespace with one request each on a fixed interval, and scrapes are answered from the last
+sample. Every namespace gets a netlink socket of its own, which is closed, when the Host is
+gone.
+"""
+
+from typing import Dict, List, Tuple, Optional
+import collections
+import http.server
+import threading
+import time
+from pyroute2 import IPRoute
+
+DEFAULT_PORT = 9474
+DEFAULT_INTERVAL = 10.0
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric, field of IFLA_STATS64, help)
+INTERFACE_COUNTERS = (
+    ('virtnet_interface_receive_bytes_total', 'rx_bytes', "Bytes received"),
+    ('virtnet_interface_transmit_bytes_total', 'tx_bytes', "Bytes transmitted"),
+    ('virtnet_interface_receive_packets_total', 'rx_packets', "Packets received"),
+    ('virtnet_interface_transmit_packets_total', 'tx_packets', "Packets transmitted"),
+    ('virtnet_interface_receive_dropped_total', 'rx_dropped', "Received packets dropped"),
+    ('virtnet_interface_transmit_dropped_total', 'tx_dropped', "Transmitted packets dropped"),
+    ('virtnet_interface_receive_errors_total', 'rx_errors', "Receive errors"),
+    ('virtnet_interface_transmit_errors_total', 'tx_errors', "Transmit errors"),
+)
+
+# (metric, type, field of the tc statistics, help)
+QDISC_METRICS = (
+    ('virtnet_qdisc_bytes_total', 'counter', 'bytes', "Bytes sent by the qdisc"),
+    ('virtnet_qdisc_packets_total', 'counter', 'packets', "Packets sent by the qdisc"),
+    ('virtnet_qdisc_drops_total', 'counter', 'drops', "Packets dropped by the qdisc"),
+    ('virtnet_qdisc_overlimits_total', 'counter', 'overlimits', "Overlimits of the qdisc"),
+    ('virtnet_qdisc_requeues_total', 'counter', 'requeues', "Requeues of the qdisc"),
+    ('virtnet_qdisc_backlog_bytes', 'gauge', 'backlog', "Bytes queued in the qdisc"),
+    ('virtnet_qdisc_queue_length', 'gauge', 'qlen', "Packets queued in the qdisc"),
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape(str(value)))
+                          for key, value in labels) + '}'
+
+def _handle(value: int) -> str:
+    if value == 0xffffffff:
+        return 'root'
+    return '{:x}:{:x}'.format(value >> 16, value & 0xffff)
+
+def _qdisc_stats(msg) -> Dict[str, int]:
+    stats2 = msg.get_attr('TCA_STATS2')
+    if stats2 is None:
+        stats = dict(msg.get_attr('TCA_STATS') or {})
+        stats['drops'] = stats.pop('drop', 0)
+        return stats
+    ret = dict(stats2.get_attr('TCA_STATS_BASIC') or {})
+    ret.update(stats2.get_attr('TCA_STATS_QUEUE') or {})
+    return ret
+
+class Metrics(object):
+    """Samples in the Prometheus text format, grouped by metric"""
+    def __init__(self) -> None:
+        self.__metrics = collections.OrderedDict()
+
+    def add(self, name: str, kind: str, text: str, labels: Labels, value: float) -> None:
+        """Add a sample of metric name with type kind and help text"""
+        if name not in self.__metrics:
+            self.__metrics[name] = (kind, text, [])
+        self.__metrics[name][2].append((labels, value))
+
+    def render(self) -> bytes:
+        """Return the exposition text"""
+        lines = []
+        for name, (kind, text, samples) in self.__metrics.items():
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+        lines.append('')
+        return '\n'.join(lines).encode()
+
+class Exporter(object):
+    """HTTP server answering scrapes from samples taken every interval seconds.
+
+    Args:
+        manager: Manager whose objects are exported.
+        address: Address to listen on.
+        port: Port to listen on; 0 selects a free one.
+        interval: Seconds between samples.
+    """
+    def __init__(self, manager, address: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                 interval: float = DEFAULT_INTERVAL) -> None:
+        self.__manager = manager
+        self.interval = interval
+        self.__sockets = {} # type: Dict[Optional[str], IPRoute]
+        self.__text = Metrics().render()
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+        exporter = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            """Serves the last sample on /metrics"""
+            def do_GET(self): # pylint: disable=invalid-name
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                text = exporter.text
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, *args): # pylint: disable=arguments-differ
+                pass
+        self.__server = http.server.ThreadingHTTPServer((address, port), Handler)
+        self.__server.daemon_threads = True
+        self.sample()
+        self.__threads = [
+            threading.Thread(target=self.__server.serve_forever, name="virtnet-exporter",
+                             daemon=True),
+            threading.Thread(target=self.__run, name="virtnet-sampler", daemon=True),
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """Return the (address, port) the server listens on"""
+        return self.__server.server_address[:2]
+
+    @property
+    def text(self) -> bytes:
+        """Return the metrics of the last sample"""
+        return self.__text
+
+    def __socket(self, name: Optional[str], host=None) -> IPRoute:
+        sock = self.__sockets.get(name)
+        if sock is None:
+            sock = IPRoute() if host is None else host.thread.call(IPRoute)
+            self.__sockets[name] = sock
+        return sock
+
+    def __namespaces(self) -> List[Tuple[Optional[str], object, Optional[set]]]:
+        # (namespace, host, interface names to export or None for all)
+        from . host import Host
+        from . switch import Switch
+        ret = []
+        switches = set()
+        for obj in self.__manager.snapshot():
+            if isinstance(obj, Host) and obj.running:
+                ret.append((obj.name, obj, None))
+            elif isinstance(obj, Switch) and obj.running:
+                switches.add(obj.name)
+                switches.update(obj.interfaces)
+        if switches:
+            ret.append((None, None, switches))
+        return ret
+
+    def sample(self) -> None:
+        """Take a new sample now"""
+        with self.__lock:
+            self.__sample()
+
+    def __sample(self) -> None:
+        start = time.monotonic()
+        metrics = Metrics()
+        counts = collections.Counter(type(obj).__name__ for obj in self.__manager.snapshot())
+        for kind, count in sorted(counts.items()):
+            metrics.add('virtnet_objects', 'gauge', "Number of managed objects",
+                        (('type', kind),), count)
+        for operation, timing in sorted(self.__manager.snapshot_timings().items()):
+            labels = (('operation', operation),)
+            metrics.add('virtnet_operation_last_seconds', 'gauge',
+                        "Duration of the last run of the operation", labels, timing.last)
+            metrics.add('virtnet_operation_seconds_total', 'counter',
+                        "Total duration of all runs of the operation", labels, timing.total)
+            metrics.add('virtnet_operations_total', 'counter', "Runs of the operation",
+                        labels, timing.count)
+
+        namespaces = self.__namespaces()
+        errors = 0
+        for name, host, names in namespaces:
+            label = '' if name is None else name
+            try:
+                sock = self.__socket(name, host)
+                links = sock.get_links()
+                qdiscs = sock.get_qdiscs()
+            except Exception: # pylint: disable=broad-except
+                # e.g. the namespace is being removed
+                errors += 1
+                self.__close(name)
+                continue
+            ifnames = {}
+            for link in links:
+                ifname = link.get_attr('IFLA_IFNAME')
+                ifnames[link['index']] = ifname
+                if names is not None and ifname not in names:
+                    continue
+                stats = link.get_attr('IFLA_STATS64') or link.get_attr('IFLA_STATS') or {}
+                labels = (('namespace', label), ('interface', ifname))
+                for metric, field, text in INTERFACE_COUNTERS:
+                    metrics.add(metric, 'counter', text, labels, stats.get(field, 0))
+            for qdisc in qdiscs:
+                ifname = ifnames.get(qdisc['index'])
+                if ifname is None or (names is not None and ifname not in names):
+                    continue
+                stats = _qdisc_stats(qdisc)
+                labels = (('namespace', label), ('interface', ifname),
+                          ('kind', qdisc.get_attr('TCA_KIND')),
+                          ('handle', _handle(qdisc['handle'])),
+                          ('parent', _handle(qdisc['parent'])))
+                for metric, kind, field, text in QDISC_METRICS:
+                    metrics.add(metric, kind, text, labels, stats.get(field, 0))
+
+        # close the sockets of removed hosts, which would keep their namespaces alive
+        current = {name for name, _, _ in namespaces}
+        for name in list(self.__sockets):
+            if name not in current:
+                self.__close(name)
+        metrics.add('virtnet_exporter_namespaces', 'gauge', "Namespaces sampled", (),
+                    len(namespaces) - errors)
+        metrics.add('virtnet_exporter_errors', 'gauge',
+                    "Namespaces which could not be sampled", (), errors)
+        metrics.add('virtnet_exporter_sample_seconds', 'gauge', "Duration of the last sample",
+                    (), time.monotonic() - start)
+        metrics.add('virtnet_exporter_sample_timestamp_seconds', 'gauge',
+                    "Time of the last sample", (), time.time())
+        self.__text = metrics.render()
+
+    def __close(self, name: Optional[str]) -> None:
+        sock = self.__sockets.pop(name, None)
+        if sock is not None:
+            sock.close()
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.interval):
+            self.sample()
+
+    def close(self) -> None:
+        """Stop serving and sampling"""
+        self.__stop.set()
+        self.__server.shutdown()
+        self.__server.server_close()
+        for thread in self.__threads:
+            thread.join()
+        with self.__lock:
+            for name in list(self.__sockets):
+                self.__close(name)
@@ -0,0 +1,165 @@
+"""Generators module.
+
+This module provides generators for common topologies. Every generator builds a specification
+for a Topology, where every router has a switch with its own LAN and some hosts attached.
+Routers are connected with point to point links. Addresses are drawn from lan (one subnet per
+router with the router at .1) and from links (one /30 per router link). After building,
+routes are set up with Manager.simple_route.
+
+All generators take the Manager as first argument and return the built Topology. With shards,
+the topology is built by that many processes, see virtnet.shard.
+"""
+
+from typing import Dict, Any
+import itertools
+import random
+from . address import Network
+from . context import Manager
+from . topology import Topology
+
+DEFAULT_LAN = "10.0.0.0/9"
+DEFAULT_LINKS = "10.128.0.0/9"
+
+class _SpecBuilder(object):
+    """Helper for building topology specifications"""
+    def __init__(self, lan: str, lanprefix: int, links: str) -> None:
+        self.spec = {'networks': {}, 'switches': {}, 'routers': {}, 'hosts': {},
+                     'links': []} # type: Dict[str, Any]
+        self.__lans = Network(lan).subnets(lanprefix, router=1)
+        self.__links = Network(links).subnets(30)
+        self.__interfaces = {}
+
+    def _interface(self, name: str) -> str:
+        num = self.__interfaces.get(name, 0)
+        self.__interfaces[name] = num + 1
+        return "eth{}".format(num)
+
+    def router(self, name: str, hosts: int) -> str:
+        """Add a router with a LAN consisting of a switch and some hosts"""
+        self.spec['routers'][name] = {}
+        if not hosts:
+            return name
+        lan = next(self.__lans)
+        switch = "{}s".format(name)
+        self.spec['networks'][switch] = {'network': str(lan.network), 'router': 1}
+        self.spec['switches'][switch] = {'network': switch}
+        self.spec['links'].append({'from': name, 'to': switch, 'name': self._interface(name)})
+        for i in range(hosts):
+            host = "{}h{}".format(name, i)
+            self.spec['hosts'][host] = {}
+            self.spec['links'].append({'from': host, 'to': switch, 'name': 'eth0'})
+        return name
+
+    def link(self, local: str, remote: str) -> None:
+        """Connect two routers with a point to point link"""
+        network = next(self.__links)
+        self.spec['links'].append({
+            'from': local, 'to': remote,
+            'name': self._interface(local), 'peername': self._interface(remote),
+            'addresses': [str(next(network))], 'peer_addresses': [str(next(network))],
+        })
+
+def _build(manager: Manager, builder: _SpecBuilder, workers: int, shards: int) -> Topology:
+    if shards:
+        from . import shard
+        topology = shard.build(manager, builder.spec, shards, workers)
+    else:
+        topology = Topology(builder.spec, workers=workers, manager=manager)
+    manager.simple_route()
+    return topology
+
+def line(manager: Manager, routers: int, hosts: int = 1, lan: str = DEFAULT_LAN,
+         lanprefix: int = 24, links: str = DEFAULT_LINKS, workers: int = 8,
+         shards: int = None) -> Topology:
+    """Build routers r0 ... rn connected in a line"""
+    builder = _SpecBuilder(lan, lanprefix, links)
+    nodes = [builder.router("r{}".format(i), hosts) for i in range(routers)]
+    for local, remote in zip(nodes, nodes[1:]):
+        builder.link(local, remote)
+    return _build(manager, builder, workers, shards)
+
+def ring(manager: Manager, routers: int, hosts: int = 1, lan: str = DEFAULT_LAN,
+         lanprefix: int = 24, links: str = DEFAULT_LINKS, workers: int = 8,
+         shards: int = None) -> Topology:
+    """Build routers r0 ... rn connected in a ring. With less than three routers, this is a
+    line, since closing the ring would add a second link between the same routers."""
+    builder = _SpecBuilder(lan, lanprefix, links)
+    nodes = [builder.router("r{}".format(i), hosts) for i in range(routers)]
+    for local, remote in zip(nodes, nodes[1:] + (nodes[:1] if routers > 2 else [])):
+        builder.link(local, remote)
+    return _build(manager, builder, workers, shards)
+
+def grid(manager: Manager, rows: int, cols: int, hosts: int = 1, lan: str = DEFAULT_LAN,
+         lanprefix: int = 24, links: str = DEFAULT_LINKS, workers: int = 8,
+         shards: int = None) -> Topology:
+    """Build a rows x cols grid of routers r<row>_<col>"""
+    builder = _SpecBuilder(lan, lanprefix, links)
+    nodes = [[builder.router("r{}_{}".format(row, col), hosts) for col in range(cols)]
+             for row in range(rows)]
+    for row in range(rows):
+        for col in range(cols):
+            if col + 1 < cols:
+                builder.link(nodes[row][col], nodes[row][col+1])
+            if row + 1 < rows:
+                builder.link(nodes[row][col], nodes[row+1][col])
+    return _build(manager, builder, workers, shards)
+
+def erdos_renyi(manager: Manager, routers: int, probability: float, seed: int = None,
+                hosts: int = 1, lan: str = DEFAULT_LAN, lanprefix: int = 24,
+                links: str = DEFAULT_LINKS, workers: int = 8,
+                shards: int = None) -> Topology:
+    """Build a G(n, p) random graph of routers r0 ... rn.
+
+    Every possible router pair is connected with the given probability. The result does not
+    need to be connected.
+    """
+    rand = random.Random(seed)
+    builder = _SpecBuilder(lan, lanprefix, links)
+    nodes = [builder.router("r{}".format(i), hosts) for i in range(routers)]
+    for local, remote in itertools.combinations(nodes, 2):
+        if rand.random() < probability:
+            builder.link(local, remote)
+    return _build(manager, builder, workers, shards)
+
+def leaf_spine(manager: Manager, spines: int, leaves: int, hosts: int = 1,
+               lan: str = DEFAULT_LAN, lanprefix: int = 24, links: str = DEFAULT_LINKS,
+               workers: int = 8,
+               shards: int = None) -> Topology:
+    """Build a leaf-spine topology with every leaf l<i> connected to every spine s<i>.
+
+    Only leaves have hosts attached.
+    """
+    builder = _SpecBuilder(lan, lanprefix, links)
+    leaf_nodes = [builder.router("l{}".format(i), hosts) for i in range(leaves)]
+    spine_nodes = [builder.router("s{}".format(i), 0) for i in range(spines)]
+    for leaf in leaf_nodes:
+        for spine in spine_nodes:
+            builder.link(leaf, spine)
+    return _build(manager, builder, workers, shards)
+
+def fat_tree(manager: Manager, k: int, hosts: int = None, lan: str = DEFAULT_LAN,
+             lanprefix: int = 24, links: str = DEFAULT_LINKS, workers: int = 8,
+             shards: int = None) -> Topology:
+    """Build a k-ary fat-tree.
+
+    There are k pods with k/2 aggregation routers a<pod>_<i> and k/2 edge routers e<pod>_<i>
+    each, and (k/2)^2 core routers c<i>. Hosts (k/2 by default) are only attached to edge
+    routers.
+    """
+    if k % 2:
+        raise ValueError("k must be even")
+    half = k // 2
+    if hosts is None:
+        hosts = half
+    builder = _SpecBuilder(lan, lanprefix, links)
+    edges = [[builder.router("e{}_{}".format(pod, i), hosts) for i in range(half)]
+             for pod in range(k)]
+    aggs = [[builder.router("a{}_{}".format(pod, i), 0) for i in range(half)] for pod in range(k)]
+    cores = [builder.router("c{}".format(i), 0) for i in range(half * half)]
+    for pod in range(k):
+        for agg in range(half):
+            for edge in edges[pod]:
+                builder.link(edge, aggs[pod][agg])
+            for core in cores[agg*half:(agg+1)*half]:
+                builder.link(aggs[pod][agg], core)
+    return _build(manager, builder, workers, shards)
@@ -0,0 +1,251 @@
+"""Helper module.
+
+This module runs python functions inside the namespaces of a host without starting a new
+interpreter. A helper process is forked once and sets up the namespaces. Every call is then
+executed in a process forked from the helper, which receives a fresh socket for the request,
+the pickled result, or a stream of results of a long running worker.
+
+Functions and arguments are pickled, so functions need to be importable, e.g. defined at
+module level.
+"""
+
+from typing import Callable, Any, Iterator
+import array
+import os
+import pickle
+import select
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+from . mountns import FORK_LOCK
+
+_HEADER = struct.Struct("!I")
+
+def _send(sock: socket.socket, obj: Any) -> None:
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+class _Reader(object): #pylint: disable=too-few-public-methods
+    """Reads pickled objects framed by _send"""
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, timeout: float = None) -> Any:
+        """Return the next object.
+
+        Raises:
+            EOFError: If the peer closed the socket.
+            TimeoutError: If no object arrived within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if len(self.buffer) >= _HEADER.size:
+                length, = _HEADER.unpack_from(self.buffer)
+                end = _HEADER.size + length
+                if len(self.buffer) >= end:
+                    data = bytes(self.buffer[_HEADER.size:end])
+                    del self.buffer[:end]
+                    return pickle.loads(data)
+            if self.eof:
+                raise EOFError()
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not select.select([self.sock], [], [], remaining)[0]:
+                raise TimeoutError()
+            data = self.sock.recv(1 << 16)
+            if not data:
+                self.eof = True
+            self.buffer += data
+
+class _Queue(object): #pylint: disable=too-few-public-methods
+    """Result queue handed to workers"""
+    def __init__(self, sock: socket.socket) -> None:
+        self.__sock = sock
+
+    def put(self, item: Any) -> None:
+        """Send item to the Worker"""
+        _send(self.__sock, (True, item))
+
+def _run(sock: socket.socket) -> None:
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    _send(sock, os.getpid())
+    try:
+        worker, func, args, kwargs = _Reader(sock).read()
+        if worker:
+            func(_Queue(sock), *args, **kwargs)
+        else:
+            _send(sock, (True, func(*args, **kwargs)))
+    except BaseException as err: # pylint: disable=broad-except
+        try:
+            _send(sock, (False, err))
+        except Exception as error: # pylint: disable=broad-except
+            # err could not be pickled
+            _send(sock, (False, RuntimeError(repr(err), repr(error))))
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+def _serve(control: socket.socket) -> None:
+    # calls are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    fds = array.array('i')
+    while True:
+        _, ancdata, _, _ = control.recvmsg(1, socket.CMSG_SPACE(fds.itemsize))
+        if not ancdata:
+            return
+        fd = array.array('i', ancdata[0][2][:fds.itemsize])[0]
+        if os.fork() == 0:
+            try:
+                control.close()
+                _run(socket.socket(fileno=fd))
+            finally:
+                os._exit(0)
+        os.close(fd)
+
+class Call(object):
+    """Function call running in a process forked from a Helper"""
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._reader = _Reader(sock)
+        self.__pid = None
+        self.__result = None
+
+    def fileno(self) -> int:
+        """Return the file descriptor of the result socket, e.g. for selectors"""
+        return self._sock.fileno()
+
+    @property
+    def pid(self) -> int:
+        """Process id of the forked process"""
+        return self._read_pid()
+
+    def _read_pid(self, timeout: float = None) -> int:
+        if self.__pid is None:
+            self.__pid = self._reader.read(timeout)
+        return self.__pid
+
+    def result(self, timeout: float = None) -> Any:
+        """Wait for the function to return and return its result or raise its exception.
+
+        Raises:
+            TimeoutError: If the function did not return within timeout seconds.
+        """
+        if self.__result is None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            try:
+                self._read_pid(timeout)
+                remaining = None if deadline is None else max(0, deadline - time.monotonic())
+                self.__result = self._reader.read(remaining)
+            except EOFError:
+                self.__result = (False, EOFError("Process {} died".format(self.__pid)))
+            self._sock.close()
+        success, value = self.__result
+        if not success:
+            raise value
+        return value
+
+class Worker(Call):
+    """Long running function in a process forked from a Helper, which sends results through a
+    queue given as first argument"""
+    def get(self, timeout: float = None) -> Any:
+        """Return the next result.
+
+        Raises:
+            EOFError: If the worker finished.
+            TimeoutError: If no result arrived within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._read_pid(timeout)
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        success, value = self._reader.read(remaining)
+        if not success:
+            raise value
+        return value
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            try:
+                yield self.get()
+            except EOFError:
+                return
+
+    def stop(self) -> None:
+        """Terminate the worker"""
+        if not self._reader.eof:
+            os.kill(self.pid, signal.SIGTERM)
+        self._sock.close()
+
+class Helper(object):
+    """Process forked from this process, which forks again for every call. The helper leads a
+    process group with all its calls and workers, so terminate can stop them together.
+
+    Args:
+        setup: Function executed in the helper after forking, e.g. to enter namespaces.
+    """
+    def __init__(self, setup: Callable[[], None] = None) -> None:
+        self.__control, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.__lock = threading.Lock()
+        with FORK_LOCK:
+            self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                os.setpgid(0, 0)
+                # don't keep other sockets (e.g. of concurrent calls) open
+                keep = remote.fileno()
+                os.closerange(3, keep)
+                os.closerange(keep + 1, os.sysconf('SC_OPEN_MAX'))
+                if setup is not None:
+                    setup()
+                _serve(remote)
+            except BaseException: # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                os._exit(0)
+        try:
+            # also done here, so terminate never misses the group
+            os.setpgid(self.pid, self.pid)
+        except OSError:
+            pass
+        remote.close()
+
+    def __submit(self, worker: bool, func: Callable, args, kwargs) -> socket.socket:
+        local, remote = socket.socketpair()
+        try:
+            with self.__lock:
+                self.__control.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                                  array.array('i', [remote.fileno()]))])
+        finally:
+            remote.close()
+        _send(local, (worker, func, args, kwargs))
+        return local
+
+    def submit(self, func: Callable, *args, **kwargs) -> Call:
+        """Run func(*args, **kwargs) in a forked process and return the Call"""
+        return Call(self.__submit(False, func, args, kwargs))
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func(*args, **kwargs) in a forked process and return the result"""
+        return self.submit(func, *args, **kwargs).result()
+
+    def start_worker(self, func: Callable, *args, **kwargs) -> Worker:
+        """Run func(queue, *args, **kwargs) in a forked process; results passed to queue.put
+        can be read from the returned Worker"""
+        return Worker(self.__submit(True, func, args, kwargs))
+
+    def close(self) -> None:
+        """Stop the helper. Running calls are not affected."""
+        self.__control.close()
+        os.waitpid(self.pid, 0)
+
+    def terminate(self) -> None:
+        """Stop the helper and kill all calls and workers still running"""
+        self.__control.close()
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitpid(self.pid, 0)
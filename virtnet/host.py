@@ -9,20 +9,21 @@ Todo:
 
 import subprocess
 import socket
-import pathlib
 import os
-import errno
-import shutil
+import threading
 from pyroute2.netns.nslink import NetNS
-from pyroute2.netns import setns
+from pyroute2.netns import listnetns, remove as remove_netns
 import pyroute2.ipdb.main
 import ipaddress
-import collections
+from typing import List, Callable, Any, Dict
 from . iproute import IPDB
 from . container import InterfaceContainer
 from . interface import VirtualInterface
 from . context import Manager
-from . import syscalls
+from . import mountns
+from . netns import NamespaceThread
+from . helper import Helper, Call, Worker
+from . sysctl import Sysctl, DEFAULTS as SYSCTL_DEFAULTS
 
 class HostException(Exception):
     """Base Class for Host-based exceptions"""
@@ -36,9 +37,6 @@ class HostDownException(HostException):
 class NamespaceExistsException(HostException):
     """Namespace with this name already exists"""
 
-ETC_DIR = pathlib.Path('/etc')
-NETNS_ETC_DIR = ETC_DIR / 'netns'
-
 DEFAULT_HOSTS = b"""127.0.0.1	localhost.localdomain	localhost
 ::1		localhost.localdomain	localhost
 
@@ -54,25 +52,17 @@ def _compatible_address (src_addr, dst_addr):
         return None
     
     
-def _setup_etc(name: str):
-    hostdir = NETNS_ETC_DIR / name
-    try:
-        os.makedirs(str(hostdir))
-    except OSError as err:
-        if err.errno != errno.EEXIST:
-            raise
-
-    ret = {}
-
-    hosts = hostdir / "hosts"
-    hosts_etc = ETC_DIR / "hosts"
-    hosts.write_bytes(DEFAULT_HOSTS)
-    ret["hosts"] = (hosts, hosts_etc)
-
-    return ret
-
-def _remove_etc(name: str) -> None:
-    shutil.rmtree(NETNS_ETC_DIR / name, ignore_errors=True)
+def _aggregate(routes, covered):
+    # collapse prefixes with identical next hops into covering networks; collapse_addresses
+    # only merges prefixes which exactly fill the supernet. Prefixes with more specific routes
+    # of their own (covered) may be used as filler, since longest prefix match keeps them.
+    groups = {}
+    for net, hops in routes.items():
+        groups.setdefault(hops, []).append(net)
+    return {net: hops for hops, nets in groups.items()
+            for net in ipaddress.collapse_addresses(nets + covered)
+            if not any(net.overlaps(other) and net.prefixlen >= other.prefixlen
+                       for other in covered)}
 
 class PhysicalHost(InterfaceContainer):
     """Physical Host.
@@ -85,6 +75,8 @@ class PhysicalHost(InterfaceContainer):
     Attributes:
         name: Name of the host.
     """
+    __slots__ = ('__ns', '__ipdb')
+
     def __init__(self, name: str = None, manager: Manager = None) -> None:
         self.__ns = None
         self.__ipdb = IPDB
@@ -115,6 +107,10 @@ class PhysicalHost(InterfaceContainer):
 
         return subprocess.Popen(*args, **kwargs)
 
+    def socket(self, *args, **kwargs) -> socket.socket:
+        """Open a socket inside the host"""
+        return socket.socket(*args, **kwargs)
+
     def stop(self) -> None:
         """Stop host
 
@@ -137,31 +133,57 @@ class Host(InterfaceContainer):
 
     Args:
         name: Name for the host, which is the name for the network namespace.
+        attach: Attach to an already existing network namespace instead of creating one. The
+            namespace is only opened (with its IPDB) when it is used first.
+        sysctl: Sysctls (key: value) to set after creating the namespace in addition to
+            virtnet.sysctl.DEFAULTS.
 
     Attributes:
         name: Name of the host, which is also the name of the network namespace.
     """
-    def __init__(self, name: str, manager: Manager = None) -> None:
+    __slots__ = ('__ns', '__ipdb', '__manager', '__attach', '__thread', '__helper',
+                 '__hostnames', '__sysctl_defaults', '__sysctl', '__attached', '__opening')
+
+    def __init__(self, name: str, manager: Manager = None, attach: bool = False,
+                 sysctl: Dict[str, Any] = None) -> None:
         self.__ns = None
         self.__ipdb = None
+        self.__attached = False
+        self.__opening = threading.Lock()
         self.__manager = manager
-        self.__files = {}
-        self.__hostnames = []
+        self.__attach = attach
+        self.__thread = None
+        self.__helper = None
+        self.__sysctl_defaults = sysctl
+        self.__sysctl = Sysctl(self)
+        self.__hostnames = ()
         super().__init__(name)
 
     def add_hostname(self, name: str) -> None:
-        self.__hostnames.append(name)
+        self.__hostnames += (name,)
+
+    @property
+    def hostnames(self) -> List[str]:
+        """Return additional hostnames of this host"""
+        return list(self.__hostnames)
 
     @property
     def running(self) -> bool:
         """True if host is running"""
-        return self.__ns is not None
+        return self.__ns is not None or self.__attached
 
     @property
     def ipdb(self) -> pyroute2.ipdb.main.IPDB:
-        """Return host IPDB"""
-        if not self.running:
-            raise HostDownException()
+        """Return host IPDB, which is opened here for an attached host"""
+        if self.__ipdb is None:
+            with self.__opening:
+                if not self.running:
+                    raise HostDownException()
+                if self.__ipdb is None:
+                    with mountns.FORK_LOCK:
+                        self.__ns = NetNS(self.name, flags=0)
+                        # IPDB clones the NetNS, which forks again
+                        self.__ipdb = pyroute2.ipdb.main.IPDB(nl=self.__ns)
         return self.__ipdb
 
     def start(self) -> None:
@@ -169,78 +191,159 @@ class Host(InterfaceContainer):
 
         Raises:
             HostUpException: If host is already running.
+            HostDownException: If the namespace to attach to does not exist.
         """
         if self.__ns is not None:
             raise HostUpException()
-        try:
-            self.__ns = NetNS(self.name)
-        except FileExistsError:
-            raise HostUpException()
-        self.__files = _setup_etc(self.name)
-        self.__ipdb = pyroute2.ipdb.main.IPDB(nl=self.__ns)
-        self.__ipdb.interfaces["lo"].up().commit()
+        if self.__attach:
+            if self.name not in listnetns():
+                raise HostDownException(self.name)
+            if not mountns.exists(self.name):
+                mountns.create(self.name, {'hosts': DEFAULT_HOSTS}, reset=False)
+            # opening the namespace costs a process and an IPDB, so it is left to ipdb
+            self.__attached = True
+        else:
+            try:
+                with mountns.FORK_LOCK:
+                    self.__ns = NetNS(self.name)
+            except FileExistsError:
+                raise HostUpException()
+            try:
+                mountns.create(self.name, {'hosts': DEFAULT_HOSTS})
+            except:
+                self.__ns.close()
+                self.__ns.remove()
+                self.__ns = None
+                raise
+            with mountns.FORK_LOCK:
+                self.__ipdb = pyroute2.ipdb.main.IPDB(nl=self.__ns)
+            self.__ipdb.interfaces["lo"].up().commit()
+            values = dict(SYSCTL_DEFAULTS)
+            values.update(self.__sysctl_defaults or {})
+            if values:
+                self.sysctl.set(values)
         if self.__manager is not None:
             self.__manager.register(self)
 
     def Popen(self, *args, **kwargs): #pylint: disable=invalid-name
         """Popen inside the host"""
 
-        mounts = tuple((bytes(src), bytes(dst)) for src, dst in self.__files.values())
+        fds = mountns.open_namespaces(self.name)
         def change_ns():
-            """Setup the namespace"""
-            # This is borrowed from iproute2 and looks more sane than pyroute2
-            # Let's move ourselves to the target network namespace
+            """Enter the namespaces"""
             try:
-                # Change to network namespace
-                setns(self.name, flags=0)
+                mountns.enter(self.name, fds)
+            except Exception as err:
+                print(err)
+                raise
+        try:
+            with mountns.FORK_LOCK:
+                return subprocess.Popen(*args, preexec_fn=change_ns, **kwargs)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    @property
+    def thread(self) -> NamespaceThread:
+        """Return a NamespaceThread running functions in the network namespace of this host, e.g.
+        for opening sockets or files in /proc/sys/net. It uses the worker shared by all hosts."""
+        if not self.running:
+            raise HostDownException()
+        if self.__thread is None:
+            self.__thread = NamespaceThread(self.name)
+        return self.__thread
 
-                # Unshare the mount namespace (preparation for following steps)
-                # Unshare UTS namespace for hostname
-                syscalls.unshare(syscalls.CLONE_NEWNS|syscalls.CLONE_NEWUTS)
+    def socket(self, *args, **kwargs) -> socket.socket:
+        """Open a socket inside the network namespace of this host.
 
-                # Make our mounts slave (otherwise unshare doesn't help with shared mounts)
-                syscalls.mount(b"none", b"/", None, syscalls.MS_REC|syscalls.MS_SLAVE, None)
+        The arguments are the same as for socket.socket. The socket stays in the namespace and
+        can be used from any thread of this process."""
+        return self.thread.call(socket.socket, *args, **kwargs)
 
-                # Mount sysfs that belongs to this network namespace
-                syscalls.umount2(b"/sys", syscalls.MNT_DETACH)
-                syscalls.mount(b"none", b"/sys", b"sysfs", 0, None)
+    @property
+    def sysctl(self) -> Sysctl:
+        """Return the sysctls of this host, e.g. host.sysctl.set({'net.ipv4.ip_forward': 1})"""
+        return self.__sysctl
 
-                # Set the hostname
-                socket.sethostname(self.name)
+    @property
+    def helper(self) -> Helper:
+        """Return a helper process inside the namespaces of this host, which forks for every
+        call. See virtnet.helper."""
+        if self.__helper is None:
+            with self.__opening:
+                if not self.running:
+                    raise HostDownException()
+                if self.__helper is None:
+                    self.__helper = Helper(lambda: mountns.enter(self.name))
+        return self.__helper
 
-                # fake hosts files etc
-                for src, dst in mounts:
-                    syscalls.mount(src, dst, b"none", syscalls.MS_BIND, None)
-            except Exception as err:
-                print(err)
-                raise
-        return subprocess.Popen(*args, preexec_fn=change_ns, **kwargs)
+    @property
+    def etc(self) -> mountns.Etc:
+        """Return the files in /etc of this host, e.g. host.etc['resolv.conf'] = b'...'"""
+        return mountns.Etc(self)
 
-    def stop(self) -> None:
-        """Stop host
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func(*args, **kwargs) inside the host without starting a new interpreter and
+        return the result. func and the arguments must be picklable."""
+        return self.helper.call(func, *args, **kwargs)
+
+    def submit(self, func: Callable, *args, **kwargs) -> Call:
+        """Like call, but return a Call to get the result from later"""
+        return self.helper.submit(func, *args, **kwargs)
+
+    def start_worker(self, func: Callable, *args, **kwargs) -> Worker:
+        """Run func(queue, *args, **kwargs) inside the host and return a Worker receiving all
+        items passed to queue.put"""
+        return self.helper.start_worker(func, *args, **kwargs)
+
+    def detach(self) -> None:
+        """Release the netlink sockets, threads and helper of this process, but keep the
+        namespace, e.g. for attaching to it from another process.
 
         Raises:
             HostDownException: If host is already stopped.
         """
-        if self.__ns is None:
+        if not self.running:
             raise HostDownException()
-        self.__ipdb.release()
-        self.__ipdb = None
-        self.__ns.close()
-        self.__ns.remove()
-        _remove_etc(self.name)
-        self.__ns = None
+        if self.__thread is not None:
+            self.__thread.stop()
+            self.__thread = None
+        with self.__opening:
+            helper, self.__helper = self.__helper, None
+        if helper is not None:
+            helper.close()
+        with self.__opening:
+            if self.__ipdb is not None:
+                self.__ipdb.release()
+                self.__ipdb = None
+                self.__ns.close()
+            self.__ns = None
+            self.__attached = False
         if self.__manager is not None:
             self.__manager.unregister(self)
 
+    def stop(self) -> None:
+        """Stop host
+
+        Raises:
+            HostDownException: If host is already stopped.
+        """
+        with self.__opening:
+            helper, self.__helper = self.__helper, None
+        if helper is not None:
+            # calls and workers still running would keep the namespaces alive
+            helper.terminate()
+        self.detach()
+        remove_netns(self.name)
+        mountns.remove(self.name)
+
     def set_hosts(self, hosts):
-        with self.__files["hosts"][0].open('wb') as hostfile:
-            hostfile.write(DEFAULT_HOSTS)
-            for host, address, hostnames in hosts:
-                hostfile.write("{}\t{}\t{}\n".format(address, host, " ".join(hostnames)).encode())
+        self.etc.write('hosts', DEFAULT_HOSTS + b"".join(
+            "{}\t{}\t{}\n".format(address, host, " ".join(hostnames)).encode()
+            for host, address, hostnames in hosts))
 
     def get_hostnames(self):
-        return [(self.name, address.ip, self.__hostnames)
+        return [(self.name, address.ip, list(self.__hostnames))
                 for interface in self.interfaces.values()
                 for address in interface.addresses]
 
@@ -264,8 +367,8 @@ class Host(InterfaceContainer):
                         lambda x: x not in visited and isinstance(x, VirtualInterface),
                         peer.interfaces.values()
                     ))
-                    intf_list.extend (new_intfs)
-                    visited.extend (new_intfs)    
+                    intf_list.update(new_intfs)
+                    visited.update(new_intfs)
                     
         
     def remove_prohibited_routes(self):
@@ -281,6 +384,12 @@ class Host(InterfaceContainer):
         if {'dst': 'default', 'family': socket.AF_INET6} not in self.ipdb.routes:
             self._find_gateway(ipaddress.IPv6Interface)
             
+ROUTER_SYSCTL = {
+    'net.ipv4.ip_forward': 1,
+    'net.ipv6.conf.all.forwarding': 1,
+    'net.ipv4.conf.default.rp_filter': 0,
+}
+
 class Router(Host):
     """Router extends Host with some additional settings a router needs
 
@@ -289,53 +398,110 @@ class Router(Host):
 
     Attributes:
         name: Name of the host, which is also the name of the network namespace."""
+    __slots__ = ()
+
     def __init__(self, *arg, **kwarg):
+        # set when the namespace is created; an attached namespace is already configured
+        sysctl = dict(ROUTER_SYSCTL)
+        sysctl.update(kwarg.get('sysctl') or {})
+        kwarg['sysctl'] = sysctl
         super().__init__(*arg, **kwarg)
-        # no simple way to open files in the network namespace :(
-        self.Popen(["sysctl", "-w", "net.ipv4.ip_forward=1", "net.ipv6.conf.all.forwarding=1",
-                    "net.ipv4.conf.default.rp_filter=0"], stdout=subprocess.DEVNULL,
-                   stderr=subprocess.DEVNULL).wait()
 
     @property
     def router(self) -> bool:
         """Return true if container is a router"""
         return True
         
-    def _bfs(self, addrtype):
-        node_list = collections.deque([(self,None,None)])
-        visited = set([self])
-        
-        while node_list:
-            node, routerAddresses, firsthop = node_list.pop()
-            
+    @staticmethod
+    def _neighbours(router, addrtype):
+        # yield (interface, neighbour router, address of neighbour) for all routers sharing a
+        # subnet with router, looking through switches
+        for intf in router.interfaces.values():
+            if intf.route and not intf.route.allow_egress:
+                continue
+            if not isinstance(intf, VirtualInterface):
+                continue
+            addresses = list(filter(lambda x: isinstance(x, addrtype), intf.addresses))
+            intf_list = [intf]
+            visited = set([intf])
+            while intf_list:
+                peer, peerintf = intf_list.pop().peer()
+                if peer is router:
+                    continue
+                if peer.router:
+                    address = _compatible_address(addresses, peerintf.addresses)
+                    if address:
+                        yield intf, peer, address
+                elif peer.switch:
+                    new_intfs = set(filter(
+                        lambda x: x not in visited and isinstance(x, VirtualInterface) and
+                        not (x.route and not x.route.allow_egress),
+                        peer.interfaces.values()
+                    ))
+                    intf_list.extend(new_intfs)
+                    visited.update(new_intfs)
+
+    def _bfs(self, addrtype, multipath=True, aggregate=False):
+        # level wise search collecting all equal cost first hops of every router
+        distance = {self: 0}
+        firsthops = {self: set()}
+        level = [self]
+        while level:
+            next_level = []
+            for node in level:
+                for intf, peer, address in self._neighbours(node, addrtype):
+                    hops = {(str(address), intf)} if node is self else firsthops[node]
+                    if peer not in distance:
+                        distance[peer] = distance[node] + 1
+                        firsthops[peer] = set()
+                        next_level.append(peer)
+                    if distance[peer] == distance[node] + 1:
+                        firsthops[peer].update(hops)
+            level = next_level
+
+        # prefixes of the nearest routers; equally near routers contribute their first hops
+        routes = {}
+        for node, dist in distance.items():
+            if node is self:
+                continue
             for intf in node.interfaces.values():
                 if intf.route and not intf.route.allow_egress:
                     continue
-
-                if node.router:
-                    routerAddresses = list(filter(lambda x: isinstance(x, addrtype), intf.addresses))
-                    for address in routerAddresses:
-                        net = str(ipaddress.ip_network(str(address),strict=False))
-                        if net not in self.ipdb.routes and node != self:
-                            self.ipdb.routes.add({'dst': net, 'gateway': firsthop}).commit()
-                if not isinstance(intf, VirtualInterface):
-                    continue
-                peer, peerintf = intf.peer()
-                if peer in visited or not (peer.router or peer.switch):
-                    continue
-                if peer.switch:
-                    # append to right side of deque to find routers on local subnet first
-                    node_list.append((peer, routerAddresses, firsthop))
-                else:
-                    # require address to be in the same subnet as previous router
-                    address = _compatible_address(routerAddresses, peerintf.addresses)
-                    if not address:
-                        continue
-                    routeFirsthop = firsthop if firsthop else str(address)
-                    node_list.appendleft((peer, None, routeFirsthop))
-                visited.add(peer)
-        
-    def find_routes(self):
-        self._bfs (ipaddress.IPv4Interface)
-        self._bfs (ipaddress.IPv6Interface)
+                for address in filter(lambda x: isinstance(x, addrtype), intf.addresses):
+                    best = routes.get(address.network)
+                    if best is None or dist < best[0]:
+                        routes[address.network] = (dist, set(firsthops[node]))
+                    elif dist == best[0]:
+                        best[1].update(firsthops[node])
+
+        nexthops = {}
+        # own prefixes may fill gaps when aggregating, unless egress to them is prohibited
+        covered = [address.network for intf in self.interfaces.values()
+                   if not (intf.route and not intf.route.allow_egress)
+                   for address in intf.addresses if isinstance(address, addrtype)]
+        for net, (_, hops) in routes.items():
+            if str(net) in self.ipdb.routes:
+                covered.append(net)
+                continue
+            # numerically, so the single path is the lowest gateway and not the lexically first
+            hops = tuple(sorted(hops, key=lambda hop: ipaddress.ip_address(hop[0])))
+            nexthops[net] = hops if multipath else hops[:1]
+        if aggregate:
+            nexthops = _aggregate(nexthops, covered)
+
+        for net in sorted(nexthops):
+            hops = nexthops[net]
+            if len(hops) == 1:
+                self.ipdb.routes.add({'dst': str(net), 'gateway': hops[0][0]}).commit()
+            else:
+                self.ipdb.routes.add({'dst': str(net), 'multipath': [
+                    {'gateway': gateway, 'hops': intf.weight - 1} for gateway, intf in hops
+                ]}).commit()
+
+    def find_routes(self, multipath: bool = False, aggregate: bool = False):
+        """Add routes to all networks reachable via other routers. If multipath is true, all
+        equal cost next hops are used, weighted by the weight of the outgoing interface. If
+        aggregate is true, adjacent prefixes with the same next hops are summarized."""
+        self._bfs(ipaddress.IPv4Interface, multipath, aggregate)
+        self._bfs(ipaddress.IPv6Interface, multipath, aggregate)
 
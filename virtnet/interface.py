@@ -8,9 +8,11 @@ Todo:
 
 import pyroute2.ipdb.main
 import pyroute2.ipdb.interfaces
-from . iproute import IPDB
-from . container import Interface, Link, InterfaceContainer, RouteDirection
+from pyroute2.netlink.rtnl.ifinfmsg import IFF_UP
+from . iproute import IPDB, lock, temporary_name, interface as find_interface
+from . container import BaseContainer, Interface, Link, InterfaceContainer, RouteDirection
 from . context import Manager
+from . qdisc import TrafficControl
 
 class InterfaceException(Exception):
     """Base Class for Interface-based exceptions"""
@@ -21,7 +23,7 @@ class InterfaceUpException(InterfaceException):
 class InterfaceDownException(InterfaceException):
     """Interface is not running"""
 
-class PhysicalInterface(Interface):
+class PhysicalInterface(TrafficControl, Interface):
     """Physical Network device
 
     Args:
@@ -29,6 +31,7 @@ class PhysicalInterface(Interface):
 
     Attributes:
         name: Name of the physical interface"""
+    __slots__ = TrafficControl.SLOTS
 
     def __init__(self, name: str, ipdb: pyroute2.ipdb.main.IPDB = IPDB, manager: Manager = None) -> None:
         interface = ipdb.interfaces[name]
@@ -40,42 +43,79 @@ class PhysicalInterface(Interface):
     def stop(self) -> None:
         pass
 
-    def tc(self, *args, **kwargs):
-        "call tc on this interface"
-        self.ipdb.nl.tc(*args, index=self.interface.index, **kwargs)
-
-class VirtualInterface(Interface):
+class VirtualInterface(TrafficControl, Interface):
     """Virtual Network device
 
     A veth interface.
 
     Args:
         name: Name of the interface.
+        side: If given, interface and ipdb are None and looked up on first use in the container
+            parent.peers[side], e.g. when attaching to an existing link.
 
     Attributes:
         name: Name of the interface.
     """
+    __slots__ = TrafficControl.SLOTS + ('parent', '__side')
+
     def __init__(self, name: str, interface: pyroute2.ipdb.interfaces.Interface,
-                 ipdb: pyroute2.ipdb.main.IPDB, parent: 'VirtualLink', route: RouteDirection = None) -> None:
+                 ipdb: pyroute2.ipdb.main.IPDB, parent: 'VirtualLink', route: RouteDirection = None,
+                 side: int = None) -> None:
         self.parent = parent
+        self.__side = side
         super().__init__(name, interface, ipdb, route)
 
+    def __resolve(self) -> None:
+        # threads resolving at the same time find the same, so no lock is needed
+        side = self.__side
+        if side is None:
+            return
+        ipdb = self.parent.peers[side].ipdb
+        Interface.interface.__set__(self, find_interface(ipdb, self.name))
+        BaseContainer.ipdb.fset(self, ipdb)
+        self.__side = None
+
+    @property
+    def interface(self) -> pyroute2.ipdb.interfaces.Interface:
+        """pyroute2 interface"""
+        if self.__side is not None:
+            self.__resolve()
+        return Interface.interface.__get__(self)
+
+    @interface.setter
+    def interface(self, value: pyroute2.ipdb.interfaces.Interface) -> None:
+        Interface.interface.__set__(self, value)
+
+    @property
+    def ipdb(self) -> pyroute2.ipdb.main.IPDB:
+        """Return the IPDB of the namespace of this interface"""
+        if self.__side is not None:
+            self.__resolve()
+        return BaseContainer.ipdb.fget(self)
+
+    @ipdb.setter
+    def ipdb(self, value: pyroute2.ipdb.main.IPDB) -> None:
+        BaseContainer.ipdb.fset(self, value)
+
     def start(self) -> None:
-        with self.interface as intf:
+        if self.__side is not None:
+            # attached to an existing link, which is set up already
+            return
+        if self.interface.ifname == self.name and self.interface.flags & IFF_UP:
+            # already set up, e.g. when attaching to an existing link
+            return
+        with lock(self.ipdb), self.interface as intf:
             intf.ifname = self.name
             intf.up()
 
     def stop(self) -> None:
-        self.interface.remove().commit()
+        with lock(self.ipdb):
+            self.interface.remove().commit()
 
     def peer(self) -> InterfaceContainer:
         "return peer of this link"
         return self.parent.partner(self)
 
-    def tc(self, *args, **kwargs):
-        "call tc on this interface"
-        self.ipdb.nl.tc(*args, index=self.interface.index, **kwargs)
-
 class VirtualLink(Link):
     """Network link consisting of two virtual devices
 
@@ -88,13 +128,14 @@ class VirtualLink(Link):
         name: Name of the interface.
         peername: Name of peer interface.
     """
-    def __init__(self, *args, manager: Manager = None, **kwargs) -> None:
+    __slots__ = ('__intf', '__peer', '__manager', '__attach')
+
+    def __init__(self, *args, manager: Manager = None, attach: bool = False, **kwargs) -> None:
         self.__intf = None
         self.__peer = None
         self.__manager = manager
+        self.__attach = attach
         super().__init__(*args, **kwargs)
-        self.__partners = {self.__peer: (self.peers[0], self.__intf),
-                           self.__intf: (self.peers[1], self.__peer)}
 
     @property
     def running(self) -> bool:
@@ -117,7 +158,11 @@ class VirtualLink(Link):
 
     def partner(self, interface):
         "return peer of this link"
-        return self.__partners[interface]
+        if interface is self.__peer:
+            return self.peers[0], self.__intf
+        if interface is self.__intf:
+            return self.peers[1], self.__peer
+        raise KeyError(interface)
 
     def start(self) -> None:
         """Start interface
@@ -127,23 +172,33 @@ class VirtualLink(Link):
         """
         if self.__intf is not None:
             raise InterfaceUpException()
-        self.__intf = IPDB.create(ifname="virt0Master", kind="veth", peer="virt0Peer").commit()
-        if self.ipdb[0] is not IPDB:
-            with IPDB.interfaces["virt0Master"] as veth:
-                veth.net_ns_fd = self.ipdb[0].nl.netns
-        if self.ipdb[1] is not IPDB:
-            with IPDB.interfaces["virt0Peer"] as veth:
-                veth.net_ns_fd = self.ipdb[1].nl.netns
+        if self.__attach:
+            # the interfaces are looked up on first use, so attaching opens no namespace
+            self.__peer = VirtualInterface(self.peername, None, None, self,
+                                           self.route.reverse() if self.route else None, side=1)
+            self.__intf = VirtualInterface(self.name, None, None, self, self.route, side=0)
+            if self.__manager is not None:
+                self.__manager.register(self)
+            return
+        master, peer = temporary_name("m"), temporary_name("p")
+        with lock(IPDB):
+            self.__intf = IPDB.create(ifname=master, kind="veth", peer=peer).commit()
+            if self.ipdb[0] is not IPDB:
+                with IPDB.interfaces[master] as veth:
+                    veth.net_ns_fd = self.ipdb[0].nl.netns
+            if self.ipdb[1] is not IPDB:
+                with IPDB.interfaces[peer] as veth:
+                    veth.net_ns_fd = self.ipdb[1].nl.netns
         while True:
             try:
-                self.__peer = VirtualInterface(self.peername, self.ipdb[1].interfaces["virt0Peer"],
+                self.__peer = VirtualInterface(self.peername, self.ipdb[1].interfaces[peer],
                                                self.ipdb[1], self, self.route.reverse() if self.route else None)
             except KeyError:
                 continue
             break
         while True:
             try:
-                self.__intf = VirtualInterface(self.name, self.ipdb[0].interfaces["virt0Master"],
+                self.__intf = VirtualInterface(self.name, self.ipdb[0].interfaces[master],
                                                self.ipdb[0], self, self.route)
             except KeyError:
                 continue
@@ -164,3 +219,135 @@ class VirtualLink(Link):
         self.__intf = None
         if self.__manager is not None:
             self.__manager.unregister(self)
+
+VXLAN_PORT = 4789
+GRE_KEY = 32 # key flag as encoded by pyroute2
+
+class TunnelInterface(TrafficControl, Interface):
+    """Tunnel device (VXLAN or GRE) inside a container.
+
+    Args:
+        name: Name of the interface.
+
+    Attributes:
+        name: Name of the interface.
+    """
+    __slots__ = TrafficControl.SLOTS + ('parent',)
+
+    def __init__(self, name: str, interface: pyroute2.ipdb.interfaces.Interface,
+                 ipdb: pyroute2.ipdb.main.IPDB, parent: 'TunnelLink', route: RouteDirection = None) -> None:
+        self.parent = parent
+        super().__init__(name, interface, ipdb, route)
+
+    def start(self) -> None:
+        with lock(self.ipdb), self.interface as intf:
+            intf.ifname = self.name
+            intf.up()
+
+    def stop(self) -> None:
+        with lock(self.ipdb):
+            self.interface.remove().commit()
+
+class TunnelLink(Link):
+    """Half of a link to a container on another machine carried by a tunnel
+
+    The tunnel is created in the underlay namespace, where local is configured, and moved into
+    the container afterwards; its packets are still sent and received in the underlay namespace.
+    Both halves must use the same key, which must be unique for every pair of machines. The
+    interface is attached to the container on start.
+
+    Args:
+        name: Name of the interface in container.
+        container: InterfaceContainer this half belongs to.
+        local: Underlay address of this machine.
+        remote: Underlay address of the other machine.
+        key: VXLAN network identifier or GRE key.
+        kind: 'vxlan' or 'gretap'.
+        underlay: IPDB of the underlay namespace. Defaults to the one of this process.
+
+    Attributes:
+        name: Name of the interface.
+        local: Underlay address of this machine.
+        remote: Underlay address of the other machine.
+        key: VXLAN network identifier or GRE key.
+        kind: 'vxlan' or 'gretap'.
+    """
+    __slots__ = ('local', 'remote', 'key', 'kind', '__underlay', '__intf', '__manager')
+
+    def __init__(self, name: str, container: InterfaceContainer, local: str, remote: str,
+                 key: int, kind: str = 'vxlan', underlay: pyroute2.ipdb.main.IPDB = None,
+                 route: RouteDirection = None, manager: Manager = None) -> None:
+        if kind not in ('vxlan', 'gretap'):
+            raise ValueError("Unknown tunnel kind {}".format(kind))
+        self.local = local
+        self.remote = remote
+        self.key = key
+        self.kind = kind
+        self.__underlay = IPDB if underlay is None else underlay
+        self.__intf = None
+        self.__manager = manager
+        super().__init__(name, [container], None, route=route)
+
+    @property
+    def running(self) -> bool:
+        """True if interface exists"""
+        return self.__intf is not None
+
+    @property
+    def peer(self) -> None:
+        """The peer is on another machine"""
+        return None
+
+    @property
+    def main(self) -> TunnelInterface:
+        """Return main interface"""
+        if not self.running:
+            raise InterfaceDownException()
+        return self.__intf
+
+    def _parameters(self) -> dict:
+        if self.kind == 'vxlan':
+            return {'vxlan_id': self.key, 'vxlan_local': self.local, 'vxlan_group': self.remote,
+                    'vxlan_port': VXLAN_PORT}
+        return {'gre_local': self.local, 'gre_remote': self.remote, 'gre_ikey': self.key,
+                'gre_okey': self.key, 'gre_iflags': GRE_KEY, 'gre_oflags': GRE_KEY}
+
+    def start(self) -> None:
+        """Start interface
+
+        Raises:
+            InterfaceUpException: If interface already exists.
+        """
+        if self.__intf is not None:
+            raise InterfaceUpException()
+        name = temporary_name("t")
+        ipdb = self.ipdb[0]
+        with lock(self.__underlay):
+            self.__underlay.create(ifname=name, kind=self.kind, **self._parameters()).commit()
+            if ipdb is not self.__underlay:
+                with self.__underlay.interfaces[name] as tunnel:
+                    tunnel.net_ns_fd = ipdb.nl.netns
+        while True:
+            try:
+                self.__intf = TunnelInterface(self.name, ipdb.interfaces[name], ipdb, self,
+                                              self.route)
+            except KeyError:
+                continue
+            break
+        self.peers[0].attach_interface(self.__intf)
+        if self.__manager is not None:
+            self.__manager.register(self)
+
+    def stop(self) -> None:
+        """Stop interface
+
+        Raises:
+            InterfaceDownException: If interface is already stopped.
+        """
+        if self.__intf is None:
+            raise InterfaceDownException()
+        self.peers[0].detach_interface(self.name)
+        self.__intf.stop()
+        self.__intf = None
+        if self.__manager is not None:
+            self.__manager.unregister(self)
@@ -1,9 +1,52 @@
-"""This module holds the iproute2 socket"""
+"""This module holds the iproute2 socket
 
-import pyroute2.ipdb.main
-import pyroute2.netlink.rtnl.tcmsg
-from . import sched_netem_test
+Changes through an IPDB are serialized per namespace with the lock returned by lock(). The
+IPDB of the default namespace is shared by every Switch and every link, so anything creating,
+moving or renaming interfaces in there has to hold lock(IPDB).
+"""
 
-pyroute2.netlink.rtnl.tcmsg.plugins['netem'] = sched_netem_test
+import os
+import itertools
+import threading
+import time
+import weakref
+import pyroute2.ipdb.main
+import pyroute2.ipdb.interfaces
+from . import qdisc # pylint: disable=unused-import; registers the tc plugins
 
 IPDB = pyroute2.ipdb.main.IPDB()
+
+SYNC_TIMEOUT = 5.0
+
+_LOCKS = weakref.WeakKeyDictionary() # type: weakref.WeakKeyDictionary
+_LOCKS_LOCK = threading.Lock()
+_NAMES = itertools.count()
+
+def lock(ipdb: pyroute2.ipdb.main.IPDB) -> threading.RLock:
+    """Return the lock serializing changes through ipdb, i.e. in one namespace"""
+    with _LOCKS_LOCK:
+        ret = _LOCKS.get(ipdb)
+        if ret is None:
+            ret = _LOCKS[ipdb] = threading.RLock()
+        return ret
+
+def temporary_name(suffix: str) -> str:
+    """Return an interface name unique across threads and processes, e.g. for creating veth pairs
+    before they are renamed inside their namespace. Names fit into IFNAMSIZ."""
+    return "v{:x}_{:x}{}".format(os.getpid(), next(_NAMES), suffix)
+
+def interface(ipdb: pyroute2.ipdb.main.IPDB, name: str,
+              timeout: float = SYNC_TIMEOUT) -> pyroute2.ipdb.interfaces.Interface:
+    """Return the interface name of ipdb. Interfaces created by other processes show up in an
+    IPDB only after their netlink events were processed, so this waits up to timeout seconds for
+    interfaces the kernel knows already.
+
+    Raises:
+        KeyError: If there is no such interface.
+    """
+    deadline = time.monotonic() + timeout
+    while name not in ipdb.interfaces:
+        if time.monotonic() > deadline or not ipdb.nl.link_lookup(ifname=name):
+            raise KeyError(name)
+        time.sleep(0.001)
+    return ipdb.interfaces[name]
@@ -0,0 +1,151 @@
+"""Manifest module.
+
+This module describes a running topology as a plain dictionary (the manifest), which can be
+stored as json and used to reattach to the kernel objects from another process. Every Network
+registered with the Manager is part of the manifest, including the ones not used by a Switch,
+and is registered again on load (see Manager.networks).
+
+The addresses of links are part of the manifest as well, so loading opens no namespace. Hosts
+open their namespace when they are used first.
+"""
+
+from typing import Union, Dict, Any
+import collections
+import ipaddress
+import json
+from . container import RouteDirection, InterfaceContainer
+from . host import Host, PhysicalHost, Router
+from . switch import Switch
+from . interface import VirtualLink
+from . address import Network
+from . context import Manager
+
+VERSION = 2
+
+# versions load understands; version 1 stored networks only inside switches
+VERSIONS = (1, 2)
+
+_CONTAINERS = {
+    'Host': Host,
+    'Router': Router,
+    'Switch': Switch,
+    'PhysicalHost': PhysicalHost,
+}
+
+def _dump_network(network: Network) -> Dict[str, Any]:
+    router = None
+    if network.router is not None:
+        router = int(network.router) - int(network.network.network_address)
+    return {'network': str(network.network), 'router': router, 'allocated': network.allocated}
+
+def _load_network(data: Dict[str, Any], manager: Manager) -> Network:
+    network = Network(data['network'], router=data['router'], manager=manager)
+    network.skip(data['allocated'])
+    return network
+
+def _dump_container(obj: InterfaceContainer, networks: Dict[Network, int]) -> Dict[str, Any]:
+    ret = {'type': type(obj).__name__, 'name': obj.name}
+    if isinstance(obj, Host):
+        ret['hostnames'] = obj.hostnames
+    if isinstance(obj, Switch) and obj.networks:
+        ret['networks'] = [networks[network] for network in obj.networks]
+    return ret
+
+def dump(manager: Manager) -> Dict[str, Any]:
+    """Return the manifest of every object registered with manager"""
+    containers = collections.OrderedDict()
+    links = []
+    for obj in manager.snapshot():
+        if isinstance(obj, VirtualLink):
+            for peer in obj.peers:
+                containers.setdefault(peer.name, peer)
+            links.append({
+                'type': type(obj).__name__,
+                'name': obj.name,
+                'peername': obj.peername,
+                'peers': [peer.name for peer in obj.peers],
+                'route': obj.route.name if obj.route else None,
+                'addresses': [sorted(str(address) for address in intf.addresses)
+                              for intf in (obj.main, obj.peer)],
+            })
+        elif isinstance(obj, InterfaceContainer):
+            containers.setdefault(obj.name, obj)
+    # networks of switches created without the manager are included as well
+    networks = collections.OrderedDict((network, None)
+                                       for network in manager.snapshot_networks())
+    for obj in containers.values():
+        if isinstance(obj, Switch):
+            for network in obj.networks:
+                networks.setdefault(network, None)
+    index = {network: i for i, network in enumerate(networks)}
+    return {
+        'version': VERSION,
+        'networks': [_dump_network(network) for network in networks],
+        'containers': [_dump_container(obj, index) for obj in containers.values()],
+        'links': links,
+    }
+
+def save(manager: Manager, path: str) -> None:
+    """Write the manifest of manager to path"""
+    with open(path, 'w') as manifest:
+        json.dump(dump(manager), manifest, indent=1)
+
+def _scan_addresses(intf) -> None:
+    addresses = [ipaddress.ip_interface("{}/{}".format(address, prefixlen))
+                 for address, prefixlen in intf.interface.ipaddr]
+    intf.add_ips([address for address in addresses if not address.is_link_local],
+                 configure=False)
+
+def load(manager: Manager, manifest: Union[str, Dict[str, Any]]) -> Dict[str, InterfaceContainer]:
+    """Rebuild the objects described by manifest from the existing kernel objects.
+
+    Nothing is created; the namespaces, bridges, and veths must still exist.
+
+    Args:
+        manager: Manager the rebuilt objects are registered with.
+        manifest: A manifest as returned by dump or a path to a saved one.
+
+    Returns:
+        An ordered mapping from name to container. The Networks are registered with manager.
+    """
+    if isinstance(manifest, str):
+        with open(manifest) as manifestfile:
+            manifest = json.load(manifestfile)
+    if manifest.get('version') not in VERSIONS:
+        raise ValueError("Unsupported manifest version {}".format(manifest.get('version')))
+
+    networks = [_load_network(data, manager) for data in manifest.get('networks', [])]
+    containers = collections.OrderedDict()
+    for data in manifest['containers']:
+        cls = _CONTAINERS[data['type']]
+        if cls is PhysicalHost:
+            obj = cls(data['name'], manager=manager)
+        elif cls is Switch:
+            switch_networks = data.get('networks',
+                                       [data['network']] if 'network' in data else [])
+            obj = cls(data['name'], network=[networks[network] if isinstance(network, int)
+                                             else _load_network(network, manager)
+                                             for network in switch_networks],
+                      manager=manager, attach=True)
+        else:
+            obj = cls(data['name'], manager=manager, attach=True)
+            for hostname in data.get('hostnames', []):
+                obj.add_hostname(hostname)
+        containers[obj.name] = obj
+
+    for data in manifest['links']:
+        peers = [containers[name] for name in data['peers']]
+        route = RouteDirection[data['route']] if data['route'] else None
+        link = VirtualLink(data['name'], peers, data['peername'], route=route,
+                           manager=manager, attach=True)
+        if 'addresses' in data:
+            # the interfaces are new, so nobody else sees the addresses yet
+            for intf, addresses in zip((link.main, link.peer), data['addresses']):
+                intf.addresses = {ipaddress.ip_interface(address) for address in addresses}
+        else:
+            for intf in (link.main, link.peer):
+                _scan_addresses(intf)
+        peers[0].attach_interface(link.main)
+        peers[1].attach_interface(link.peer)
+
+    return containers
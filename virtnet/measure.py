@@ -0,0 +1,201 @@
+"""Measure module.
+
+This module measures round trip times between hosts with ICMP echo requests sent from raw
+sockets inside the namespaces. All pairs are probed at the same time from a single selector
+loop, so no ping processes need to be spawned and parsed.
+"""
+
+from typing import Union, Sequence, Tuple, Dict
+import array
+import collections
+import ipaddress
+import itertools
+import math
+import os
+import selectors
+import socket
+import struct
+import time
+from . host import Host
+
+_ICMP_ECHO_REQUEST = 8
+_ICMP_ECHO_REPLY = 0
+_ICMPV6_ECHO_REQUEST = 128
+_ICMPV6_ECHO_REPLY = 129
+
+_ICMP = struct.Struct("!BBHHH")
+
+class RTTResult(object):
+    """Round trip time samples of one host pair.
+
+    Attributes:
+        src: Name of the source host.
+        dst: Name of the destination host or the destination address.
+        address: Destination address.
+        sent: Number of sent echo requests.
+        samples: array of round trip times in milliseconds in order of arrival. Use
+            numpy.frombuffer(samples) to get a numpy array without copying.
+    """
+    def __init__(self, src: str, dst: str,
+                 address: Union[ipaddress.IPv4Address, ipaddress.IPv6Address]) -> None:
+        self.src = src
+        self.dst = dst
+        self.address = address
+        self.sent = 0
+        self.samples = array.array('d')
+
+    @property
+    def received(self) -> int:
+        """Number of received echo replies"""
+        return len(self.samples)
+
+    @property
+    def loss(self) -> float:
+        """Fraction of lost echo requests"""
+        if not self.sent:
+            return 0.0
+        return 1 - self.received / self.sent
+
+    @property
+    def min(self) -> float:
+        """Minimum round trip time"""
+        return min(self.samples) if self.samples else math.nan
+
+    @property
+    def max(self) -> float:
+        """Maximum round trip time"""
+        return max(self.samples) if self.samples else math.nan
+
+    @property
+    def mean(self) -> float:
+        """Mean round trip time"""
+        return math.fsum(self.samples) / len(self.samples) if self.samples else math.nan
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation of the round trip time"""
+        if len(self.samples) < 2:
+            return math.nan
+        mean = self.mean
+        return math.sqrt(math.fsum((x - mean)**2 for x in self.samples) / (len(self.samples) - 1))
+
+    def __repr__(self) -> str:
+        return ("<RTTResult {}->{} sent={} received={} min={:.3f} mean={:.3f} max={:.3f} "
+                "std={:.3f}>").format(self.src, self.dst, self.sent, self.received, self.min,
+                                      self.mean, self.max, self.std)
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(array.array('H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return socket.htons(~total & 0xffff)
+
+def _destination(dst: Union[Host, str, ipaddress.IPv4Address, ipaddress.IPv6Address]
+                ) -> Tuple[str, Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    if isinstance(dst, Host):
+        addresses = sorted((address.ip for intf in dst.interfaces.values()
+                            for address in intf.addresses),
+                           key=lambda address: (address.version, address))
+        if not addresses:
+            raise ValueError("Host {} has no address".format(dst.name))
+        return dst.name, addresses[0]
+    address = ipaddress.ip_address(str(dst))
+    return str(address), address
+
+class _Probe(object): #pylint: disable=too-few-public-methods
+    """State of one host pair during the measurement"""
+    def __init__(self, src: Host, dst, ident: int) -> None:
+        name, address = _destination(dst)
+        self.result = RTTResult(src.name, name, address)
+        self.ident = ident
+        self.pending = {}
+        if address.version == 4:
+            self.sock = src.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.request, self.reply = _ICMP_ECHO_REQUEST, _ICMP_ECHO_REPLY
+        else:
+            self.sock = src.socket(socket.AF_INET6, socket.SOCK_RAW, socket.IPPROTO_ICMPV6)
+            self.request, self.reply = _ICMPV6_ECHO_REQUEST, _ICMPV6_ECHO_REPLY
+        self.sock.setblocking(False)
+
+    def send(self, seq: int) -> None:
+        """Send echo request seq"""
+        packet = _ICMP.pack(self.request, 0, 0, self.ident, seq)
+        if self.request == _ICMP_ECHO_REQUEST:
+            # the kernel calculates ICMPv6 checksums
+            packet = _ICMP.pack(self.request, 0, _checksum(packet), self.ident, seq)
+        self.pending[seq] = time.monotonic()
+        self.result.sent += 1
+        try:
+            self.sock.sendto(packet, (str(self.result.address), 0))
+        except OSError:
+            pass # counts as lost
+
+    def receive(self) -> None:
+        """Receive all available echo replies"""
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except BlockingIOError:
+                return
+            now = time.monotonic()
+            if self.request == _ICMP_ECHO_REQUEST:
+                data = data[(data[0] & 0xf)*4:] # strip ip header
+            if len(data) < _ICMP.size:
+                continue
+            msgtype, _, _, ident, seq = _ICMP.unpack_from(data)
+            if msgtype != self.reply or ident != self.ident:
+                continue
+            sent = self.pending.pop(seq, None)
+            if sent is not None:
+                self.result.samples.append((now - sent) * 1000)
+
+def measure_rtt(pairs: Sequence[Tuple[Host, Union[Host, str]]], count: int = 10,
+                interval: float = 0.01, timeout: float = 1.0
+               ) -> Dict[Tuple[str, str], RTTResult]:
+    """Measure the round trip time between many host pairs at the same time.
+
+    Args:
+        pairs: Sequence of (source host, destination) pairs. The destination can be a Host,
+            whose lowest address is used, or an address.
+        count: Number of echo requests per pair.
+        interval: Time between echo requests of a pair in seconds.
+        timeout: Time to wait for outstanding replies after the last request in seconds.
+
+    Returns:
+        Ordered mapping from (source name, destination name) to RTTResult.
+    """
+    probes = []
+    idents = itertools.count(os.getpid() & 0xffff)
+    selector = selectors.DefaultSelector()
+    try:
+        for src, dst in pairs:
+            probe = _Probe(src, dst, next(idents) & 0xffff)
+            selector.register(probe.sock, selectors.EVENT_READ, probe)
+            probes.append(probe)
+
+        start = time.monotonic()
+        end = start + (count - 1) * interval + timeout
+        seq = 0
+        while True:
+            now = time.monotonic()
+            while seq < count and start + seq * interval <= now:
+                for probe in probes:
+                    probe.send(seq)
+                seq += 1
+            if seq == count and (now >= end or not any(probe.pending for probe in probes)):
+                break
+            deadline = end if seq == count else start + seq * interval
+            for key, _ in selector.select(max(0, deadline - now)):
+                key.data.receive()
+    finally:
+        for probe in probes:
+            selector.unregister(probe.sock)
+            probe.sock.close()
+        selector.close()
+
+    results = collections.OrderedDict()
+    for probe in probes:
+        results[(probe.result.src, probe.result.dst)] = probe.result
+    return results
@@ -0,0 +1,250 @@
+"""Mountns module.
+
+This module keeps a mount and a UTS namespace per Host, which are set up once when the Host
+starts: /sys belongs to the network namespace of the host, the hostname is the name of the host,
+and /etc is an overlay of the real /etc with the files of the host on top. The namespaces are
+kept alive by bind mounts below /run/virtnet/ns, so every process of the host just enters them
+with setns. Starting a process costs the same, no matter how many files of /etc are changed.
+
+Without overlayfs, the files of the host are bind mounted one by one into the mount namespace,
+still only once per host. Then only files already existing in /etc can be replaced.
+
+The files of a host live in /run/virtnet/etc/<host>/upper and are changed with Etc (see
+Host.etc), which writes them from inside the mount namespace of the host, so they are never
+changed below a mounted overlay.
+"""
+
+from typing import Mapping, Sequence, Union
+import errno
+import fcntl
+import functools
+import os
+import pathlib
+import shutil
+import socket
+import subprocess
+import threading
+from pyroute2.netns import setns
+from . import syscalls
+
+RUN_DIR = pathlib.Path('/run/virtnet')
+NS_DIR = RUN_DIR / 'ns'
+HOST_ETC_DIR = RUN_DIR / 'etc'
+ETC_DIR = pathlib.Path('/etc')
+
+# (name of the file in /proc/<pid>/ns, flag for setns) in the order of entering
+NAMESPACES = (('uts', syscalls.CLONE_NEWUTS), ('mnt', syscalls.CLONE_NEWNS))
+
+_LOCK = threading.Lock()
+_PRIVATE = []
+
+# held while creating namespaces and by other code forking without exec (e.g. pyroute2 NetNS, and
+# IPDB, which clones its NetNS), since such a fork keeps the pipes of subprocess open and create
+# would wait forever
+FORK_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def overlay() -> bool:
+    """Return True if overlayfs is available, so /etc of hosts is an overlay, False if files
+    are bind mounted"""
+    with open('/proc/filesystems') as filesystems:
+        return any(line.split()[-1] == 'overlay' for line in filesystems if line.strip())
+
+def upper(name: str) -> pathlib.Path:
+    """Return the directory with the files of host name"""
+    return HOST_ETC_DIR / name / 'upper'
+
+def _path(name: str, kind: str) -> pathlib.Path:
+    return NS_DIR / "{}.{}".format(name, kind)
+
+def _make_private() -> None:
+    # namespace files can only be bind mounted on a private mount, see unshare(1)
+    with _LOCK:
+        if _PRIVATE:
+            return
+        os.makedirs(str(NS_DIR), exist_ok=True)
+        target = str(NS_DIR).encode()
+        # other processes (e.g. cluster workers) may do the same, so the check and the mount
+        # are serialized by a lock file
+        with open(str(RUN_DIR / 'ns.lock'), 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            with open('/proc/self/mountinfo', 'rb') as mountinfo:
+                mounted = any(line.split()[4] == target for line in mountinfo)
+            if not mounted:
+                syscalls.mount(target, target, b"none", syscalls.MS_BIND, None)
+            syscalls.mount(b"none", target, None, syscalls.MS_PRIVATE, None)
+        _PRIVATE.append(True)
+
+def _setup(name: str, use_overlay: bool) -> None:
+    """Create the namespaces of host name in the calling process"""
+    setns(name, flags=0)
+    syscalls.unshare(syscalls.CLONE_NEWNS | syscalls.CLONE_NEWUTS)
+
+    # Make our mounts slave (otherwise unshare doesn't help with shared mounts)
+    syscalls.mount(b"none", b"/", None, syscalls.MS_REC | syscalls.MS_SLAVE, None)
+
+    # Mount sysfs that belongs to this network namespace
+    syscalls.umount2(b"/sys", syscalls.MNT_DETACH)
+    syscalls.mount(b"none", b"/sys", b"sysfs", 0, None)
+
+    socket.sethostname(name)
+
+    files = upper(name)
+    if use_overlay:
+        options = "lowerdir={},upperdir={},workdir={}".format(ETC_DIR, files,
+                                                              files.parent / 'work')
+        syscalls.mount(b"overlay", bytes(ETC_DIR), b"overlay", 0, options.encode())
+        return
+    for directory, _, names in os.walk(str(files)):
+        for filename in names:
+            src = pathlib.Path(directory) / filename
+            syscalls.mount(bytes(src), bytes(ETC_DIR / src.relative_to(files)), b"none",
+                           syscalls.MS_BIND, None)
+
+def create(name: str, files: Mapping[str, bytes], reset: bool = True) -> None:
+    """Create the namespaces of host name, whose network namespace must exist already.
+
+    Args:
+        name: Name of the host.
+        files: Content of files relative to /etc, e.g. {'hosts': b'...'}.
+        reset: Remove files left from before instead of keeping them.
+    """
+    _make_private()
+    files_dir = upper(name)
+    if reset:
+        # the work directory of overlayfs must be empty as well
+        shutil.rmtree(str(files_dir.parent), ignore_errors=True)
+    os.makedirs(str(files_dir), exist_ok=True)
+    os.makedirs(str(files_dir.parent / 'work'), exist_ok=True)
+    for filename, data in files.items():
+        path = files_dir / filename
+        if reset or not path.exists():
+            os.makedirs(str(path.parent), exist_ok=True)
+            path.write_bytes(data)
+
+    # the process holds the namespaces until they are bind mounted
+    use_overlay = overlay()
+    with FORK_LOCK:
+        process = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   preexec_fn=lambda: _setup(name, use_overlay))
+    try:
+        for kind, _ in NAMESPACES:
+            path = _path(name, kind)
+            path.touch()
+            syscalls.mount("/proc/{}/ns/{}".format(process.pid, kind).encode(), bytes(path),
+                           b"none", syscalls.MS_BIND, None)
+    except:
+        _unmount(name)
+        raise
+    finally:
+        # killed, since processes forked before by pyroute2 may hold the pipe open
+        process.kill()
+        process.wait()
+        process.stdin.close()
+
+def exists(name: str) -> bool:
+    """Return True if the namespaces of host name exist"""
+    with open('/proc/self/mountinfo', 'rb') as mountinfo:
+        return any(line.split()[4] == bytes(_path(name, 'mnt')) for line in mountinfo)
+
+def open_namespaces(name: str) -> Sequence[int]:
+    """Return file descriptors of the namespaces of host name for enter"""
+    ret = []
+    try:
+        for kind, _ in NAMESPACES:
+            ret.append(os.open(str(_path(name, kind)), os.O_RDONLY))
+    except:
+        for fd in ret:
+            os.close(fd)
+        raise
+    return ret
+
+def enter(name: str, fds: Sequence[int] = None) -> None:
+    """Move the calling process into the namespaces of host name. The process must be single
+    threaded, e.g. forked. fds from open_namespaces are closed."""
+    if fds is None:
+        fds = open_namespaces(name)
+    # entering a mount namespace changes to its root directory
+    cwd = os.getcwd()
+    setns(name, flags=0)
+    for fd, (_, flag) in zip(fds, NAMESPACES):
+        syscalls.setns(fd, flag)
+        os.close(fd)
+    os.chdir(cwd)
+
+def _unmount(name: str) -> None:
+    # also cleans up after a failed create, where some paths are not mounted or don't exist
+    for kind, _ in NAMESPACES:
+        path = _path(name, kind)
+        try:
+            syscalls.umount2(bytes(path), syscalls.MNT_DETACH)
+        except OSError as err:
+            if err.errno not in (errno.EINVAL, errno.ENOENT):
+                raise
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+def remove(name: str) -> None:
+    """Remove the namespaces and files of host name. Processes still inside keep them alive."""
+    _unmount(name)
+    shutil.rmtree(str(HOST_ETC_DIR / name), ignore_errors=True)
+
+def _write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as target:
+        target.write(data)
+
+def _bind(src: str, dst: str) -> None:
+    syscalls.mount(src.encode(), dst.encode(), b"none", syscalls.MS_BIND, None)
+
+class Etc(object):
+    """Files in /etc of a host, given relative to /etc, e.g. host.etc['resolv.conf'] = b'...'.
+
+    Files are written inside the mount namespace of the host by its helper process. With
+    overlayfs, they end up in the upper directory; without, files changed before are rewritten
+    through their bind mount and other files are bind mounted.
+
+    Args:
+        host: Host, whose helper is used.
+    """
+    __slots__ = ('__host',)
+
+    def __init__(self, host) -> None:
+        self.__host = host
+
+    def path(self, filename: str) -> pathlib.Path:
+        """Return the path outside of the host of a file changed for the host"""
+        path = pathlib.PurePosixPath(filename)
+        if path.is_absolute() or '..' in path.parts:
+            raise ValueError("Invalid file in /etc: {}".format(filename))
+        return upper(self.__host.name) / path
+
+    def read(self, filename: str) -> bytes:
+        """Return the content of a file as seen by the host"""
+        path = self.path(filename)
+        if not path.is_file():
+            path = ETC_DIR / filename
+        return path.read_bytes()
+
+    def write(self, filename: str, data: Union[bytes, str]) -> None:
+        """Replace or create a file"""
+        if isinstance(data, str):
+            data = data.encode()
+        path = self.path(filename)
+        if overlay() or path.is_file():
+            self.__host.call(_write, str(ETC_DIR / filename), data)
+        else:
+            self.__host.call(_write, str(path), data)
+            try:
+                self.__host.call(_bind, str(path), str(ETC_DIR / filename))
+            except:
+                path.unlink()
+                raise
+
+    def __getitem__(self, filename: str) -> bytes:
+        return self.read(filename)
+
+    def __setitem__(self, filename: str, data: Union[bytes, str]) -> None:
+        self.write(filename, data)
@@ -0,0 +1,130 @@
+"""Netns module.
+
+This module runs functions inside network namespaces. Namespaces are a per thread property, so
+a thread inside a namespace can open sockets or files belonging to it on behalf of the rest of
+the process. A single worker thread serves all namespaces: it enters the namespace of every
+function before running it and returns to its own namespace when idle, so no thread is kept
+per namespace and no namespace is kept alive by the worker.
+"""
+
+from typing import Callable, Any, Optional
+import logging
+import os
+import queue
+import threading
+from pyroute2.netns import NETNS_RUN_DIR
+from . import syscalls
+
+LOG = logging.getLogger(__name__)
+
+def enter(name: str) -> None:
+    """Move the calling thread into the network namespace name"""
+    nsfd = os.open(os.path.join(NETNS_RUN_DIR, name), os.O_RDONLY)
+    try:
+        syscalls.setns(nsfd, syscalls.CLONE_NEWNET)
+    finally:
+        os.close(nsfd)
+
+class _Worker(object): #pylint: disable=too-few-public-methods
+    """Thread executing functions inside network namespaces"""
+    def __init__(self) -> None:
+        self.__queue = queue.Queue()
+        self.__home = None
+        started = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(started,),
+                                         name="virtnet-netns", daemon=True)
+        self.__thread.start()
+        started.wait()
+
+    def __run(self, started: threading.Event) -> None:
+        self.__home = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+        started.set()
+        away = False
+        while True:
+            name, func, args, kwargs, done = self.__queue.get()
+            try:
+                if name is not None:
+                    enter(name)
+                    away = True
+                result, error = func(*args, **kwargs), None
+            except BaseException as err: # pylint: disable=broad-except
+                result, error = None, err
+            try:
+                done(result, error)
+            except Exception: # pylint: disable=broad-except
+                # the worker serves every namespace, so it must survive callbacks
+                LOG.exception("Callback of a function in namespace %s failed", name)
+            if away and self.__queue.empty():
+                # don't keep the namespace alive after it is removed
+                syscalls.setns(self.__home, syscalls.CLONE_NEWNET)
+                away = False
+
+    def put(self, name: Optional[str], func: Callable, args, kwargs,
+            callback: Callable[[Any, BaseException], None]) -> None:
+        """Queue func for running inside namespace name (None for the home namespace)"""
+        self.__queue.put((name, func, args, kwargs, callback))
+
+_WORKER = None
+_LOCK = threading.Lock()
+
+def _worker() -> _Worker:
+    global _WORKER # pylint: disable=global-statement
+    with _LOCK:
+        if _WORKER is None:
+            _WORKER = _Worker()
+        return _WORKER
+
+def _wait(submit: Callable[[Callable[[Any, BaseException], None]], None]) -> Any:
+    done = threading.Event()
+    ret = []
+    def callback(result, error):
+        ret.extend((result, error))
+        done.set()
+    submit(callback)
+    done.wait()
+    result, error = ret
+    if error is not None:
+        raise error
+    return result
+
+class NamespaceThread(object):
+    """Executes functions inside a network namespace for other threads. All instances share
+    one worker thread, so functions run one after another and must not block or call into
+    another NamespaceThread.
+
+    Args:
+        name: Name of the network namespace.
+
+    Attributes:
+        name: Name of the network namespace.
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.__worker = _worker()
+        self.__running = True
+
+    @property
+    def running(self) -> bool:
+        """True until stop is called"""
+        return self.__running
+
+    def submit(self, func: Callable, *args, callback: Callable[[Any, BaseException], None],
+               **kwargs) -> None:
+        """Run func inside the namespace and call callback(result, exception) afterwards.
+
+        The callback is executed by the worker thread."""
+        self.__worker.put(self.name, func, args, kwargs, callback)
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func inside the namespace and return the result"""
+        return _wait(lambda callback: self.submit(func, *args, callback=callback, **kwargs))
+
+    def stop(self) -> None:
+        """Wait for all submitted functions to finish"""
+        if self.__running:
+            self.__running = False
+            _wait(lambda callback: self.__worker.put(None, lambda: None, (), {}, callback))
+
+def call(name: str, func: Callable, *args, **kwargs) -> Any:
+    """Run func inside the network namespace name"""
+    return NamespaceThread(name).call(func, *args, **kwargs)
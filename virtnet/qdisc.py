@@ -0,0 +1,315 @@
+"""Qdisc module.
+
+This module encodes queueing disciplines into netlink messages and remembers the configuration
+applied to every interface, so reapplying an unchanged configuration costs no netlink traffic.
+
+Qdisc kinds are looked up in the registry of pyroute2 tc plugins, which already covers tbf, htb,
+fq_codel, and cake. netem is replaced by virtnet.sched_netem_test.
+
+Wherever a qdisc kind is expected, a NetemProfile can be given instead. It is validated and
+encoded once, which pays off when the same netem configuration is applied to many interfaces
+or applied repeatedly.
+"""
+
+from typing import Dict, Any, Tuple, Union
+import errno
+import hashlib
+import struct
+import types
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_ACK, NLM_F_CREATE, NLM_F_EXCL, NLM_F_REPLACE
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.rtnl import RTM_NEWQDISC, RTM_DELQDISC, TC_H_ROOT
+from pyroute2.netlink.rtnl.tcmsg import tcmsg, plugins as tc_plugins
+from pyroute2.netlink.rtnl.tcmsg.common import get_rate
+from pyroute2.iproute.linux import transform_handle
+from . import sched_netem_test
+
+FLAGS = {
+    'add': NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_EXCL,
+    'change': NLM_F_REQUEST | NLM_F_ACK | NLM_F_REPLACE,
+    'replace': NLM_F_REQUEST | NLM_F_ACK | NLM_F_CREATE | NLM_F_REPLACE,
+}
+
+# the token bucket of tbf holds this many seconds worth of the rate, but at least BURST_MIN bytes
+BURST_TIME = 0.001
+BURST_MIN = 2 * 1514
+TBF_LATENCY = '50ms'
+
+# handles used by shaping: netem is the root 1:, tbf below it 10: in class 1:1
+NETEM_HANDLE = '1:'
+TBF_HANDLE = '10:'
+TBF_PARENT = '1:1'
+TBF_PARENT_ID = transform_handle(TBF_PARENT)
+
+def register(kind: str, plugin: types.ModuleType) -> None:
+    """Register a tc plugin (a module with get_parameters, and optionally parent and fix_msg)
+    for qdisc kind. This also makes it available to tc()."""
+    tc_plugins[kind] = plugin
+
+def plugin(kind: str) -> types.ModuleType:
+    """Return the plugin for qdisc kind"""
+    try:
+        return tc_plugins[kind]
+    except KeyError:
+        raise ValueError("Unknown qdisc {}".format(kind))
+
+register('netem', sched_netem_test)
+
+# parameters of netem given in percent
+NETEM_PERCENT = frozenset(['loss', 'delay_corr', 'loss_corr', 'dup_corr', 'prob_reorder',
+                           'corr_reorder', 'prob_corrupt', 'corr_corrupt'])
+NETEM_PARAMETERS = NETEM_PERCENT | frozenset(['delay', 'jitter', 'limit', 'gap', 'duplicate',
+                                              'dist', 'rate', 'packet_overhead', 'cell_size',
+                                              'cell_overhead'])
+
+# struct nlmsghdr followed by struct tcmsg
+_HEADER = struct.Struct("=IHHIIBxxxiIII")
+
+class NetemProfile(object):
+    """Immutable netem configuration, which is validated and encoded on creation.
+
+    Profiles can be passed instead of the kind 'netem' to tc, set_qdisc, shaping, message, and
+    request, and as profile to netem events of the Scheduler. Profiles with the same encoding
+    are equal and have the same hash.
+
+    Args:
+        params: The same as for tc('add', 'netem', ...), e.g. delay=100000 (us), loss=1.
+
+    Raises:
+        ValueError: If a parameter is unknown or out of range, or parameters don't fit together.
+    """
+    __slots__ = ('__params', '__options', '__attrs')
+
+    def __init__(self, **params) -> None:
+        unknown = set(params) - NETEM_PARAMETERS
+        if unknown:
+            raise ValueError("Unknown netem parameters {}".format(", ".join(sorted(unknown))))
+        try:
+            for key, value in params.items():
+                if key in ('dist', 'delay', 'jitter', 'rate'):
+                    continue
+                if value < 0 or (key in NETEM_PERCENT and value > 100):
+                    raise ValueError("netem parameter {} out of range: {}".format(key, value))
+            if 'dist' in params:
+                params['dist'] = tuple(params['dist'])
+            options = sched_netem_test.get_parameters(params)
+            msg = tcmsg()
+            msg['attrs'] = [['TCA_KIND', 'netem'], ['TCA_OPTIONS', options]]
+            msg.encode()
+        except ValueError:
+            raise
+        except Exception as err:
+            raise ValueError("Invalid netem parameters: {}".format(err))
+        object.__setattr__(self, '_NetemProfile__params', params)
+        object.__setattr__(self, '_NetemProfile__options', options)
+        object.__setattr__(self, '_NetemProfile__attrs', bytes(msg.data[_HEADER.size:]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("NetemProfile is immutable")
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        """Return a copy of the parameters"""
+        return dict(self.__params)
+
+    def message(self, index: int, handle=0, parent=TC_H_ROOT) -> tcmsg:
+        """Return an unencoded RTM_NEWQDISC message for this profile on interface index"""
+        msg = tcmsg()
+        msg['index'] = index
+        msg['handle'] = transform_handle(handle)
+        msg['parent'] = transform_handle(parent)
+        msg['attrs'] = [['TCA_KIND', 'netem'], ['TCA_OPTIONS', self.__options]]
+        return msg
+
+    def encode(self, index: int, handle=0, parent=TC_H_ROOT, command: str = 'replace') -> bytes:
+        """Return the request for command (add, change or replace) of this profile on
+        interface index"""
+        return _HEADER.pack(_HEADER.size + len(self.__attrs), RTM_NEWQDISC, FLAGS[command], 0,
+                            0, 0, index, transform_handle(handle), transform_handle(parent),
+                            0) + self.__attrs
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, NetemProfile) and self.__attrs == other.__attrs
+
+    def __hash__(self) -> int:
+        return hash(self.__attrs)
+
+    def __repr__(self) -> str:
+        params = ["{}={!r}".format(key, value) for key, value in sorted(self.__params.items())
+                  if key != 'dist']
+        if 'dist' in self.__params:
+            # the table is too long to show, but profiles with different tables must differ
+            dist = self.__params['dist']
+            params.append("dist=<{} values, sha1 {}>".format(
+                len(dist), hashlib.sha1(repr(dist).encode()).hexdigest()[:12]))
+        return "NetemProfile({})".format(", ".join(params))
+
+    def __reduce__(self):
+        return (_netem_profile, (self.__params,))
+
+def _netem_profile(params: Dict[str, Any]) -> NetemProfile:
+    return NetemProfile(**params)
+
+Kind = Union[str, NetemProfile]
+
+def shaping(rate=None, burst: int = None, latency=TBF_LATENCY, profile: NetemProfile = None,
+            **netem) -> Tuple[Tuple[Kind, Dict[str, Any]], ...]:
+    """Return the qdiscs as (kind, params) emulating a link with the netem params (delay, loss,
+    ...) or profile limited to rate (bytes/s or a string like '10gbit').
+
+    The rate is enforced by tbf instead of netem, which is cheaper and more accurate at high
+    rates. netem is always the root qdisc 1:; if both are needed, tbf 10: is below it in 1:1."""
+    if profile is not None:
+        if netem:
+            raise ValueError("Either a profile or netem parameters can be given")
+        kind, netem = profile, {}
+    else:
+        kind = 'netem'
+    if rate is None:
+        return ((kind, dict(netem, handle=NETEM_HANDLE)),)
+    if burst is None:
+        burst = max(int(get_rate(rate) * BURST_TIME), BURST_MIN)
+    tbf = {'rate': rate, 'burst': burst, 'latency': latency}
+    if not netem and profile is None:
+        return (('tbf', tbf),)
+    netem = dict(netem, handle=NETEM_HANDLE)
+    tbf.update(parent=TBF_PARENT, handle=TBF_HANDLE)
+    return ((kind, netem), ('tbf', tbf))
+
+def message(index: int, kind: Kind, params: Dict[str, Any]) -> tcmsg:
+    """Return an unencoded RTM_NEWQDISC message for kind with params on interface index. The
+    params are the same as for tc('add', kind, ...); for a NetemProfile only handle and parent
+    are allowed."""
+    if isinstance(kind, NetemProfile):
+        return kind.message(index, **params)
+    module = plugin(kind)
+    params = dict(params)
+    msg = tcmsg()
+    msg['index'] = index
+    msg['handle'] = transform_handle(params.pop('handle', 0))
+    msg['parent'] = transform_handle(params.pop('parent', getattr(module, 'parent', TC_H_ROOT)))
+    if hasattr(module, 'fix_msg'):
+        module.fix_msg(msg, params)
+    msg['attrs'].append(['TCA_KIND', kind])
+    if params:
+        msg['attrs'].append(['TCA_OPTIONS', module.get_parameters(params)])
+    return msg
+
+def encode(msg: tcmsg, command: str = 'replace') -> bytes:
+    """Encode msg as request for command (add, change or replace)"""
+    msg['header']['type'] = RTM_NEWQDISC
+    msg['header']['flags'] = FLAGS[command]
+    msg.encode()
+    return msg.data
+
+def request(index: int, kind: Kind, params: Dict[str, Any], command: str = 'replace') -> bytes:
+    """Return the encoded request for command (add, change or replace) of kind with params on
+    interface index. This is cheap for a NetemProfile."""
+    if isinstance(kind, NetemProfile):
+        return kind.encode(index, command=command, **params)
+    return encode(message(index, kind, params), command)
+
+class TrafficControl(object):
+    """Mixin for interfaces providing tc and cached qdisc configuration.
+
+    Classes using this mixin need to add SLOTS to their __slots__.
+
+    Attributes:
+        qdisc_writes: Number of qdisc configurations sent to the kernel by set_qdisc.
+        qdisc_skips: Number of set_qdisc calls skipped, because nothing changed.
+    """
+    __slots__ = ()
+    SLOTS = ('qdisc_writes', 'qdisc_skips', '_TrafficControl__qdiscs')
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.qdisc_writes = 0
+        self.qdisc_skips = 0
+        self.__qdiscs = {} # type: Dict[int, Tuple[str, int, bytes]]
+        super().__init__(*args, **kwargs)
+
+    def tc(self, *args, **kwargs): #pylint: disable=invalid-name
+        "call tc on this interface; a NetemProfile can be given instead of the kind 'netem'"
+        # the result is unknown to set_qdisc, so start over
+        self.__qdiscs.clear()
+        if len(args) > 1 and isinstance(args[1], NetemProfile):
+            if args[0] in FLAGS:
+                msg = args[1].message(self.interface.index, **kwargs)
+                return self.ipdb.nl.nlm_request(msg, msg_type=RTM_NEWQDISC,
+                                                msg_flags=FLAGS[args[0]])
+            args = (args[0], 'netem') + args[2:]
+        return self.ipdb.nl.tc(*args, index=self.interface.index, **kwargs)
+
+    def set_qdisc(self, kind: Kind, **params) -> bool:
+        """Configure qdisc kind (or a NetemProfile) with params (like tc('add', kind, ...)) on
+        this interface.
+
+        The qdisc is added, changed, or replaced as needed. Nothing is sent if the same
+        configuration was already applied by set_qdisc. Returns True if the kernel was updated."""
+        if isinstance(kind, NetemProfile):
+            # the profile itself identifies the configuration
+            handle = transform_handle(params.get('handle', 0))
+            parent = transform_handle(params.get('parent', TC_H_ROOT))
+            state = ('netem', handle, kind) # type: Tuple[str, int, Any]
+        else:
+            msg = message(self.interface.index, kind, params)
+            state = (kind, msg['handle'], encode(msg, 'replace'))
+            parent = msg['parent']
+        current = self.__qdiscs.get(parent)
+        if current == state:
+            self.qdisc_skips += 1
+            return False
+        if current is None:
+            command = 'add'
+        elif current[:2] == state[:2]:
+            command = 'change'
+        else:
+            command = 'replace'
+        try:
+            self.__send(kind, params, command)
+        except NetlinkError as err:
+            if command != 'add' or err.code != errno.EEXIST:
+                raise
+            command = 'replace'
+            self.__send(kind, params, command)
+        if parent == TC_H_ROOT and command != 'change':
+            # a new root qdisc drops all children
+            self.__qdiscs.clear()
+        self.__qdiscs[parent] = state
+        self.qdisc_writes += 1
+        return True
+
+    def shape(self, rate=None, **params) -> bool:
+        """Emulate a link with netem params or a profile and rate (see shaping) using
+        set_qdisc. Returns True if the kernel was updated."""
+        qdiscs = shaping(rate, **params)
+        # without a cached root, a tbf may be left below netem from before
+        stale = TC_H_ROOT not in self.__qdiscs or TBF_PARENT_ID in self.__qdiscs
+        written = False
+        for kind, qdisc_params in qdiscs:
+            written = self.set_qdisc(kind, **qdisc_params) or written
+        if len(qdiscs) == 1 and qdiscs[0][1].get('handle') == NETEM_HANDLE and stale:
+            # changing netem keeps its child, so the tbf of a previous rate is removed
+            written = self.__remove_tbf() or written
+        return written
+
+    def __remove_tbf(self) -> bool:
+        msg = tcmsg()
+        msg['index'] = self.interface.index
+        msg['handle'] = transform_handle(TBF_HANDLE)
+        msg['parent'] = TBF_PARENT_ID
+        self.__qdiscs.pop(TBF_PARENT_ID, None)
+        try:
+            self.ipdb.nl.nlm_request(msg, msg_type=RTM_DELQDISC)
+        except NetlinkError as err:
+            if err.code not in (errno.ENOENT, errno.EINVAL):
+                raise
+            return False
+        return True
+
+    def __send(self, kind: Kind, params: Dict[str, Any], command: str) -> None:
+        msg = message(self.interface.index, kind, params)
+        self.ipdb.nl.nlm_request(msg, msg_type=RTM_NEWQDISC, msg_flags=FLAGS[command])
+
+    def forget_qdisc(self) -> None:
+        """Forget the cached qdisc configuration, e.g. after changing it with other tools"""
+        self.__qdiscs.clear()
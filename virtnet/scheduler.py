@@ -0,0 +1,205 @@
+"""Scheduler module.
+
+This module executes timelines of faults (link up/down, netem changes, switch port
+detach/attach, host stops) at precise points in time. Interface indices are resolved and
+netlink messages are encoded before the timeline starts, so executing an event is a single
+send on an already open netlink socket.
+"""
+
+from typing import Callable, Any, List, Optional
+import collections
+import socket
+import threading
+import time
+from pyroute2.netlink import NLM_F_REQUEST, NLM_F_ACK, NLMSG_ERROR
+from pyroute2.netlink.rtnl import RTM_NEWLINK
+from pyroute2.netlink.rtnl.ifinfmsg import ifinfmsg, IFF_UP
+from pyroute2.netlink.rtnl.marshal import MarshalRtnl
+from . container import Interface, InterfaceContainer
+from . import netns
+from . import qdisc
+
+NETLINK_ROUTE = 0
+
+ACTIONS = ('down', 'up', 'netem', 'detach', 'attach', 'stop', 'call')
+
+# sleep until this many seconds before an event and busy wait for the rest
+SPIN = 0.002
+
+TimelineEvent = collections.namedtuple('TimelineEvent', ['time', 'action', 'target', 'params'])
+TimelineEvent.__doc__ = """Event at time seconds after start applying action to target"""
+
+LogEntry = collections.namedtuple('LogEntry', ['planned', 'actual', 'event', 'error'])
+LogEntry.__doc__ = """Executed event with planned and actual time relative to the start in seconds
+and the error, if the event failed"""
+
+def _link_message(index: int, **attrs) -> bytes:
+    msg = ifinfmsg()
+    msg['index'] = index
+    if 'up' in attrs:
+        msg['change'] = IFF_UP
+        msg['flags'] = IFF_UP if attrs['up'] else 0
+    if 'master' in attrs:
+        msg['attrs'].append(['IFLA_MASTER', attrs['master']])
+    msg['header']['type'] = RTM_NEWLINK
+    msg['header']['flags'] = NLM_F_REQUEST | NLM_F_ACK
+    msg.encode()
+    return msg.data
+
+def _owner(intf: Interface) -> Optional[InterfaceContainer]:
+    """Return the container intf belongs to, if it is part of a link"""
+    link = getattr(intf, 'parent', None)
+    if link is None:
+        return None
+    if intf is link.main:
+        return link.peers[0]
+    if intf is link.peer:
+        return link.peers[1]
+    return None
+
+class _Step(object): #pylint: disable=too-few-public-methods
+    """Prepared event. done is called after the message succeeded, e.g. for bookkeeping."""
+    def __init__(self, event: TimelineEvent, sock: Optional[socket.socket] = None,
+                 message: bytes = None, function: Callable[[], Any] = None,
+                 done: Callable[[], Any] = None) -> None:
+        self.event = event
+        self.sock = sock
+        self.message = message
+        self.function = function
+        self.done = done
+
+class Scheduler(object):
+    """Scheduler executing a timeline of events on a monotonic clock.
+
+    Actions and their targets:
+
+    * down, up: Interface
+    * netem: Interface; the params are the same as for tc('add', 'netem', ...), or
+      profile=NetemProfile with optional handle and parent
+    * detach: Interface attached to a Switch, with optional params switch=Switch; attach:
+      Interface, with params switch=Switch. The interfaces of the Switch are updated as well.
+    * stop: container like Host
+    * call: callable, which is called with params
+
+    Attributes:
+        events: The timeline.
+        log: List of LogEntry of executed events.
+    """
+    def __init__(self) -> None:
+        self.events = [] # type: List[TimelineEvent]
+        self.log = [] # type: List[LogEntry]
+        self.__steps = None
+        self.__sockets = {}
+        self.__thread = None
+
+    def add(self, at: float, action: str, target, **params) -> TimelineEvent:
+        """Add an event at the given time in seconds after the start"""
+        if action not in ACTIONS:
+            raise ValueError("Unknown action {}".format(action))
+        event = TimelineEvent(at, action, target, params)
+        self.events.append(event)
+        self.__steps = None
+        return event
+
+    def extend(self, timeline) -> None:
+        """Add (time, action, target[, params]) tuples"""
+        for entry in timeline:
+            self.add(entry[0], entry[1], entry[2], **(entry[3] if len(entry) > 3 else {}))
+
+    def _socket(self, intf: Interface) -> socket.socket:
+        namespace = intf.namespace
+        if namespace not in self.__sockets:
+            if namespace is None:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+            else:
+                sock = netns.call(namespace, socket.socket, socket.AF_NETLINK, socket.SOCK_RAW,
+                                  NETLINK_ROUTE)
+            sock.bind((0, 0))
+            self.__sockets[namespace] = sock
+        return self.__sockets[namespace]
+
+    def _prepare(self, event: TimelineEvent) -> _Step:
+        target = event.target
+        if event.action in ('down', 'up'):
+            return _Step(event, self._socket(target),
+                         _link_message(target.interface.index, up=event.action == 'up'))
+        if event.action == 'netem':
+            params = dict(event.params)
+            kind = params.pop('profile', 'netem')
+            return _Step(event, self._socket(target),
+                         qdisc.request(target.interface.index, kind, params),
+                         done=target.forget_qdisc)
+        if event.action == 'detach':
+            switch = event.params.get('switch') or _owner(target)
+            return _Step(event, self._socket(target),
+                         _link_message(target.interface.index, master=0),
+                         done=None if switch is None else
+                         lambda: switch.detach_interface(target.name))
+        if event.action == 'attach':
+            switch = event.params['switch']
+            # the port is set by the message, so only the container bookkeeping is left
+            return _Step(event, self._socket(target),
+                         _link_message(target.interface.index,
+                                       master=switch.ipdb.interfaces[switch.name].index),
+                         done=lambda: InterfaceContainer.attach_interface(switch, target))
+        if event.action == 'stop':
+            return _Step(event, function=target.stop)
+        return _Step(event, function=lambda: target(**event.params))
+
+    def prepare(self) -> None:
+        """Resolve interfaces and encode all messages. This is done by run, if needed."""
+        self.__steps = [self._prepare(event)
+                        for event in sorted(self.events, key=lambda event: event.time)]
+
+    @staticmethod
+    def _check(sock: socket.socket) -> None:
+        for msg in MarshalRtnl().parse(sock.recv(1 << 16)):
+            if msg['header']['type'] == NLMSG_ERROR and msg['header']['error'] is not None:
+                raise msg['header']['error']
+
+    def run(self) -> List[LogEntry]:
+        """Execute the timeline and return the log"""
+        if self.__steps is None:
+            self.prepare()
+        self.log = []
+        start = time.monotonic()
+        for step in self.__steps:
+            deadline = start + step.event.time
+            remaining = deadline - time.monotonic()
+            if remaining > SPIN:
+                time.sleep(remaining - SPIN)
+            while time.monotonic() < deadline:
+                pass
+            actual = time.monotonic() - start
+            error = None
+            try:
+                if step.message is not None:
+                    step.sock.send(step.message)
+                    self._check(step.sock)
+                    if step.done is not None:
+                        step.done()
+                else:
+                    step.function()
+            except Exception as err: # pylint: disable=broad-except
+                error = err
+            self.log.append(LogEntry(step.event.time, actual, step.event, error))
+        return self.log
+
+    def start(self) -> None:
+        """Execute the timeline in a background thread"""
+        if self.__steps is None:
+            self.prepare()
+        self.__thread = threading.Thread(target=self.run, name="virtnet-scheduler", daemon=True)
+        self.__thread.start()
+
+    def join(self, timeout: float = None) -> List[LogEntry]:
+        """Wait for a timeline started with start and return the log"""
+        self.__thread.join(timeout)
+        return self.log
+
+    def close(self) -> None:
+        """Close all netlink sockets"""
+        for sock in self.__sockets.values():
+            sock.close()
+        self.__sockets.clear()
+        self.__steps = None
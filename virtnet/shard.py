@@ -0,0 +1,131 @@
+"""Shard module.
+
+This module builds a large Topology with several worker processes, which is not limited by the
+GIL and the netlink message parsing of a single process. The specification is split into shards
+at the links between routers; everything else connected (e.g. a router with its LAN) stays in
+one shard. Every worker builds its shard with its own netlink sockets and returns the manifest
+of it without removing anything. The main process attaches to all shards with one Manager,
+and creates the links between the shards. Routes are left to the caller, e.g.
+Manager.simple_route, since they depend on the whole topology.
+
+Workers are started with the spawn method, so they inherit no netlink socket or thread of this
+process. As with every spawned process, the main script must be guarded by
+``if __name__ == '__main__':``.
+"""
+
+from typing import Dict, Any, List, Union
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+from . context import Manager
+from . topology import Topology, CONTAINERS, DEFAULT_WORKERS, load_spec, _normalize, \
+    _switch_networks
+
+def partition(spec: Dict[str, Any], shards: int) -> List[List[str]]:
+    """Split the container names of spec into at most shards groups of similar size. Only links
+    between two routers connect different groups."""
+    spec = _normalize(spec)
+    kinds = {name: kind for kind in CONTAINERS for name in spec[kind]}
+    parent = {name: name for name in kinds}
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+    def union(first, second):
+        parent[find(first)] = find(second)
+    for link in spec['links'].values():
+        if kinds[link['from']] != 'routers' or kinds[link['to']] != 'routers':
+            union(link['from'], link['to'])
+    # switches sharing a network draw addresses from the same Network
+    owners = {}
+    for name, switch in spec['switches'].items():
+        for network in _switch_networks(switch):
+            union(owners.setdefault(network, name), name)
+
+    groups = collections.OrderedDict()
+    for name in kinds:
+        groups.setdefault(find(name), []).append(name)
+    # groups are kept in the order of the specification, since neighbours are often close
+    size = -(-len(kinds) // max(1, shards))
+    ret = [[]]
+    for group in groups.values():
+        if ret[-1] and len(ret[-1]) + len(group) > size and len(ret) < shards:
+            ret.append([])
+        ret[-1].extend(group)
+    return ret
+
+def _subspec(spec: Dict[str, Any], names: List[str]) -> Dict[str, Any]:
+    names = set(names)
+    ret = {kind: {name: value for name, value in spec[kind].items() if name in names}
+           for kind in CONTAINERS}
+    networks = {network for switch in ret['switches'].values()
+                for network in _switch_networks(switch)}
+    ret['networks'] = {name: value for name, value in spec['networks'].items()
+                       if name in networks}
+    ret['links'] = [link for link in spec['links'].values()
+                    if link['from'] in names and link['to'] in names]
+    return ret
+
+def _build(spec: Dict[str, Any], workers: int) -> Dict[str, Any]:
+    """Build spec in a worker process and return its manifest. A partially built shard is
+    removed again."""
+    with Manager() as manager:
+        Topology(spec, workers=workers, manager=manager)
+        ret = manager.manifest()
+        manager.detach()
+    return ret
+
+def build(manager: Manager, spec: Union[Dict[str, Any], str], shards: int = None,
+          workers: int = DEFAULT_WORKERS) -> Topology:
+    """Build spec with several processes and attach to the result.
+
+    Args:
+        manager: Manager the topology is registered with.
+        spec: Specification of the topology, see virtnet.topology.
+        shards: Number of worker processes. Defaults to the number of cpus.
+        workers: Number of threads per process.
+
+    Returns:
+        The Topology, which can be changed with apply like any other.
+    """
+    with manager.timed('shard_build'):
+        return _build_shards(manager, spec, shards, workers)
+
+def _build_shards(manager: Manager, spec: Union[Dict[str, Any], str], shards: int,
+                  workers: int) -> Topology:
+    if isinstance(spec, str):
+        spec = load_spec(spec)
+    normalized = _normalize(spec)
+    parts = [_subspec(normalized, names)
+             for names in partition(spec, shards or os.cpu_count() or 1)]
+    manifests = []
+    error = None
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(len(parts), mp_context=context) as executor:
+        for future in [executor.submit(_build, part, workers) for part in parts]:
+            try:
+                manifests.append(future.result())
+            except Exception as err: # pylint: disable=broad-except
+                error = error or err
+    # attach to every shard built, so that manager removes them in any case
+    containers = {}
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for attached in executor.map(manager.attach, manifests):
+            containers.update(attached)
+    if error is not None:
+        raise error
+
+    built = {kind: {} for kind in CONTAINERS}
+    built['networks'] = normalized['networks']
+    built['links'] = []
+    for part in parts:
+        for kind in CONTAINERS:
+            built[kind].update(part[kind])
+        built['links'].extend(part['links'])
+    topology = Topology(workers=workers, manager=manager)
+    topology.adopt(built, containers)
+    # only the links between shards are left to create
+    topology.apply(spec)
+    return topology
@@ -6,8 +6,9 @@ Todo:
     * Implement like everything!
 """
 
+from typing import Union, Sequence
 import pyroute2.ipdb.main
-from . iproute import IPDB
+from . iproute import IPDB, lock, interface
 from . container import InterfaceContainer, Interface
 from . context import Manager
 from . address import Network
@@ -31,17 +32,26 @@ class Switch(InterfaceContainer):
 
     Attributes:
         name: Name of the switch = interface name.
-        network: A Network to draw ipaddresses from
+        network: A Network or a sequence of Networks (e.g. IPv4 and IPv6) to draw
+            ipaddresses from
         ipdb: IPDB
+        attach: Attach to an already existing bridge instead of creating one.
     """
-    def __init__(self, name: str, network: Network = None,
+    __slots__ = ('__intf', '__manager', '__networks', '__attach')
+
+    def __init__(self, name: str, network: Union[Network, Sequence[Network]] = None,
                  ipdb: pyroute2.ipdb.main.IPDB = None,
-                 manager: Manager = None) -> None:
+                 manager: Manager = None, attach: bool = False) -> None:
         if ipdb is None:
             ipdb = IPDB
         self.__intf = None
         self.__manager = manager
-        self.__network = network
+        if network is None:
+            network = []
+        elif isinstance(network, Network):
+            network = [network]
+        self.__networks = tuple(network)
+        self.__attach = attach
         super().__init__(name, ipdb)
 
     @property
@@ -56,12 +66,19 @@ class Switch(InterfaceContainer):
 
     @property
     def network(self):
-        """Return a network to draw addresses from upon connect"""
-        return self.__network
+        """Return the first network to draw addresses from upon connect"""
+        return self.__networks[0] if self.__networks else None
+
+    @property
+    def networks(self) -> Sequence[Network]:
+        """Return all networks to draw addresses from upon connect"""
+        return self.__networks
 
     def attach_interface(self, intf: Interface) -> None:
         """Attach peer part of VirtualInterface"""
-        self.__intf.add_port(intf.interface).commit()
+        with lock(self.ipdb):
+            if intf.interface.index not in self.__intf.ports:
+                self.__intf.add_port(intf.interface).commit()
         super().attach_interface(intf)
 
     def start(self) -> None:
@@ -69,10 +86,18 @@ class Switch(InterfaceContainer):
 
         Raises:
             SwitchUpException: If switch is already running.
+            SwitchDownException: If the bridge to attach to does not exist.
         """
         if self.__intf is not None:
             raise SwitchUpException()
-        self.__intf = self.ipdb.create(kind="bridge", ifname=self.name).up().commit()
+        if self.__attach:
+            try:
+                self.__intf = interface(self.ipdb, self.name)
+            except KeyError:
+                raise SwitchDownException(self.name)
+        else:
+            with lock(self.ipdb):
+                self.__intf = self.ipdb.create(kind="bridge", ifname=self.name).up().commit()
         if self.__manager is not None:
             self.__manager.register(self)
 
@@ -82,7 +107,7 @@ class Switch(InterfaceContainer):
 
     @stp.setter
     def stp(self, value):
-        with self.__intf as intf:
+        with lock(self.ipdb), self.__intf as intf:
             intf.br_stp_state = 0
 
     def stop(self) -> None:
@@ -93,7 +118,8 @@ class Switch(InterfaceContainer):
         """
         if self.__intf is None:
             raise SwitchDownException()
-        self.__intf.down().remove().commit()
+        with lock(self.ipdb):
+            self.__intf.down().remove().commit()
         self.__intf = None
         if self.__manager is not None:
             self.__manager.unregister(self)
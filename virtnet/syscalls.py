@@ -36,4 +36,12 @@ mount.errcheck = _raise_OSError
 
 MS_BIND = 4096
 MS_REC = 16384
+MS_PRIVATE = 1 << 18
 MS_SLAVE = 1 << 19
+
+setns = _LIBC.setns
+setns.argtypes = [ctypes.c_int, ctypes.c_int]
+setns.restype = ctypes.c_int
+setns.errcheck = _raise_OSError
+
+CLONE_NEWNET = 0x40000000
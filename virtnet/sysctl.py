@@ -0,0 +1,90 @@
+"""Sysctl module.
+
+This module reads and writes sysctls of network namespaces directly in /proc/sys. Files in
+/proc/sys/net belong to the network namespace of the opening thread, so this is done by the
+namespace worker (see Host.thread) instead of running the sysctl tool inside the host.
+
+Keys are given like for the sysctl tool, e.g. 'net.ipv4.ip_forward'. Use '/' as separator for
+keys containing dots, e.g. 'net/ipv4/conf/eth0.10/forwarding'.
+"""
+
+from typing import Any, Mapping, Union, Sequence, Dict
+import collections
+import os
+import threading
+
+PROC_SYS = '/proc/sys'
+
+# sysctls set in every newly created Host
+DEFAULTS = collections.OrderedDict() # type: Dict[str, Any]
+
+def _path(key: str) -> str:
+    if '/' not in key:
+        key = key.replace('.', '/')
+    return os.path.join(PROC_SYS, key)
+
+def _write(values: Mapping[str, Any]) -> None:
+    for key, value in values.items():
+        with open(_path(key), 'w') as sysctl:
+            sysctl.write(str(value))
+
+def _read(keys: Sequence[str]) -> 'collections.OrderedDict[str, str]':
+    ret = collections.OrderedDict()
+    for key in keys:
+        with open(_path(key)) as sysctl:
+            ret[key] = sysctl.read().strip()
+    return ret
+
+class Sysctl(object):
+    """Sysctls of a host.
+
+    Args:
+        host: Host, whose namespace thread is used.
+    """
+    __slots__ = ('__host',)
+
+    def __init__(self, host) -> None:
+        self.__host = host
+
+    def set(self, values: Mapping[str, Any]) -> None:
+        """Write all values (key: value) at once"""
+        self.__host.thread.call(_write, values)
+
+    def get(self, keys: Union[str, Sequence[str]]) -> Union[str, Mapping[str, str]]:
+        """Return the value of key, or an ordered mapping of values for a sequence of keys"""
+        if isinstance(keys, str):
+            return self.__host.thread.call(_read, [keys])[keys]
+        return self.__host.thread.call(_read, list(keys))
+
+    def __getitem__(self, key: str) -> str:
+        return self.get(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set({key: value})
+
+def set_many(values: Mapping[Any, Mapping[str, Any]]) -> None:
+    """Write sysctls of many hosts, queuing the writes of all hosts at once. The writes run one
+    after another on the namespace worker, which is shared by all hosts, but the caller waits
+    only once instead of once per host.
+
+    Args:
+        values: Mapping from Host to the values (key: value) to write.
+    """
+    lock = threading.Lock()
+    done = threading.Event()
+    pending = [len(values)]
+    errors = []
+    def callback(_, error):
+        with lock:
+            if error is not None:
+                errors.append(error)
+            pending[0] -= 1
+            if not pending[0]:
+                done.set()
+    if not values:
+        return
+    for host, host_values in values.items():
+        host.thread.submit(_write, host_values, callback=callback)
+    done.wait()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,329 @@
+"""Topology module.
+
+This module builds a whole topology from a declarative specification. A specification is a
+dictionary (which can be loaded from json or yaml) like::
+
+    {
+        "networks": {"lan": {"network": "192.168.0.0/24", "router": 1}},
+        "switches": {"sw": {"network": "lan"}},
+        "routers": {"router": {}},
+        "hosts": {"host0": {"hostnames": ["www"]}, "host1": {}},
+        "links": [
+            {"from": "router", "to": "sw", "name": "eth0"},
+            {"from": "host0", "to": "sw", "name": "eth0"},
+            {"from": "host1", "to": "sw", "name": "eth0", "route": "NONE"},
+            {"from": "host0", "to": "host1", "name": "eth1", "peername": "eth1",
+             "addresses": ["10.0.0.1/30"], "peer_addresses": ["10.0.0.2/30"]}
+        ]
+    }
+
+A switch may also draw from several networks, e.g. ``{"network": ["lan", "lan6"]}``.
+
+The specification is compiled into a Plan consisting of stages. The steps within a parallel stage
+are independent of each other and are executed concurrently.
+"""
+
+from typing import Dict, Any, List, Tuple, Union
+import collections
+import concurrent.futures
+import ipaddress
+import json
+import time
+from . container import RouteDirection
+from . host import Host, Router
+from . switch import Switch
+from . interface import VirtualLink
+from . address import Network
+from . context import Manager
+
+CONTAINERS = collections.OrderedDict([
+    ('hosts', Host),
+    ('routers', Router),
+    ('switches', Switch),
+])
+
+DEFAULT_WORKERS = 8
+
+def load_spec(path: str) -> Dict[str, Any]:
+    """Load a specification from a json or yaml file"""
+    with open(path) as specfile:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml # pylint: disable=import-error
+            return yaml.safe_load(specfile)
+        return json.load(specfile)
+
+def _switch_networks(spec: Dict[str, Any]) -> List[str]:
+    network = spec.get('network', [])
+    return [network] if isinstance(network, str) else list(network)
+
+def _normalize(spec: Dict[str, Any]) -> Dict[str, Any]:
+    ret = {'networks': dict(spec.get('networks', {})), 'links': collections.OrderedDict()}
+    names = set()
+    for kind in CONTAINERS:
+        ret[kind] = dict(spec.get(kind, {}))
+        for name in ret[kind]:
+            if name in names:
+                raise ValueError("Duplicate container name {}".format(name))
+            names.add(name)
+    for link in spec.get('links', []):
+        for end in ('from', 'to'):
+            if link[end] not in names:
+                raise ValueError("Link references unknown container {}".format(link[end]))
+        key = (link['from'], link['name'])
+        if key in ret['links']:
+            raise ValueError("Duplicate link {} on {}".format(link['name'], link['from']))
+        ret['links'][key] = link
+    for switch in ret['switches'].values():
+        for network in _switch_networks(switch):
+            if network not in ret['networks']:
+                raise ValueError("Switch references unknown network {}".format(network))
+    return ret
+
+Step = collections.namedtuple('Step', ['description', 'function'])
+
+class Stage(list):
+    """List of steps which can be executed in parallel, if parallel is True"""
+    def __init__(self, parallel: bool = True) -> None:
+        super().__init__()
+        self.parallel = parallel
+
+class Plan(object):
+    """Execution plan consisting of stages of steps"""
+    def __init__(self) -> None:
+        self.stages = [] # type: List[Stage]
+
+    def stage(self, parallel: bool = True) -> Stage:
+        """Start a new stage and return it"""
+        self.stages.append(Stage(parallel))
+        return self.stages[-1]
+
+    def __len__(self) -> int:
+        return sum(len(stage) for stage in self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def describe(self) -> List[List[str]]:
+        """Return the descriptions of all steps grouped by stage"""
+        return [[step.description for step in stage] for stage in self.stages if stage]
+
+    def execute(self, workers: int = DEFAULT_WORKERS) -> None:
+        """Execute the plan stage by stage, running the steps of parallel stages concurrently"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for stage in self.stages:
+                if not stage.parallel or len(stage) == 1 or workers == 1:
+                    for step in stage:
+                        step.function()
+                    continue
+                for future in [executor.submit(step.function) for step in stage]:
+                    future.result()
+
+class Topology(object):
+    """Topology built from a declarative specification.
+
+    Args:
+        spec: Specification of the topology. An empty topology is created if this is None.
+        workers: Number of parallel workers for building.
+
+    Attributes:
+        spec: The currently applied specification.
+        containers: Mapping of names to Hosts, Routers and Switches.
+        links: Mapping of (container name, interface name) to VirtualLinks.
+        networks: Mapping of names to Networks.
+    """
+    def __init__(self, spec: Union[Dict[str, Any], str] = None, workers: int = DEFAULT_WORKERS,
+                 manager: Manager = None) -> None:
+        self.__manager = manager
+        self.workers = workers
+        self.spec = _normalize({})
+        self.containers = {}
+        self.links = {}
+        self.networks = {}
+        if spec is not None:
+            self.apply(spec)
+
+    def __getitem__(self, name: str):
+        return self.containers[name]
+
+    def _create_network(self, name: str, spec: Dict[str, Any]) -> None:
+        self.networks[name] = Network(spec['network'], router=spec.get('router'),
+                                      manager=self.__manager)
+
+    def _remove_network(self, name: str) -> None:
+        network = self.networks.pop(name)
+        if self.__manager is not None:
+            self.__manager.unregister_network(network)
+
+    def _create_container(self, kind: str, name: str, spec: Dict[str, Any]) -> None:
+        if kind == 'switches':
+            networks = [self.networks[network] for network in _switch_networks(spec)]
+            obj = Switch(name, network=networks, manager=self.__manager)
+        else:
+            obj = CONTAINERS[kind](name, manager=self.__manager)
+            for hostname in spec.get('hostnames', []):
+                obj.add_hostname(hostname)
+        self.containers[name] = obj
+
+    def _create_link(self, key: Tuple[str, str], spec: Dict[str, Any]) -> None:
+        route = RouteDirection[spec.get('route', 'DEFAULT')]
+        local = self.containers[spec['from']]
+        remote = self.containers[spec['to']]
+        link = local.connect(VirtualLink, remote, spec['name'], spec.get('peername'), route=route,
+                             manager=self.__manager)
+        link.main.add_ips([ipaddress.ip_interface(address)
+                           for address in spec.get('addresses', [])])
+        link.peer.add_ips([ipaddress.ip_interface(address)
+                           for address in spec.get('peer_addresses', [])])
+        self.links[key] = link
+
+    def _create_links(self, links: List[Tuple[Tuple[str, str], Dict[str, Any]]]) -> None:
+        for key, spec in links:
+            self._create_link(key, spec)
+
+    def _remove_container(self, name: str) -> None:
+        obj = self.containers.pop(name)
+        if obj.running:
+            obj.stop()
+
+    def _remove_link(self, key: Tuple[str, str]) -> None:
+        link = self.links.pop(key)
+        for container, intf in zip(link.peers, (link.main, link.peer)):
+            container.detach_interface(intf.name)
+        if link.running:
+            link.stop()
+
+    def plan(self, spec: Union[Dict[str, Any], str]) -> Plan:
+        """Compute the plan for going from the current to the given specification"""
+        if isinstance(spec, str):
+            spec = load_spec(spec)
+        new = _normalize(spec)
+        old = self.spec
+        plan = Plan()
+
+        def changed(kind, name):
+            return name not in new[kind] or new[kind][name] != old[kind][name]
+
+        networks = {name for name in old['networks'] if changed('networks', name)}
+        removed = {}
+        for kind in CONTAINERS:
+            removed[kind] = {name for name in old[kind]
+                             if changed(kind, name) or
+                             (kind == 'switches' and
+                              networks.intersection(_switch_networks(old[kind][name])))}
+        removed_containers = set().union(*removed.values())
+        removed_links = {key for key, link in old['links'].items()
+                         if key not in new['links'] or new['links'][key] != link
+                         or link['from'] in removed_containers or link['to'] in removed_containers}
+
+        stage = plan.stage()
+        for key in removed_links:
+            stage.append(Step("remove link {} of {}".format(key[1], key[0]),
+                              lambda key=key: self._remove_link(key)))
+        stage = plan.stage()
+        for name in removed_containers:
+            stage.append(Step("remove {}".format(name),
+                              lambda name=name: self._remove_container(name)))
+        for name in networks:
+            stage.append(Step("remove network {}".format(name),
+                              lambda name=name: self._remove_network(name)))
+
+        stage = plan.stage()
+        for name, network in new['networks'].items():
+            if name not in old['networks'] or name in networks:
+                stage.append(Step("create network {}".format(name),
+                                  lambda name=name, network=network:
+                                  self._create_network(name, network)))
+        for kind in CONTAINERS:
+            stage = plan.stage()
+            for name, container in new[kind].items():
+                if name not in old[kind] or name in removed[kind]:
+                    stage.append(Step("create {} {}".format(CONTAINERS[kind].__name__.lower(), name),
+                                      lambda kind=kind, name=name, container=container:
+                                      self._create_container(kind, name, container)))
+        # generated peer names depend on the number of interfaces of the local container, so
+        # links without a peername are created after all others, in order per local container
+        stage = plan.stage()
+        generated = collections.OrderedDict()
+        for key, link in new['links'].items():
+            if key not in old['links'] or key in removed_links:
+                if 'peername' in link:
+                    stage.append(Step("create link {} of {}".format(key[1], key[0]),
+                                      lambda key=key, link=link: self._create_link(key, link)))
+                else:
+                    generated.setdefault(link['from'], []).append((key, link))
+        targets = {link['to'] for links in generated.values() for _, link in links}
+        # containers with generated names on both ends would depend on the order of execution
+        stage = plan.stage(parallel=not targets.intersection(generated))
+        for name, links in generated.items():
+            stage.append(Step("create links {} of {}".format(
+                ", ".join(key[1] for key, _ in links), name),
+                              lambda links=links: self._create_links(links)))
+        return plan
+
+    def _applied(self, old: Dict[str, Any], new: Dict[str, Any], before) -> Dict[str, Any]:
+        # specification of what exists after going from old to new stopped part way: objects
+        # still the same as before are described by old, objects created since by new
+        networks, containers, links = before
+        ret = {'networks': {}, 'links': collections.OrderedDict()}
+        for kind in CONTAINERS:
+            ret[kind] = {}
+        for name, network in self.networks.items():
+            source = old if network is networks.get(name) else new
+            ret['networks'][name] = source['networks'][name]
+        for name, container in self.containers.items():
+            source = old if container is containers.get(name) else new
+            kind = next(kind for kind in CONTAINERS if name in source[kind])
+            ret[kind][name] = source[kind][name]
+        for key, link in self.links.items():
+            source = old if link is links.get(key) else new
+            ret['links'][key] = source['links'][key]
+        return ret
+
+    def apply(self, spec: Union[Dict[str, Any], str]) -> Plan:
+        """Bring the running topology to the given specification, touching only what changed.
+        If a step fails, spec describes what was done until then, so applying again continues.
+
+        Returns:
+            The executed Plan.
+        """
+        if isinstance(spec, str):
+            spec = load_spec(spec)
+        plan = self.plan(spec)
+        before = (dict(self.networks), dict(self.containers), dict(self.links))
+        start = time.monotonic()
+        try:
+            plan.execute(self.workers)
+        except:
+            # keep what was done, so applying again continues from there
+            self.spec = self._applied(self.spec, _normalize(spec), before)
+            raise
+        if self.__manager is not None:
+            self.__manager.record('topology_apply', time.monotonic() - start)
+            if self.__manager.accounting is not None:
+                self.__manager.accounting.sync()
+        self.spec = _normalize(spec)
+        return plan
+
+    def adopt(self, spec: Union[Dict[str, Any], str], containers: Dict[str, Any]) -> None:
+        """Take running containers (e.g. attached from a manifest) as the current state of spec
+        without creating anything. Links are found through the interfaces of the containers.
+        Networks not used by any switch are created."""
+        if isinstance(spec, str):
+            spec = load_spec(spec)
+        spec = _normalize(spec)
+        for kind in CONTAINERS:
+            for name in spec[kind]:
+                self.containers[name] = containers[name]
+        for name, switch in spec['switches'].items():
+            for network, obj in zip(_switch_networks(switch), containers[name].networks):
+                self.networks[network] = obj
+        for name, network in spec['networks'].items():
+            if name not in self.networks:
+                self._create_network(name, network)
+        for key in spec['links']:
+            self.links[key] = containers[key[0]].interfaces[key[1]].parent
+        self.spec = spec
+
+    def stop(self) -> None:
+        """Remove everything created by this topology"""
+        self.apply({})